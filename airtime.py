@@ -0,0 +1,153 @@
+"""
+Airtime Estimates for Meshtastic Monitor
+
+The radio only tells us the local node's channelUtilization.  This works out
+how long each packet we hear was on the air (LoRa time-on-air for the modem
+settings in NodeConfig.get_lora_config and the packet's size) and adds it up
+per sending node and per port over sliding windows, so you can see who and
+what is using the channel.
+
+Every copy we hear counts, rebroadcasts included: each one was a separate
+transmission.  They're charged to the node that originated the packet.
+"""
+
+import math
+import threading
+import time
+
+from config import Config
+from nodeconfig import NodeConfig
+from rates import WINDOWS, RateCounter
+
+# Meshtastic's modem presets: bandwidth (kHz), spreading factor, coding rate (4/x)
+PRESETS = {
+    'LONG_FAST': (250, 11, 5),
+    'LONG_SLOW': (125, 12, 8),
+    'VERY_LONG_SLOW': (62.5, 12, 8),
+    'MEDIUM_SLOW': (250, 10, 5),
+    'MEDIUM_FAST': (250, 9, 5),
+    'SHORT_SLOW': (250, 8, 5),
+    'SHORT_FAST': (250, 7, 5),
+    'LONG_MODERATE': (125, 11, 8),
+    'SHORT_TURBO': (500, 7, 5),
+}
+PREAMBLE_SYMBOLS = 16   # Meshtastic uses a longer preamble than the LoRa default of 8
+HEADER_BYTES = 16       # Meshtastic's own packet header, sent ahead of the (encrypted) payload
+DATA_OVERHEAD = 6       # Protobuf framing around a decoded payload (port number, length)
+
+
+def time_on_air(size, bandwidth, spread_factor, coding_rate):
+    """
+    Seconds a LoRa packet is on the air (explicit header, CRC on), per the Semtech formula
+
+    :param size: bytes of payload handed to the radio
+    :param bandwidth: kHz
+    :param coding_rate: the x in 4/x
+    """
+    symbol = (2 ** spread_factor) / (bandwidth * 1000)
+    low_data_rate = 1 if symbol > 0.016 else 0
+    payload_symbols = 8 + max(
+        math.ceil((8 * size - 4 * spread_factor + 28 + 16) / (4 * (spread_factor - 2 * low_data_rate)))
+        * coding_rate, 0)
+    return (PREAMBLE_SYMBOLS + 4.25 + payload_symbols) * symbol
+
+
+def packet_size(packet):
+    """Bytes a received packet took on the air"""
+    raw = packet.get('raw')
+    if raw is not None:
+        try:
+            if raw.WhichOneof('payload_variant') == 'encrypted':
+                return HEADER_BYTES + len(raw.encrypted)
+            return HEADER_BYTES + raw.decoded.ByteSize()
+        except Exception:
+            pass
+    payload = packet.get('decoded', {}).get('payload')
+    if isinstance(payload, (bytes, bytearray)):
+        return HEADER_BYTES + DATA_OVERHEAD + len(payload)
+    encrypted = packet.get('encrypted')
+    if isinstance(encrypted, str):
+        return HEADER_BYTES + len(encrypted) * 3 // 4   # base64
+    return HEADER_BYTES + DATA_OVERHEAD
+
+
+class Airtime:
+    """Singleton accumulating estimated airtime by node and by port"""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(Airtime, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        self.refresh_interval = Config().get('airtime.refresh_interval', 300)
+        self.lock = threading.Lock()
+        self.modem = None
+        self.modem_read_at = 0
+        self.total = RateCounter()
+        self.groups = {'nodes': {}, 'ports': {}}
+        self._initialized = True
+
+    def get_modem(self):
+        """(bandwidth, spread factor, coding rate) the radio is set to, re-read every so often"""
+        now = time.time()
+        if self.modem is None or now - self.modem_read_at > self.refresh_interval:
+            self.modem_read_at = now
+            result = NodeConfig().get_lora_config()
+            if result['success']:
+                lora = result['config']
+                custom = (lora['bandwidth'], lora['spread_factor'], lora['coding_rate'])
+                if lora['use_preset'] or not all(custom):
+                    self.modem = PRESETS.get(lora['modem_preset_name'], PRESETS['LONG_FAST'])
+                else:
+                    self.modem = custom
+            elif self.modem is None:
+                self.modem = PRESETS['LONG_FAST']
+        return self.modem
+
+    def estimate(self, size):
+        """Seconds on air for a packet of `size` bytes with the radio's current settings"""
+        return time_on_air(size, *self.get_modem())
+
+    def add_packet(self, packet, node_id, port, now=None):
+        now = now or time.time()
+        seconds = self.estimate(packet_size(packet))
+        with self.lock:
+            self.total.add(now, seconds)
+            for group, key in (('nodes', node_id), ('ports', port)):
+                counter = self.groups[group].get(key)
+                if counter is None:
+                    counter = self.groups[group][key] = RateCounter()
+                counter.add(now, seconds)
+        return seconds
+
+    def get_airtime(self, top=20):
+        """Seconds on air per window, overall, by port and for the `top` nodes using the most"""
+        now = time.time()
+        with self.lock:
+            total = {name: round(value, 3) for name, value in self.total.get(now).items()}
+            result = {
+                'windows': list(WINDOWS),
+                'modem': dict(zip(('bandwidth', 'spread_factor', 'coding_rate'), self.modem or ())),
+                'total': total,
+                # Share of each window the channel was busy with packets we heard
+                'utilization': {name: round(100 * total[name] / WINDOWS[name][0], 2) for name in WINDOWS}
+            }
+            for group, counters in self.groups.items():
+                values = {key: {name: round(value, 3) for name, value in counter.get(now).items()}
+                          for key, counter in counters.items()}
+                for key in [key for key, seconds in values.items() if not seconds['1h']]:
+                    del counters[key]
+                    del values[key]
+                result[group] = dict(sorted(values.items(), key=lambda item: item[1]['15m'], reverse=True))
+
+            result['nodes'] = dict(list(result['nodes'].items())[:top])
+            return result
+
+
+__all__ = ['Airtime', 'time_on_air']
@@ -0,0 +1,159 @@
+"""
+Anomaly Detection for Meshtastic Monitor
+
+Watches each node's packet rate as packets arrive and flags nodes that are
+flooding the mesh, so one misconfigured node can't push everyone else out of
+the (limited) packet history.
+
+Two checks, both constant time per packet:
+  * a token bucket per node: a sustained rate above anomaly.rate packets a
+    minute (after a burst allowance) empties it
+  * an EWMA baseline of each node's packets per minute: a minute well above
+    the node's own normal (anomaly.spike_factor times) is a spike
+
+When anomaly.throttle is on, packets from a node whose bucket is empty still
+count everywhere else, but don't get a row in the packet table; how many were
+held back is kept per node.
+"""
+
+import threading
+import time
+
+from config import Config
+
+
+class Anomalies:
+    """Singleton tracking per-node packet rates"""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(Anomalies, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        self.lock = threading.Lock()
+        self.nodes = {}             # node id -> state, see _node()
+        self.suppressed = 0
+        self.apply_config(Config())
+        Config().subscribe(self.apply_config)
+        self._initialized = True
+
+    def apply_config(self, config):
+        self.enabled = config.get('anomaly.enabled', True)
+        self.throttle = config.get('anomaly.throttle', False)
+        self.rate = config.get('anomaly.rate', 10) / 60     # tokens per second
+        self.burst = config.get('anomaly.burst', 30)
+        self.spike_factor = config.get('anomaly.spike_factor', 5)
+        self.min_spike = config.get('anomaly.min_spike', 5)  # packets in a minute before it can be a spike
+
+    def _node(self, node_id, now):
+        state = self.nodes.get(node_id)
+        if state is None:
+            state = self.nodes[node_id] = {
+                'tokens': self.burst,
+                'refilled': now,
+                'minute': int(now // 60),
+                'minute_count': 0,
+                'baseline': None,       # EWMA of packets per minute
+                'flagged': None,        # why, if the node is misbehaving right now
+                'flagged_since': None,
+                'last_seen': now,
+                'packets': 0,
+                'suppressed': 0,
+                'ports': {}             # packets per port while flagged
+            }
+        return state
+
+    def _roll_minute(self, state, minute):
+        # Fold finished minutes into the baseline; minutes with no packets count as zero
+        elapsed = minute - state['minute']
+        if elapsed <= 0:
+            return
+        count = state['minute_count']
+        if state['baseline'] is None:
+            state['baseline'] = float(count)
+        else:
+            state['baseline'] = 0.8 * state['baseline'] + 0.2 * count
+        if elapsed > 1:
+            state['baseline'] *= 0.8 ** min(elapsed - 1, 60)
+        state['minute'] = minute
+        state['minute_count'] = 0
+
+    def check(self, node_id, port, now=None):
+        """
+        Account for a packet from node_id
+
+        :return: True if the packet should be kept out of the packet table
+        """
+        if not self.enabled:
+            return False
+        now = now or time.time()
+        with self.lock:
+            state = self._node(node_id, now)
+            self._roll_minute(state, int(now // 60))
+            state['minute_count'] += 1
+            state['packets'] += 1
+            state['last_seen'] = now
+
+            state['tokens'] = min(self.burst, state['tokens'] + (now - state['refilled']) * self.rate)
+            state['refilled'] = now
+            flooding = state['tokens'] < 1
+            if not flooding:
+                state['tokens'] -= 1
+
+            baseline = state['baseline']
+            spiking = (baseline is not None and state['minute_count'] >= self.min_spike
+                       and state['minute_count'] > self.spike_factor * max(baseline, 1))
+
+            if flooding or spiking:
+                reason = 'rate' if flooding else 'spike'
+                if state['flagged'] is None:
+                    state['flagged_since'] = now
+                    state['ports'] = {}
+                    print(f'Anomaly: {node_id} flagged ({reason}), {state["packets"]} packets so far', flush=True)
+                state['flagged'] = reason
+                state['ports'][port] = state['ports'].get(port, 0) + 1
+            elif state['tokens'] >= self.burst / 2:
+                # Calmed down: half the burst allowance is back
+                state['flagged'] = None
+                state['flagged_since'] = None
+
+            if flooding and self.throttle:
+                state['suppressed'] += 1
+                self.suppressed += 1
+                return True
+            return False
+
+    def get_anomalies(self):
+        """Nodes flagged now, plus anyone we've suppressed packets from"""
+        now = time.time()
+        with self.lock:
+            # Forget nodes we haven't heard from in an hour
+            for node_id in [node_id for node_id, state in self.nodes.items() if now - state['last_seen'] > 3600]:
+                del self.nodes[node_id]
+
+            nodes = []
+            for node_id, state in self.nodes.items():
+                if state['flagged'] is None and not state['suppressed']:
+                    continue
+                nodes.append({
+                    'node': node_id,
+                    'reason': state['flagged'],
+                    'since': state['flagged_since'],
+                    'last_seen': state['last_seen'],
+                    'last_minute': state['minute_count'] if state['minute'] == int(now // 60) else 0,
+                    'baseline': None if state['baseline'] is None else round(state['baseline'], 2),
+                    'packets': state['packets'],
+                    'suppressed': state['suppressed'],
+                    'ports': state['ports']
+                })
+            nodes.sort(key=lambda node: (node['reason'] is not None, node['last_minute']), reverse=True)
+            return {'throttle': self.throttle, 'suppressed': self.suppressed, 'nodes': nodes}
+
+
+__all__ = ['Anomalies']
@@ -0,0 +1,307 @@
+"""
+Packet Archive for Meshtastic Monitor
+
+The live packet table only holds the newest data.max_packets rows.  The archive
+keeps a few numbers about every packet for as long as you like, for looking at
+months of RSSI, hops and traffic mix.
+
+It's columnar: one directory per day (archive/2026-10-19/), holding a file per
+field in FIELDS of plain little-endian values, plus meta.json with the row count
+and the string table the port column's codes index.  Packets are buffered in
+memory and a background thread appends them every archive.flush_interval
+seconds; meta.json is written last, so a reader (or a restart after a crash)
+never sees a partly written row.
+
+Queries memory-map the column files and aggregate with NumPy a day at a time,
+so a year of packets never turns into Python objects.  Anyone can read the
+archive, so in split mode the web worker answers queries straight from disk.
+NumPy is slow to import, so it's only imported when first needed.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from airtime import packet_size
+from config import Config
+
+VERSION = 1
+
+# Column -> dtype.  port is a code into the partition's string table, hops is -1 and rssi / snr NaN when unknown
+FIELDS = {
+    'time': '<f8',
+    'from': '<u4',
+    'port': '<u2',
+    'hops': 'i1',
+    'rssi': '<f4',
+    'snr': '<f4',
+    'size': '<u2'
+}
+
+RSSI_RANGE = (-150, 0)      # dBm covered by the 1 dB histogram bins for the RSSI percentiles
+MAX_BUCKETS = 10000
+NAN = float('nan')
+
+
+class Partition:
+    """One day's column files"""
+
+    def __init__(self, path):
+        self.path = path
+        self.meta = {'version': VERSION, 'rows': 0, 'strings': []}
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+
+    @property
+    def rows(self):
+        return self.meta['rows']
+
+    def column(self, name):
+        """The column, memory-mapped (read only)"""
+        import numpy as np
+        if not self.rows:
+            return np.empty(0, dtype=FIELDS[name])
+        return np.memmap(os.path.join(self.path, name), dtype=FIELDS[name], mode='r', shape=(self.rows,))
+
+    def append(self, columns, strings):
+        """
+        Add rows to the partition
+
+        :param columns: {field: array}, all the same length
+        :param strings: the strings the port codes in columns refer to (a superset of the current table)
+        """
+        import numpy as np
+        os.makedirs(self.path, exist_ok=True)
+        for name, dtype in FIELDS.items():
+            path = os.path.join(self.path, name)
+            with open(path, 'ab') as f:
+                # Anything past the row count is from a write that never finished
+                f.truncate(self.rows * np.dtype(dtype).itemsize)
+                f.write(np.asarray(columns[name], dtype=dtype).tobytes())
+        meta = dict(self.meta, version=VERSION, rows=self.rows + len(columns['time']), strings=strings)
+        temp = os.path.join(self.path, 'meta.json.tmp')
+        with open(temp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp, os.path.join(self.path, 'meta.json'))
+        self.meta = meta
+
+
+def _day(when):
+    return datetime.fromtimestamp(when).strftime('%Y-%m-%d')
+
+
+def _number(value, default):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class Archive:
+    """Singleton that buffers packets and appends them to the day's partition"""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(Archive, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        self.lock = threading.Lock()           # Guards pending
+        self.write_lock = threading.Lock()     # One flush at a time: each appends after the row count it read
+        self.pending = []           # (time, from, port, hops, rssi, snr, size)
+        self.thread = None
+        self.apply_config(Config())
+        Config().subscribe(self.apply_config)
+        atexit.register(self.flush)
+        self._initialized = True
+
+    def apply_config(self, config):
+        self.enabled = config.get('archive.enabled', True)
+        self.path = config.get('archive.path', 'archive')
+        self.flush_interval = config.get('archive.flush_interval', 60)
+        self.keep_days = config.get('archive.keep_days', 365)
+
+    def add_packet(self, packet, port, hops, now=None):
+        if not self.enabled:
+            return
+        row = (now or time.time(), packet.get('from', 0), port, hops,
+               _number(packet.get('rxRssi'), NAN), _number(packet.get('rxSnr'), NAN),
+               min(packet_size(packet), 65535))
+        with self.lock:
+            self.pending.append(row)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._roll_loop, daemon=True)
+                self.thread.start()
+
+    def _roll_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+                self.prune()
+            except Exception as e:
+                print(f'Archive error: {e}', flush=True)
+
+    def flush(self):
+        """Append everything buffered to its day's partition; returns how many rows were written"""
+        with self.write_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+            days = {}
+            for row in pending:
+                days.setdefault(_day(row[0]), []).append(row)
+            written = 0
+            try:
+                for day, rows in days.items():
+                    self._append(day, rows)
+                    written += len(rows)
+            except Exception:
+                # Keep what didn't make it to disk for the next flush
+                unwritten = [row for rows in days.values() for row in rows][written:]
+                with self.lock:
+                    self.pending[:0] = unwritten
+                raise
+            return written
+
+    def _append(self, day, rows):
+        partition = Partition(os.path.join(self.path, day))
+        strings = list(partition.meta['strings'])
+        codes = {name: code for code, name in enumerate(strings)}
+        for row in rows:
+            if row[2] not in codes:
+                codes[row[2]] = len(strings)
+                strings.append(row[2])
+        times, froms, ports, hops, rssi, snr, size = zip(*rows)
+        partition.append({'time': times, 'from': froms, 'port': [codes[port] for port in ports],
+                          'hops': hops, 'rssi': rssi, 'snr': snr, 'size': size}, strings)
+
+    def prune(self):
+        """Remove partitions older than archive.keep_days (0 keeps everything)"""
+        if not self.keep_days:
+            return
+        oldest = _day(time.time() - self.keep_days * 86400)
+        for day in self.days():
+            if day < oldest:
+                partition = os.path.join(self.path, day)
+                for name in os.listdir(partition):
+                    os.remove(os.path.join(partition, name))
+                os.rmdir(partition)
+
+    def days(self, since=None, until=None):
+        """Partition names (dates), oldest first, overlapping [since, until)"""
+        if not os.path.isdir(self.path):
+            return []
+        first = _day(since) if since else ''
+        last = _day(until) if until else '9999'
+        return sorted(day for day in os.listdir(self.path)
+                      if len(day) == 10 and first <= day <= last and os.path.isdir(os.path.join(self.path, day)))
+
+    def aggregate(self, since=None, until=None, node=None, port=None, bucket=86400):
+        """
+        Packet counts, RSSI / SNR / hops and traffic mix over [since, until) (epoch seconds)
+
+        :param node: only packets from this node id (!a1b2c3d4)
+        :param port: only this port, e.g. POSITION_APP
+        :param bucket: seconds per entry in the time series, buckets starting at since
+                       (or the first archived day)
+        """
+        import numpy as np
+        days = self.days(since, until)
+        until = until or time.time()
+        if since is None:
+            since = datetime.strptime(days[0], '%Y-%m-%d').timestamp() if days else until
+        if bucket <= 0:
+            raise ValueError('bucket must be positive')
+        buckets = max(int(np.ceil((until - since) / bucket)), 1)
+        if buckets > MAX_BUCKETS:
+            raise ValueError(f'{buckets} buckets is too many, use a larger bucket')
+        node_num = int(node.lstrip('!'), 16) if node else None
+
+        packets = np.zeros(buckets, dtype=np.int64)
+        totals = {name: np.zeros(buckets) for name in ('rssi', 'snr', 'hops')}
+        counts = {name: np.zeros(buckets, dtype=np.int64) for name in ('rssi', 'snr', 'hops')}
+        rssi_bins = np.arange(RSSI_RANGE[0], RSSI_RANGE[1] + 1)
+        rssi_histogram = np.zeros(len(rssi_bins) - 1, dtype=np.int64)
+        hop_counts = np.zeros(128, dtype=np.int64)
+        ports, nodes = {}, {}
+        size = 0
+
+        for day in days:
+            partition = Partition(os.path.join(self.path, day))
+            if not partition.rows:
+                continue
+            strings = partition.meta['strings']
+            times = partition.column('time')
+            mask = (times >= since) & (times < until)
+            if node_num is not None:
+                mask &= partition.column('from') == node_num
+            if port is not None:
+                if port not in strings:
+                    continue
+                mask &= partition.column('port') == strings.index(port)
+            if not mask.any():
+                continue
+
+            index = ((times[mask] - since) // bucket).astype(np.int64)
+            packets += np.bincount(index, minlength=buckets)
+            for name in ('rssi', 'snr', 'hops'):
+                values = partition.column(name)[mask]
+                valid = values >= 0 if name == 'hops' else ~np.isnan(values)
+                totals[name] += np.bincount(index[valid], weights=values[valid], minlength=buckets)
+                counts[name] += np.bincount(index[valid], minlength=buckets)
+                if name == 'rssi':
+                    rssi_histogram += np.histogram(values[valid], bins=rssi_bins)[0]
+                elif name == 'hops':
+                    hop_counts += np.bincount(values[valid].astype(np.int64), minlength=128)[:128]
+
+            for code, count in enumerate(np.bincount(partition.column('port')[mask], minlength=len(strings))):
+                if count:
+                    ports[strings[code]] = ports.get(strings[code], 0) + int(count)
+            senders, sent = np.unique(partition.column('from')[mask], return_counts=True)
+            for sender, count in zip(senders.tolist(), sent.tolist()):
+                nodes[sender] = nodes.get(sender, 0) + count
+            size += int(partition.column('size')[mask].sum(dtype=np.int64))
+
+        def means(name):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = np.round(totals[name] / counts[name], 2)
+            return [None if np.isnan(value) else float(value) for value in values]
+
+        def rssi_percentile(p):
+            if not rssi_histogram.sum():
+                return None
+            cumulative = np.cumsum(rssi_histogram)
+            return int(rssi_bins[np.searchsorted(cumulative, p / 100 * cumulative[-1])])
+
+        busiest = sorted(nodes.items(), key=lambda item: item[1], reverse=True)[:20]
+        return {
+            'since': since,
+            'until': until,
+            'bucket': bucket,
+            'packets': int(packets.sum()),
+            'bytes': size,
+            'series': {
+                'start': [since + i * bucket for i in range(buckets)],
+                'packets': packets.tolist(),
+                'rssi': means('rssi'),
+                'snr': means('snr'),
+                'hops': means('hops')
+            },
+            'rssi_percentiles': {p: rssi_percentile(p) for p in (10, 50, 90)},
+            'hops': {hops: int(count) for hops, count in enumerate(hop_counts) if count},
+            'ports': dict(sorted(ports.items(), key=lambda item: item[1], reverse=True)),
+            'nodes': {f'!{sender:08x}': count for sender, count in busiest}
+        }
+
+
+__all__ = ['Archive', 'Partition', 'FIELDS']
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Backfill history from packetlog.txt
+
+    python backfill.py packetlog.txt                   # into an empty history
+    python backfill.py old/packetlog.txt packetlog.txt --replace --local !a1b2c3d4
+    python backfill.py packetlog.txt --replace --workers 8
+    python backfill.py packetlog.txt --replace --archive  # also fill in the long-term archive
+
+Reads old packet logs back into the packet and message history (persisted_data.snap),
+so history survives a lost or reset data file.  Run it while the program is stopped:
+both write persisted_data.snap.
+
+The history is always rebuilt from the logs alone (--replace if there is one).  The
+stores rely on rows arriving in time order, for expiry, the row limits and since /
+until queries, and logged packets can't be told apart from rows already saved, so
+adding old logs to an existing history would put old rows after new ones and
+duplicate any overlap.  Give every log you want in the history, oldest first.
+
+The logs are split into byte ranges that are parsed in a pool of processes; parsing
+is the slow part.  The parsed packets then go, in file order, through the same
+Message handling as live packets, in replay mode: nothing is logged again and the
+radio isn't asked anything.  Node names come from the NODEINFO packets seen so far
+in the logs, and --local says which node was ours (for DMs it sent).
+
+Only the newest data.max_packets / data.max_messages rows are kept, and rows older
+than their [retention] are dropped the next time the program expires rows.
+With --archive the packets are also added to the packet archive (see archive.py),
+which keeps them all; load each log into the archive only once.
+"""
+
+import argparse
+import ast
+import os
+import sys
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNK_SIZE = 8 * 1024 * 1024
+MAX_FAILURES = 5        # Packets that failed to replay shown at the end, with their tracebacks
+DATE_LENGTH = len('2000-01-01 00:00:00')
+
+
+def strip_raw(text):
+    """
+    Drop the 'raw': values from a logged packet
+
+    They're protobuf text rather than Python literals, so literal_eval can't read
+    them; they run until the next ', ' or '}' outside braces and quoted strings.
+    """
+    parts = []
+    start = 0
+    while True:
+        found = text.find("'raw': ", start)
+        if found < 0:
+            parts.append(text[start:])
+            return ''.join(parts)
+        parts.append(text[start:found])
+        i = found + len("'raw': ")
+        depth = 0
+        quoted = False
+        while i < len(text):
+            c = text[i]
+            if quoted:
+                if c == '\\':
+                    i += 1
+                elif c == '"':
+                    quoted = False
+            elif c == '"':
+                quoted = True
+            elif c == '{':
+                depth += 1
+            elif c == '}':
+                if depth == 0:
+                    break
+                depth -= 1
+            elif c == ',' and depth == 0 and text.startswith(", '", i):
+                i += 2
+                break
+            i += 1
+        start = i
+        # Don't leave a dangling ', ' before a closing brace
+        if text.startswith('}', start) and parts[-1].endswith(', '):
+            parts[-1] = parts[-1][:-2]
+
+
+def parse_line(line):
+    """
+    One line of packetlog.txt
+
+    :return: (when it was logged, packet dict), or None for lines that aren't packets
+    :raises ValueError: for packet lines that can't be read
+    """
+    if len(line) <= DATE_LENGTH + 1 or line[DATE_LENGTH:DATE_LENGTH + 2] != ':{':
+        return None     # Initialized / Restarted / error lines
+    try:
+        packet = ast.literal_eval(strip_raw(line[DATE_LENGTH + 1:].rstrip('\n')))
+    except (ValueError, SyntaxError, MemoryError, RecursionError) as e:
+        raise ValueError(f'{type(e).__name__}: {e}') from None
+    if not isinstance(packet, dict) or 'from' not in packet:
+        raise ValueError('not a packet')
+    return line[:DATE_LENGTH], packet
+
+
+def parse_chunk(path, start, end):
+    """
+    Parse the lines that start in [start, end) of a file (runs in a worker process)
+
+    :return: {'bytes', 'lines', 'packets': [(logged, packet, path@offset), ...], 'errors', 'samples'}
+    """
+    result = {'bytes': end - start, 'lines': 0, 'packets': [], 'errors': 0, 'samples': []}
+    with open(path, 'rb') as f:
+        if start:
+            # Whatever line straddles the start belongs to the previous chunk
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        while position < end:
+            raw = f.readline()
+            if not raw:
+                break
+            where = f'{path}@{position}'
+            position += len(raw)
+            result['lines'] += 1
+            line = raw.decode('utf-8', errors='replace')
+            try:
+                parsed = parse_line(line)
+            except ValueError as e:
+                result['errors'] += 1
+                if len(result['samples']) < 3:
+                    result['samples'].append(f'{where}: {e}')
+                continue
+            if parsed is not None:
+                result['packets'].append(parsed + (where,))
+    return result
+
+
+def chunks(paths, chunk_size):
+    """(path, start, end) byte ranges covering every file, in order"""
+    for path in paths:
+        size = os.path.getsize(path)
+        for start in range(0, size, chunk_size):
+            yield path, start, min(start + chunk_size, size)
+
+
+def parse_files(paths, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Parse the files in a process pool, yielding each chunk's result in file order
+
+    Only a few chunks per worker are in flight at once, so memory use doesn't
+    depend on the size of the logs.
+    """
+    workers = workers or os.cpu_count() or 1
+    ranges = chunks(paths, chunk_size)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for _ in range(2 * workers):
+            spec = next(ranges, None)
+            if spec is None:
+                break
+            pending.append(pool.submit(parse_chunk, *spec))
+        while pending:
+            result = pending.popleft().result()
+            spec = next(ranges, None)
+            if spec is not None:
+                pending.append(pool.submit(parse_chunk, *spec))
+            yield result
+
+
+def replay(packets, nodes, local=None, archive=False, failures=None):
+    """
+    Handle parsed packets as if they'd just been received
+
+    :param nodes: {node id: node}, updated from NODEINFO packets as they go by
+    :param failures: list the first MAX_FAILURES failures are added to, as (path@offset, traceback)
+    :return: how many packets failed
+    """
+    from message import Message
+    failed = 0
+    for logged, packet, where in packets:
+        try:
+            Message(None, packet, {'nodes': nodes, 'local': local, 'received': logged,
+                                   'archive': archive}).handle_message()
+        except Exception:
+            failed += 1
+            if failures is not None and len(failures) < MAX_FAILURES:
+                failures.append((where, traceback.format_exc()))
+            continue
+        user = packet.get('decoded', {}).get('user')
+        if isinstance(user, dict) and user.get('longName'):
+            nodes[f'!{packet["from"]:08x}'] = {'user.longName': user['longName']}
+    return failed
+
+
+def backfill(paths, workers=None, chunk_size=CHUNK_SIZE, local=None, replace=False, archive=False):
+    """Load the logs into Status, printing progress as it goes; returns the totals"""
+    from status import Status
+    status = Status()
+    if replace:
+        status.clear()
+
+    total_bytes = sum(os.path.getsize(path) for path in paths)
+    totals = {'bytes': 0, 'lines': 0, 'packets': 0, 'errors': 0, 'failed': 0}
+    failures = []
+    nodes = {}
+    started = time.time()
+    status.batch_mode = True
+    try:
+        for result in parse_files(paths, workers, chunk_size):
+            totals['failed'] += replay(result['packets'], nodes, local, archive, failures)
+            if archive:
+                from archive import Archive
+                Archive().flush()
+            for key in ('bytes', 'lines', 'errors'):
+                totals[key] += result[key]
+            totals['packets'] += len(result['packets'])
+            for sample in result['samples']:
+                print(f'Unreadable line {sample}', flush=True)
+
+            elapsed = max(time.time() - started, 1e-6)
+            print(f'{100 * totals["bytes"] / max(total_bytes, 1):5.1f}%  {totals["lines"]} lines, '
+                  f'{totals["packets"]} packets, {totals["errors"]} unreadable  '
+                  f'({totals["lines"] / elapsed:.0f} lines/s, {totals["bytes"] / elapsed / 1e6:.1f} MB/s)', flush=True)
+    finally:
+        status.batch_mode = False
+        status.persist(force=True)
+    for where, trace in failures:
+        print(f'\nPacket at {where} failed:\n{trace}', end='', flush=True)
+    if totals['failed'] > len(failures):
+        print(f'\n... and {totals["failed"] - len(failures)} more', flush=True)
+    totals['seconds'] = round(time.time() - started, 1)
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load packetlog.txt files back into the packet and message history')
+    parser.add_argument('logs', nargs='+', help='Log files, oldest first')
+    parser.add_argument('--workers', type=int, help='Parsing processes (default: one per CPU)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE // (1024 * 1024), metavar='MB',
+                        help='Bytes of log each worker parses at a time')
+    parser.add_argument('--local', help='Our own node id, e.g. !a1b2c3d4, so DMs we sent are threaded right')
+    parser.add_argument('--archive', action='store_true', help='Also add the packets to the long-term archive')
+    parser.add_argument('--replace', action='store_true', help='Throw away the existing history first')
+    args = parser.parse_args(argv)
+
+    for path in args.logs:
+        if not os.path.isfile(path):
+            parser.error(f'{path} not found')
+
+    from config import Config
+    if not Config().get('data.persist_data'):
+        parser.error('data.persist_data is off in config.toml, there would be nowhere to put the history')
+    from status import SNAPSHOT_FILE, LEGACY_FILE
+    existing = [path for path in (SNAPSHOT_FILE, LEGACY_FILE) if os.path.exists(path)]
+    if existing and not args.replace:
+        parser.error(f'{existing[0]} already has history: use --replace to rebuild it from the logs '
+                     f'(include the logs it came from, oldest first)')
+
+    local = int(args.local.lstrip('!'), 16) if args.local else None
+    totals = backfill(args.logs, args.workers, args.chunk_size * 1024 * 1024, local, args.replace,
+                      args.archive)
+    print(f'Done in {totals["seconds"]}s: {totals["packets"]} packets from {totals["lines"]} lines, '
+          f'{totals["errors"]} unreadable lines, {totals["failed"]} packets failed', flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,20 @@
 import tomllib
 import logging
+import os
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# Cached marker for keys that aren't in the file (so a miss is as cheap as a hit)
+_MISSING = object()
+
 class Config:
     _instance = None
 
+    # Seconds between repeated "not found" warnings for the same key
+    miss_warning_interval = 300
+
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super(Config, cls).__new__(cls, *args, **kwargs)
@@ -13,10 +22,38 @@ class Config:
 
     def __init__(self):
         if not hasattr(self, 'initialized'):
-            with open("config.toml", "rb") as f:
-                self.data = tomllib.load(f)
+            self.path = "config.toml"
+            self._lock = threading.Lock()
+            self._paths = {}        # key as given -> tuple of nested keys
+            self._values = {}       # tuple of nested keys -> value (or _MISSING)
+            self._warned = {}       # tuple of nested keys -> when we last warned about it
+            self._subscribers = []
+            self._load()
             self.initialized = True
 
+            reload_interval = self.get('config.reload_interval', 5)
+            if reload_interval:
+                threading.Thread(target=self._watch, args=(reload_interval,), daemon=True).start()
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            self.data = tomllib.load(f)
+        self.mtime = os.path.getmtime(self.path)
+
+    def _compile(self, keys):
+        """Turn key1.key2 (or a list of keys) into a tuple we can cache values under"""
+        if isinstance(keys, str):
+            return tuple(keys.split('.'))
+        return tuple(keys)
+
+    def _lookup(self, path):
+        data = self.data
+        for key in path:
+            if not isinstance(data, dict) or key not in data:
+                return _MISSING
+            data = data[key]
+        return data
+
     def get(self, keys, default=None):
         """
 
@@ -24,15 +61,56 @@ class Config:
         :param default: What to return if not found
         :return: either default or the value
         """
-        data = self.data
-        if '.' in keys:
-            keys = keys.split('.')
-        for key in keys:
-            if key not in data:
-                logger.warning(f'Key {keys} not found in config file.')
-                return default
-            data = data[key]
-        return data
+        path = self._paths.get(keys if isinstance(keys, str) else tuple(keys))
+        if path is None:
+            path = self._compile(keys)
+            self._paths[keys if isinstance(keys, str) else path] = path
+
+        value = self._values.get(path, None)
+        if value is None:
+            value = self._lookup(path)
+            self._values[path] = value
+
+        if value is _MISSING:
+            now = time.time()
+            if now - self._warned.get(path, 0) > self.miss_warning_interval:
+                self._warned[path] = now
+                logger.warning(f'Key {".".join(path)} not found in config file.')
+            return default
+        return value
+
+    def subscribe(self, callback):
+        """Call callback(config) whenever config.toml is reloaded"""
+        self._subscribers.append(callback)
+
+    def reload(self):
+        """Re-read config.toml and tell everyone who subscribed"""
+        with self._lock:
+            try:
+                self._load()
+            except Exception as e:
+                # Probably caught mid-edit; keep what we had and try again next time
+                logger.warning(f'Could not reload {self.path}: {e}')
+                return False
+            self._values = {}
+            self._warned = {}
+
+        print(f'Reloaded {self.path}', flush=True)
+        for callback in list(self._subscribers):
+            try:
+                callback(self)
+            except Exception as e:
+                logger.warning(f'Config subscriber {callback} failed: {e}')
+        return True
+
+    def _watch(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                if os.path.getmtime(self.path) != self.mtime:
+                    self.reload()
+            except OSError:
+                pass
 
 
 if __name__ == "__main__":
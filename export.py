@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Bulk export of history as NDJSON or CSV
+
+    python export.py packets --format csv -o packets.csv --url http://127.0.0.1:5000
+    python export.py telemetry --filter node=!a1b2c3d4 --gzip -o telemetry.ndjson.gz --url ...
+    python export.py messages --since 1760000000            # from persisted_data.snap, no server
+
+Everything is generated row by row (packets and messages a page at a time), so
+an export never holds more than a page in memory however much history there is.
+The same generators back the /api/export/<kind> endpoints, and with --url the
+CLI just streams one of those to a file.  Without --url packets and messages are
+read from persisted_data.snap; nodes and telemetry only live in the running
+program, so they need --url.
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import urllib.parse
+import urllib.request
+import zlib
+
+KINDS = ['packets', 'messages', 'nodes', 'telemetry']
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Filters each kind accepts (see Status.query_packets / query_messages and Metrics.export)
+FILTERS = {
+    'packets': ['node', 'type', 'channel', 'since', 'until', 'min_hops', 'max_hops', 'min_rssi', 'text'],
+    'messages': ['node', 'channel', 'since', 'until', 'text'],
+    'nodes': [],
+    'telemetry': ['node', 'metric', 'since', 'until', 'resolution']
+}
+
+# Filters that have to be numbers, and how they're parsed
+NUMERIC_FILTERS = {'since': float, 'until': float, 'min_hops': int, 'max_hops': int, 'min_rssi': float}
+
+PAGE_SIZE = 500
+
+
+def _pages(query, filters):
+    cursor = None
+    while True:
+        page = query(filters, cursor, PAGE_SIZE)
+        yield from page['rows']
+        cursor = page['next_cursor']
+        if cursor is None:
+            return
+
+
+def check_filters(kind, filters):
+    """
+    Check filter values up front, so a bad one is an error before any rows are sent
+
+    :raises ValueError: naming the filter that's wrong
+    """
+    for name, parse in NUMERIC_FILTERS.items():
+        if name in filters:
+            try:
+                parse(filters[name])
+            except (TypeError, ValueError):
+                raise ValueError(f'{name} must be a number, not {filters[name]!r}') from None
+    if kind == 'telemetry' and 'resolution' in filters:
+        from metrics import RESOLUTIONS
+        if filters['resolution'] not in RESOLUTIONS:
+            raise ValueError(f'resolution must be one of {", ".join(RESOLUTIONS)}')
+
+
+def iter_rows(kind, filters):
+    """Rows (dicts) of one kind, newest first for packets and messages"""
+    if kind == 'packets':
+        from status import Status
+        return _pages(Status().query_packets, filters)
+    if kind == 'messages':
+        from status import Status
+        return _pages(Status().query_messages, filters)
+    if kind == 'nodes':
+        from nodedata import NodeData
+        NodeData().refresh_data()
+        return iter(list(NodeData().data or []))
+    if kind == 'telemetry':
+        from metrics import Metrics
+        return Metrics().export(filters.get('node'), filters.get('metric'),
+                                float(filters['since']) if filters.get('since') else None,
+                                float(filters['until']) if filters.get('until') else None,
+                                filters.get('resolution', 'raw'))
+    raise ValueError(f'Unknown kind {kind}, expected one of {", ".join(KINDS)}')
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, default=str) + '\n'
+
+
+def csv_lines(rows):
+    """CSV with a header taken from the first row's keys"""
+    buffer = io.StringIO()
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row), extrasaction='ignore')
+            writer.writeheader()
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)   # 16+: gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(kind, fmt='ndjson', filters=None, compress=False):
+    """
+    Generate an export as bytes, a chunk at a time
+
+    :param filters: {name: value} from FILTERS[kind]; anything else is ignored
+    :raises ValueError: for an unknown format or a bad filter value (before anything is generated)
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format {fmt}, expected one of {", ".join(FORMATS)}')
+    filters = {name: value for name, value in (filters or {}).items() if name in FILTERS.get(kind, [])}
+    check_filters(kind, filters)
+    rows = iter_rows(kind, filters)
+    lines = ndjson_lines(rows) if fmt == 'ndjson' else csv_lines(rows)
+    chunks = (line.encode('utf-8') for line in lines)
+    return gzipped(chunks) if compress else chunks
+
+
+def filename(kind, fmt, compress):
+    return f'{kind}.{fmt}' + ('.gz' if compress else '')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export Meshtastic Monitor history as NDJSON or CSV')
+    parser.add_argument('kind', choices=KINDS)
+    parser.add_argument('--format', choices=list(FORMATS), default='ndjson')
+    parser.add_argument('--gzip', action='store_true', help='Compress the output')
+    parser.add_argument('--since', help='Only rows from this time on (epoch seconds)')
+    parser.add_argument('--until', help='Only rows up to this time (epoch seconds)')
+    parser.add_argument('--filter', action='append', default=[], metavar='NAME=VALUE',
+                        help='Any other filter, e.g. type=POSITION_APP or node=!a1b2c3d4 (repeatable)')
+    parser.add_argument('--url', help='Export from a running program at this address instead of persisted_data.snap')
+    parser.add_argument('-o', '--output', help='File to write (default: standard output)')
+    args = parser.parse_args(argv)
+
+    filters = dict(item.split('=', 1) for item in args.filter)
+    for name in ('since', 'until'):
+        if getattr(args, name):
+            filters[name] = getattr(args, name)
+
+    if args.url:
+        query = urllib.parse.urlencode(dict(filters, format=args.format, **({'gzip': 1} if args.gzip else {})))
+        response = urllib.request.urlopen(f'{args.url.rstrip("/")}/api/export/{args.kind}?{query}')
+        chunks = iter(lambda: response.read(65536), b'')
+    elif args.kind in ('nodes', 'telemetry'):
+        parser.error(f'{args.kind} are only kept by the running program, use --url')
+    else:
+        try:
+            chunks = export(args.kind, args.format, filters, args.gzip)
+        except ValueError as e:
+            parser.error(str(e))
+
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+Fleet tools for many TCP (or serial) attached Meshtastic nodes
+
+    python fleet.py audit nodes.txt                    # diff every node against the majority
+    python fleet.py audit nodes.txt --reference 10.0.0.5
+    python fleet.py audit 10.0.0.5 10.0.0.6 --use-cache
+    python fleet.py push patch.toml nodes.txt          # apply, verify, roll back failures
+
+Nodes can be given as addresses or as files with one address per line (# comments
+allowed).  Configs are fetched concurrently, each with its own timeout, and every
+snapshot is cached to disk so a re-run (or a node that is down) can use the last one.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import tomllib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from nodeconfig import NodeConfig
+
+DEFAULT_CACHE_DIR = 'fleet_snapshots'
+
+
+def load_addresses(items):
+    """Expand the command line into a list of node addresses"""
+    addresses = []
+    for item in items:
+        if os.path.isfile(item):
+            with open(item) as f:
+                for line in f:
+                    line = line.split('#')[0].strip()
+                    if line:
+                        addresses.append(line)
+        else:
+            addresses.append(item)
+    return addresses
+
+
+def connect(address):
+    """Open an interface to a node, serial if it looks like a device path"""
+    if address.startswith('/'):
+        from meshtastic.serial_interface import SerialInterface
+        return SerialInterface(address)
+    from meshtastic.tcp_interface import TCPInterface
+    return TCPInterface(hostname=address)
+
+
+def flatten_config(all_config):
+    """
+    Turn NodeConfig.get_all_config() output into {'section.field': value}
+
+    The *_name and *_options entries are only there for the UI, so they're dropped.
+    """
+    flat = {}
+    for section, result in all_config.items():
+        if not result.get('success'):
+            flat[f'{section}.error'] = result.get('error')
+            continue
+        if section == 'channels':
+            for channel in result['channels']:
+                for key, value in channel.items():
+                    if key in ('index', 'role_options', 'role_name'):
+                        continue
+                    flat[f'channels.{channel["index"]}.{key}'] = value
+            continue
+        for key, value in result['config'].items():
+            if key.endswith('_options') or key.endswith('_name'):
+                continue
+            flat[f'{section}.{key}'] = value
+    # Round-trip through JSON so protobuf odds and ends compare the same way cached snapshots do
+    return json.loads(json.dumps(flat, default=str))
+
+
+def snapshot_path(cache_dir, address):
+    return os.path.join(cache_dir, address.replace('/', '_') + '.json')
+
+
+def fetch_snapshot(address):
+    """Connect to a node and read all of its configuration"""
+    interface = connect(address)
+    try:
+        local_node = interface.localNode
+        node_id = f'!{local_node.nodeNum:08x}'
+        user = interface.nodes.get(node_id, {}).get('user', {})
+        all_config = NodeConfig.for_node(local_node).get_all_config()
+        return {
+            'address': address,
+            'node_id': node_id,
+            'long_name': user.get('longName', 'Unknown'),
+            'fetched': time.time(),
+            'raw': json.loads(json.dumps(all_config, default=str)),
+            'config': flatten_config(all_config)
+        }
+    finally:
+        interface.close()
+
+
+def run_with_timeout(fn, timeout, *args):
+    """Run fn in its own thread, giving up (but not killing it) after timeout seconds"""
+    outcome = {}
+
+    def target():
+        try:
+            outcome['result'] = fn(*args)
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise TimeoutError(f'no answer after {timeout}s')
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+
+def get_snapshot(address, timeout, cache_dir, max_age=None):
+    """Fetch one node's snapshot (or reuse a fresh cached one) and cache it on disk"""
+    path = snapshot_path(cache_dir, address)
+    started = time.time()
+
+    if max_age is not None and os.path.exists(path) and time.time() - os.path.getmtime(path) < max_age:
+        with open(path) as f:
+            snapshot = json.load(f)
+        return {'address': address, 'ok': True, 'source': 'cache', 'seconds': 0, 'snapshot': snapshot}
+
+    try:
+        snapshot = run_with_timeout(fetch_snapshot, timeout, address)
+    except Exception as e:
+        result = {'address': address, 'ok': False, 'error': str(e), 'seconds': time.time() - started}
+        # Fall back on the last snapshot we have, but say so
+        if os.path.exists(path):
+            with open(path) as f:
+                result['snapshot'] = json.load(f)
+            result['source'] = 'stale cache'
+        return result
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(snapshot, f, indent=2)
+    return {'address': address, 'ok': True, 'source': 'node', 'seconds': time.time() - started, 'snapshot': snapshot}
+
+
+def fetch_fleet(addresses, timeout=60, workers=8, cache_dir=DEFAULT_CACHE_DIR, max_age=None):
+    """Snapshot every node concurrently; results come back in the order given"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(get_snapshot, address, timeout, cache_dir, max_age) for address in addresses]
+        return [future.result() for future in futures]
+
+
+def diff_matrix(snapshots, reference=None):
+    """
+    Compare every node against a reference node, or the majority value for each field
+
+    :param snapshots: {address: flattened config}
+    :param reference: address of the reference node, or None for majority vote
+    :return: (expected values, {field: {address: value}} for fields where a node differs)
+    """
+    fields = sorted(set().union(*[config.keys() for config in snapshots.values()]))
+    missing = object()
+
+    if reference is not None:
+        expected = {field: snapshots[reference].get(field, missing) for field in fields}
+    else:
+        expected = {}
+        for field in fields:
+            votes = Counter(json.dumps(config.get(field), sort_keys=True) for config in snapshots.values())
+            expected[field] = json.loads(votes.most_common(1)[0][0])
+
+    matrix = {}
+    for field in fields:
+        differs = {address: config.get(field, '(missing)') for address, config in snapshots.items()
+                   if config.get(field, missing) != expected[field]}
+        if differs:
+            matrix[field] = differs
+    return {field: value for field, value in expected.items() if value is not missing}, matrix
+
+
+def print_matrix(expected, matrix, addresses):
+    """Fields down the side, nodes across the top, '·' where a node matches"""
+    width = max([len(field) for field in matrix] + [10])
+    print(f'{"field":{width}}  {"expected":16}  ' + '  '.join(f'{a:16}' for a in addresses))
+    for field, differs in matrix.items():
+        cells = '  '.join(f'{str(differs.get(a, "·"))[:16]:16}' for a in addresses)
+        print(f'{field:{width}}  {str(expected.get(field, "(missing)"))[:16]:16}  {cells}')
+
+
+def audit(args):
+    addresses = load_addresses(args.nodes)
+    if args.reference and args.reference not in addresses:
+        addresses.insert(0, args.reference)
+
+    started = time.time()
+    results = fetch_fleet(addresses, args.timeout, args.workers, args.cache_dir,
+                          args.max_age if args.use_cache else None)
+    print(f'Fetched {len(results)} nodes in {time.time() - started:.1f}s\n')
+
+    for r in results:
+        state = f'{r["source"]}, {r["seconds"]:.1f}s' if r['ok'] else f'FAILED ({r["error"]})'
+        if not r['ok'] and 'snapshot' in r:
+            state += ', using stale cache'
+        name = r['snapshot']['long_name'] if 'snapshot' in r else ''
+        print(f'  {r["address"]:20} {name:24} {state}')
+
+    snapshots = {r['address']: r['snapshot']['config'] for r in results if 'snapshot' in r}
+    if not snapshots or (args.reference and args.reference not in snapshots):
+        print('\nNot enough snapshots to compare')
+        return 2
+
+    expected, matrix = diff_matrix(snapshots, args.reference)
+    print(f'\nCompared against {args.reference or "the majority value"}: {len(matrix)} differing field(s)\n')
+    if matrix:
+        print_matrix(expected, matrix, list(snapshots))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'reference': args.reference, 'nodes': results, 'expected': expected, 'differences': matrix},
+                      f, indent=2, default=str)
+
+    return 1 if matrix else 0
+
+
+def load_patch(path):
+    """
+    Read a declarative patch (TOML or JSON), e.g.
+
+        [lora]
+        hop_limit = 6
+
+        [channels.0]
+        name = "Ops"
+
+    :return: (sections, channels) in the form NodeConfig.update_config_batch takes
+    """
+    with open(path, 'rb') as f:
+        patch = tomllib.load(f) if path.endswith('.toml') else json.load(f)
+    channels = {str(index): fields for index, fields in patch.pop('channels', {}).items()}
+    return patch, channels
+
+
+def patch_fields(sections, channels):
+    """The flattened field names (as in flatten_config) a patch sets, with their values"""
+    fields = {f'{section}.{key}': value for section, changes in sections.items() for key, value in changes.items()}
+    fields.update({f'channels.{index}.{key}': value for index, changes in channels.items() for key, value in changes.items()})
+    return fields
+
+
+def rollback_patch(fields, before):
+    """Build the patch that puts the given flattened fields back the way they were"""
+    sections, channels = {}, {}
+    for field in fields:
+        if field not in before:
+            continue
+        parts = field.split('.')
+        if parts[0] == 'channels':
+            channels.setdefault(parts[1], {})[parts[2]] = before[field]
+        else:
+            sections.setdefault(parts[0], {})[parts[1]] = before[field]
+    return sections, channels
+
+
+def apply_patch(address, sections, channels):
+    interface = connect(address)
+    try:
+        return NodeConfig.for_node(interface.localNode).update_config_batch(sections, channels)
+    finally:
+        interface.close()
+
+
+def verify(address, fields, timeout, settle):
+    """Wait for the node to come back, read it again and list any field that didn't take"""
+    time.sleep(settle)
+    deadline = time.time() + timeout
+    while True:
+        try:
+            snapshot = run_with_timeout(fetch_snapshot, max(1, deadline - time.time()), address)
+            break
+        except Exception:
+            # Most likely still rebooting
+            if time.time() >= deadline:
+                raise
+            time.sleep(5)
+    config = snapshot['config']
+    wrong = {field: config.get(field) for field, value in fields.items() if config.get(field) != value}
+    return snapshot, wrong
+
+
+def push_node(address, sections, channels, args):
+    """Snapshot, apply, verify and (if need be) roll back one node; returns its report line"""
+    report = {'address': address, 'status': 'ok', 'timings': {}}
+    fields = patch_fields(sections, channels)
+
+    def timed(step, fn, *fn_args):
+        started = time.time()
+        try:
+            return fn(*fn_args)
+        finally:
+            report['timings'][step] = round(time.time() - started, 1)
+
+    try:
+        before = timed('snapshot', run_with_timeout, fetch_snapshot, args.timeout, address)
+    except Exception as e:
+        report.update(status='unreachable', error=str(e))
+        return report
+
+    # Keep the pre-change config so a failed node can be put back later, by hand if need be
+    os.makedirs(args.cache_dir, exist_ok=True)
+    report['pre_snapshot'] = snapshot_path(args.cache_dir, f'{address}.pre-{int(before["fetched"])}')
+    with open(report['pre_snapshot'], 'w') as f:
+        json.dump(before, f, indent=2)
+
+    # A field the snapshot doesn't have would always fail to verify, and couldn't be rolled back
+    unknown = sorted(field for field in fields if field not in before['config'])
+    if unknown:
+        report.update(status='unknown fields', error=f'not in the node\'s config: {", ".join(unknown)}')
+        return report
+
+    report['changes'] = {field: [before['config'].get(field), value] for field, value in fields.items()
+                         if before['config'].get(field) != value}
+    if not report['changes']:
+        report['status'] = 'unchanged'
+        return report
+    if args.dry_run:
+        report['status'] = 'dry run'
+        return report
+
+    try:
+        result = timed('apply', run_with_timeout, apply_patch, args.timeout, address, sections, channels)
+        if not result.get('success'):
+            raise RuntimeError(result.get('error') or 'some sections failed to write')
+        after, wrong = timed('verify', verify, address, fields, args.timeout, args.settle)
+        if not wrong:
+            return report
+        report.update(status='verify failed', wrong=wrong)
+    except Exception as e:
+        report.update(status='failed', error=str(e))
+
+    if args.no_rollback:
+        return report
+
+    undo_sections, undo_channels = rollback_patch(fields, before['config'])
+    if not undo_sections and not undo_channels:
+        report['rolled_back'] = False
+        report['rollback_error'] = 'nothing to put back'
+        return report
+    try:
+        timed('rollback', run_with_timeout, apply_patch, args.timeout, address, undo_sections, undo_channels)
+        _, still_wrong = timed('rollback_verify', verify, address, patch_fields(undo_sections, undo_channels),
+                               args.timeout, args.settle)
+        report['rolled_back'] = not still_wrong
+    except Exception as e:
+        report['rolled_back'] = False
+        report['rollback_error'] = str(e)
+    return report
+
+
+def push(args):
+    sections, channels = load_patch(args.patch)
+    addresses = load_addresses(args.nodes)
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(push_node, address, sections, channels, args) for address in addresses]
+        reports = [future.result() for future in futures]
+
+    print(f'Pushed {args.patch} to {len(reports)} nodes in {time.time() - started:.1f}s\n')
+    for r in reports:
+        timings = ' '.join(f'{step}={seconds}s' for step, seconds in r['timings'].items())
+        line = f'  {r["address"]:20} {r["status"]:14} {timings}'
+        if 'rolled_back' in r:
+            line += ' (rolled back)' if r['rolled_back'] else ' (ROLLBACK FAILED)'
+        if 'error' in r:
+            line += f'  {r["error"]}'
+        print(line)
+        for field, (old, new) in r.get('changes', {}).items():
+            print(f'      {field}: {old} -> {new}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2, default=str)
+
+    return 0 if all(r['status'] in ('ok', 'unchanged', 'dry run') for r in reports) else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Meshtastic fleet tools')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('audit', help='Compare configuration across many nodes')
+    p.add_argument('nodes', nargs='+', help='Node addresses, or files listing them')
+    p.add_argument('--reference', help='Compare against this node instead of the majority value')
+    p.add_argument('--timeout', type=float, default=60, help='Seconds to wait for each node')
+    p.add_argument('--workers', type=int, default=8, help='Nodes to talk to at once')
+    p.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Where to keep config snapshots')
+    p.add_argument('--use-cache', action='store_true', help='Reuse cached snapshots younger than --max-age')
+    p.add_argument('--max-age', type=float, default=3600, help='Seconds a cached snapshot stays fresh')
+    p.add_argument('--json', help='Also write the full report to this file')
+    p.set_defaults(func=audit)
+
+    p = sub.add_parser('push', help='Apply a config patch to many nodes, verify it and roll back failures')
+    p.add_argument('patch', help='TOML or JSON file of {section: {field: value}} (plus [channels.N])')
+    p.add_argument('nodes', nargs='+', help='Node addresses, or files listing them')
+    p.add_argument('--workers', type=int, default=4, help='Nodes to change at once')
+    p.add_argument('--timeout', type=float, default=120, help='Seconds allowed for each step on each node')
+    p.add_argument('--settle', type=float, default=30, help='Seconds to let a node reboot before verifying')
+    p.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Where to keep pre-change snapshots')
+    p.add_argument('--no-rollback', action='store_true', help="Leave failed nodes as they are")
+    p.add_argument('--dry-run', action='store_true', help='Only show what would change')
+    p.add_argument('--json', help='Also write the full report to this file')
+    p.set_defaults(func=push)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
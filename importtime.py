@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+How long importing a module takes, and what it spends the time on
+
+    python importtime.py                    # mesher, i.e. what startup waits for before the web server is up
+    python importtime.py message --top 30
+    python importtime.py mesher --runs 5    # best of 5
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter (so
+nothing is already imported) and lists the slowest modules by cumulative time,
+then each of --check's heavy dependencies with whether it got imported at all.
+"""
+
+import argparse
+import subprocess
+import sys
+
+# Imports that should only happen when they're used, not at startup
+HEAVY = ['meshtastic', 'geopy', 'numpy']
+
+
+def profile(module):
+    """{module: (own microseconds, cumulative microseconds)} for one import of module"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'import failed')
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Profile the import time of a module')
+    parser.add_argument('module', nargs='?', default='mesher')
+    parser.add_argument('--top', type=int, default=15, help='How many of the slowest modules to list')
+    parser.add_argument('--runs', type=int, default=3, help='Imports to time; the fastest is reported')
+    parser.add_argument('--check', nargs='*', default=HEAVY, metavar='MODULE',
+                        help='Modules that should not be imported (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    runs = [profile(args.module) for _ in range(max(args.runs, 1))]
+    times = min(runs, key=lambda run: run.get(args.module, (0, 0))[1])
+    total = times.get(args.module, (0, 0))[1]
+    print(f'import {args.module}: {total / 1000:.1f} ms (best of {len(runs)})\n')
+
+    print(f'{"cumulative ms":>14}  {"self ms":>8}  module')
+    slowest = sorted(times.items(), key=lambda item: item[1][1], reverse=True)
+    for name, (own, cumulative) in slowest[:args.top]:
+        print(f'{cumulative / 1000:14.1f}  {own / 1000:8.1f}  {name}')
+
+    if args.check:
+        print()
+        for name in args.check:
+            if name in times:
+                print(f'{name}: imported ({times[name][1] / 1000:.1f} ms)')
+            else:
+                print(f'{name}: not imported')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
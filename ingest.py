@@ -0,0 +1,116 @@
+"""
+Ingest Process for Meshtastic Monitor
+
+Run this instead of mesher.py when you want more than one web process.  This
+process is the only one that talks to the radio: it listens for packets, keeps
+Status / NodeData up to date, publishes snapshots of them to the shared store,
+and executes commands that web workers put on the shared command queue.
+
+    python ingest.py 192.168.5.50
+    MESHER_ROLE=web gunicorn -w 4 -b 0.0.0.0:8080 mesher:app
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import mesher
+from config import Config
+from linkstats import LinkStats
+from nodeconfig import NodeConfig
+from nodedata import NodeData
+from sharedstore import SharedStore
+from startup import Startup
+
+
+class Ingest:
+    def __init__(self):
+        config = Config()
+        self.publish_interval = config.get('shared.publish_interval', 1)
+        self.publish_rows = config.get('shared.publish_rows', 500)
+        # The same steps mesher.py runs, so its request handlers (which we replay commands
+        # through) see startup as done
+        if not Startup().run(mesher.STARTUP_STEPS):
+            raise SystemExit(1)
+        self.listener = mesher.listener
+        self.store = SharedStore()
+        self.executor = ThreadPoolExecutor(max_workers=config.get('shared.command_workers', 4))
+        self.nodes_published_at = None
+        self.config_dirty = True
+
+    def publish(self):
+        """Publish everything the web workers serve on their own"""
+        snapshot = {
+            'index': mesher.build_index_info(),
+            'updates': mesher.build_updates(self.publish_rows),
+            'localnode': mesher.build_local_node_info(),
+        }
+
+        # Node details only change when NodeData refreshes its cache
+        nd = NodeData()
+        if nd.lasttime != self.nodes_published_at:
+            self.nodes_published_at = nd.lasttime
+            snapshot['node_details'] = {node['id']: nd.lookup_by_id(node['id']) for node in list(nd.data or [])}
+
+        snapshot['link_stats'] = LinkStats().get_all()
+
+        if self.config_dirty:
+            self.config_dirty = False
+            snapshot['config_all'] = NodeConfig().get_all_config()
+
+        self.store.put_many(snapshot)
+
+        flash = mesher.pop_flash_message()
+        if flash is not None:
+            self.store.put('flash', flash)
+
+    def execute(self, command_id, kind, payload):
+        try:
+            if kind != 'request':
+                raise ValueError(f'Unknown command kind: {kind}')
+
+            # Replay the worker's request against our own (in-process) copy of the app
+            client = mesher.app.test_client()
+            response = client.open(payload['path'], method=payload['method'],
+                                   query_string=payload['query_string'], json=payload['json'])
+            result = {
+                'status': response.status_code,
+                'content_type': response.content_type,
+                'body': response.get_data(as_text=True)
+            }
+            if payload['path'].startswith('/api/config') and payload['method'] != 'GET':
+                self.config_dirty = True
+        except Exception as e:
+            print(f'Error executing command {command_id}: {e}', flush=True)
+            result = {'status': 500, 'content_type': 'text/plain', 'body': str(e)}
+
+        self.store.complete(command_id, result)
+
+    def run(self):
+        threading.Thread(target=self.publish_loop, daemon=True).start()
+
+        last_purge = time.time()
+        while True:
+            commands = self.store.claim_commands()
+            for command_id, kind, payload in commands:
+                self.executor.submit(self.execute, command_id, kind, payload)
+
+            if time.time() - last_purge > 600:
+                last_purge = time.time()
+                self.store.purge_commands()
+
+            if not commands:
+                time.sleep(self.store.poll_interval)
+
+    def publish_loop(self):
+        while True:
+            try:
+                self.publish()
+            except Exception as e:
+                print(f'Error publishing snapshot: {e}', flush=True)
+            time.sleep(self.publish_interval)
+
+
+if __name__ == '__main__':
+    print('Starting ingest process')
+    Ingest().run()
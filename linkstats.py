@@ -0,0 +1,157 @@
+"""
+Link Statistics for Meshtastic Monitor
+
+Running per-node aggregates of the signal we receive from each node (RSSI,
+SNR), how many hops its packets took and how often we hear it.  Every packet
+updates them in constant time, so link quality is available long after the
+packet rows themselves have been trimmed, without scanning any history.
+
+Percentiles are approximate: values are counted into fixed-width bins, and a
+percentile is read back as the middle of the bin it falls in.
+"""
+
+import threading
+import time
+
+
+class Histogram:
+    """Count, mean, min/max and approximate percentiles of a stream of values"""
+
+    def __init__(self, low, high, width):
+        self.low = low
+        self.width = width
+        self.bins = [0] * (int((high - low) / width) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        # Anything out of range goes in the end bins
+        index = min(len(self.bins) - 1, max(0, int((value - self.low) / self.width)))
+        self.bins[index] += 1
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        wanted = p / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.bins):
+            seen += count
+            if count and seen >= wanted:
+                value = self.low + (index + 0.5) * self.width
+                return round(min(self.max, max(self.min, value)), 2)
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return None
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 2),
+            'min': self.min,
+            'max': self.max,
+            'p10': self.percentile(10),
+            'p50': self.percentile(50),
+            'p90': self.percentile(90)
+        }
+
+
+class NodeLinkStats:
+    """Everything we keep about one node"""
+
+    HOURS = 24      # How many hours of packet counts we keep
+
+    def __init__(self, now):
+        self.first_seen = now
+        self.last_seen = now
+        self.count = 0
+        self.rssi = Histogram(-150, 10, 1)
+        self.snr = Histogram(-30, 20, 0.5)
+        self.hops = {}                          # hops -> packets
+        self.hourly = [[0, 0] for _ in range(self.HOURS)]   # ring of [hour number, packets]
+
+    def add(self, now, rssi, snr, hops):
+        self.last_seen = now
+        self.count += 1
+        if rssi is not None:
+            self.rssi.add(rssi)
+        if snr is not None:
+            self.snr.add(snr)
+        if hops is not None and hops >= 0:
+            self.hops[hops] = self.hops.get(hops, 0) + 1
+
+        hour = int(now // 3600)
+        bucket = self.hourly[hour % self.HOURS]
+        if bucket[0] != hour:
+            bucket[0], bucket[1] = hour, 0
+        bucket[1] += 1
+
+    def packets_per_hour(self, now):
+        """Average over the last day (or since we first heard the node, if that's less)"""
+        hour = int(now // 3600)
+        recent = sum(count for bucket_hour, count in self.hourly if hour - bucket_hour < self.HOURS)
+        hours = min(self.HOURS, max(1.0, (now - self.first_seen) / 3600))
+        return round(recent / hours, 2)
+
+    def summary(self, now):
+        return {
+            'count': self.count,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+            'rssi': self.rssi.summary(),
+            'snr': self.snr.summary(),
+            'hops': dict(sorted(self.hops.items())),
+            'packets_per_hour': self.packets_per_hour(now)
+        }
+
+
+class LinkStats:
+    """Singleton holding NodeLinkStats for every node we've heard"""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(LinkStats, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        self.lock = threading.Lock()
+        self.nodes = {}     # node id -> NodeLinkStats
+        self._initialized = True
+
+    @staticmethod
+    def _number(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def add_packet(self, node_id, rssi, snr, hops, now=None):
+        now = now or time.time()
+        with self.lock:
+            stats = self.nodes.get(node_id)
+            if stats is None:
+                stats = self.nodes[node_id] = NodeLinkStats(now)
+            stats.add(now, self._number(rssi), self._number(snr), hops)
+
+    def get_node(self, node_id):
+        with self.lock:
+            stats = self.nodes.get(node_id)
+            return stats.summary(time.time()) if stats else None
+
+    def get_all(self):
+        now = time.time()
+        with self.lock:
+            return {node_id: stats.summary(now) for node_id, stats in self.nodes.items()}
+
+
+__all__ = ['LinkStats']
@@ -6,12 +6,15 @@ from message import Message
 import time
 import os
 from config import Config
+from supervisor import Supervisor
+from sweep import Sweeper
 
 
 class Listener():
     def __init__(self):
         retries = 4
         while retries:
+            pub.sendMessage('mesher.startup.progress', step='radio', done=5 - retries, total=4)
             try:
                 self.mesh = Mesh()
                 retries = 0
@@ -34,12 +37,18 @@ class Listener():
         pub.subscribe(self.on_receive, "meshtastic.receive")
         pub.subscribe(self.on_disconnect, "meshtastic.connection.lost")
 
+        if config.get('sweep.enabled', False):
+            Sweeper().start()
+
+        Supervisor().start()
+
         print('Listener initialized')
 
     def __del__(self):
         print("Listener is being destroyed")
 
     def on_receive(self, packet: dict, interface):
+        Supervisor().heard()
         try:
             msg = Message(interface, packet)
             msg.handle_message()
@@ -49,7 +58,9 @@ class Listener():
                 f.write(f'{get_datestamp()}: ERROR processing packet: {e}\n')
                 f.write(f'{get_datestamp()}: Packet was: {packet}\n')
 
-    def on_disconnect(self):
+    def on_disconnect(self, interface=None):
+        # Called on meshtastic's own thread: just hand over to the supervisor, which reconnects
+        if interface is not None and interface is not self.mesh.node:
+            return      # An interface we've already replaced, closed by Mesh.reconnect
         print('Disconnected from Mesh')
-        self.mesh.reconnect()
-        print('Reconnected to Mesh')
+        Supervisor().connection_lost()
@@ -1,11 +1,7 @@
-from meshtastic.tcp_interface import TCPInterface
-from meshtastic.serial_interface import SerialInterface
-from meshtastic.mesh_interface import MeshInterface
-from meshtastic import BROADCAST_ADDR
 import sys
 import os
 
-from nodedata import NodeData
+# meshtastic takes a while to import, so it's only imported when we connect
 
 #   If using TCP/IP
 DEFAULT_DEVICE = '192.168.5.51'
@@ -34,14 +30,25 @@ class Mesh:
 
         print(f'Initializing mesh at {self.device}')
 
-        # Mac/Linux Specific, not sure what Windows does...
-        if self.device.startswith('/'):
-            self.node = SerialInterface(self.device)
-        else:
-            self.node = TCPInterface(hostname=self.device)
+        from meshtastic.mesh_interface import MeshInterface
 
+        self.node = self.open_interface()
         self.mi = MeshInterface()
+        self.load_node_info()
+
+        self._initialized = True
+
+    def open_interface(self):
+        from meshtastic.tcp_interface import TCPInterface
+        from meshtastic.serial_interface import SerialInterface
+
+        # Mac/Linux Specific, not sure what Windows does...
+        if self.device.startswith('/'):
+            return SerialInterface(self.device)
+        return TCPInterface(hostname=self.device)
 
+    def load_node_info(self):
+        """(Re)read our node's channels and details from the interface"""
         ch = self.node.localNode.channels
 
         self.channels = []
@@ -70,11 +77,21 @@ class Mesh:
         for ch in self.channels:
             print(f'{ch["index"]}  {ch["name"]:12}  {ch["role"]:9}  PSK Bits {8*len(ch["psk"])}')
 
-        self._initialized = True
-
-
     def reconnect(self):
-        self.node = TCPInterface(hostname=self.device)
+        """Replace the interface with a new connection (over serial or TCP, whichever we had)"""
+        from nodeconfig import NodeConfig
+        from nodedata import NodeData
+
+        old = self.node
+        try:
+            old.close()
+        except Exception as e:
+            print(f'Error closing the old connection: {e}', flush=True)
+        self.node = self.open_interface()
+        self.load_node_info()
+        # What we cached came from the old connection
+        NodeConfig().invalidate_cache()
+        NodeData().refresh_data(force=True)
 
     def reset(self):
         Mesh._instance = None
@@ -100,6 +117,7 @@ class Mesh:
             return str(e)
 
     def send_channel(self, dest, message):
+        from meshtastic import BROADCAST_ADDR
 
         try:
             # Send the message
@@ -1,6 +1,7 @@
 import socket
 import os
-from flask import Flask, render_template, jsonify, request, abort
+import sys
+from flask import Flask, render_template, jsonify, request, abort, Response
 from status import Status
 from listener import Listener
 from mesh import Mesh
@@ -9,6 +10,19 @@ import logging
 import threading
 from config import Config
 from nodeconfig import NodeConfig
+from sharedstore import SharedStore
+from traceroute import Traceroutes
+from sweep import Sweeper
+from topology import Topology
+from linkstats import LinkStats
+from airtime import Airtime
+from anomaly import Anomalies
+from archive import Archive
+import export
+from metrics import Metrics
+from rates import Rates
+from startup import Startup
+from supervisor import Supervisor
 
 
 # This prevents the Werkzeug logger from printing to the console all the requests we receive
@@ -18,63 +32,147 @@ if not Config().get('debug.http_logging', False):
 
 app = Flask(__name__)
 
-status = Status()
+# When MESHER_ROLE=web this process is one of (possibly many) stateless web workers:
+# it never touches the radio, serves the dashboard from the shared store that
+# ingest.py publishes, and forwards everything else to the ingest process.
+WEB_WORKER = os.getenv('MESHER_ROLE', 'single') == 'web'
 
-flash_message = None
-flash_message_lock = threading.Lock()
+# Endpoints a web worker answers on its own from the shared store
+WORKER_LOCAL_ENDPOINTS = {'static', 'index', 'get_updates', 'get_details', 'get_local_node_info',
+                          'get_config_page', 'get_all_config', 'get_archive'}
 
-@app.route('/')
-def index():
-    m = Mesh()
-    device_metrics = m.node_data.get('deviceMetrics', {})
-    voltage = device_metrics.get('voltage', 'N/A')
-    batt_level = device_metrics.get('batteryLevel', 'N/A')
-    firmware_version = m.node.metadata.firmware_version if m.node.metadata else 'Unknown'
-    return render_template('index.html', name=m.full_name, voltage=voltage, batt_level=batt_level, version=firmware_version,
-                           channels=m.channels)
+# Endpoints that can't go through the command queue
+WORKER_UNSUPPORTED_ENDPOINTS = {'export_history'}
 
+status = None
+listener = None
 
-@app.route('/api/updates')
-def get_updates():
-    rowmax =int(request.args.get('rowmax'))
 
-    # Demo data - replace with your actual data source
-    summary_data = status.get_counts()
+def load_history():
+    """Load the saved packets and messages (a startup step, see startup.py)"""
+    global status
+    status = Status()
+
+
+def connect_radio():
+    global listener
+    listener = Listener()
 
-    messages_data = status.get_messages(rowmax)
 
-    packets_data = status.get_packets(rowmax)
+STARTUP_STEPS = [('history', load_history), ('radio', connect_radio)]
 
-    nodes_data = NodeData().get_nodes()[:rowmax]
+# Endpoints served while the startup steps are still running
+STARTUP_ENDPOINTS = {'static', 'index', 'get_startup', 'retry_startup'}
+
+flash_message = None
+flash_message_lock = threading.Lock()
 
+
+def pop_flash_message():
     global flash_message
     with flash_message_lock:
         f = flash_message
         flash_message = None
-    return jsonify({
-        "summary": summary_data,
-        "messages": messages_data,
-        "packets": packets_data,
-        "nodes": nodes_data,
-        "flash": f
+    return f
+
+
+@app.before_request
+def forward_to_ingest():
+    """In web worker mode, hand anything we can't serve from the store to the ingest process"""
+    if not WEB_WORKER or request.endpoint in WORKER_LOCAL_ENDPOINTS:
+        return None
+    if request.endpoint in WORKER_UNSUPPORTED_ENDPOINTS:
+        # The command queue hands back whole text bodies, which would buffer an export and break gzip
+        abort(501, description='Exports need the history in memory: run export.py on the ingest host, '
+                               'or export from mesher.py in single-process mode')
+
+    store = SharedStore()
+    command_id = store.enqueue('request', {
+        'method': request.method,
+        'path': request.path,
+        'query_string': request.query_string.decode(),
+        'json': request.get_json(silent=True)
     })
+    result = store.wait_result(command_id)
+    if result is None:
+        abort(504, description='Timed out waiting for the ingest process')
+    return Response(result['body'], status=result['status'], content_type=result['content_type'])
 
-# sendTraceRoute waits for a response.  We don't care, we'll see the packet
-# coming back.  So we'll stick this in a thread so the rest of the app can
-# get on with things..
-def send_trace_route_in_thread(dest, hopLimit, channelIndex):
-    global flash_message
-    try:
-        print(f'Sending traceroute ({dest} {hopLimit} {channelIndex}) ({type(dest)})', flush=True)
-        Mesh().node.sendTraceRoute(dest, hopLimit, channelIndex=channelIndex)
-    except Exception as e:
-        l = logging.getLogger(__name__)
-        l.info(f'TraceRoute EXCEPTION: {e}')
-        with flash_message_lock:
-            flash_message = 'Trace Route Failed'
 
-    # print('Traceroute finished', flush=True)
+@app.before_request
+def wait_for_startup():
+    """Until the history is loaded and the radio connected, only the connecting page is served"""
+    if Startup().state == 'idle' and not WEB_WORKER:
+        # Imported by a WSGI server rather than run as a script: start up on the first request
+        Startup().start(STARTUP_STEPS)
+    if Startup().pending and request.endpoint not in STARTUP_ENDPOINTS:
+        abort(503, description='Still starting up, see /api/startup')
+
+
+@app.route('/api/startup', methods=['GET'])
+def get_startup():
+    """How far along loading the history and connecting to the radio are"""
+    return jsonify(Startup().get_state())
+
 
+@app.route('/api/startup', methods=['POST'])
+def retry_startup():
+    """Run the startup steps again after one failed"""
+    if Startup().state != 'failed':
+        return jsonify({'success': False, 'error': f'Startup is {Startup().state}'})
+    Startup().start(STARTUP_STEPS)
+    return jsonify({'success': True})
+
+
+def build_index_info():
+    m = Mesh()
+    device_metrics = m.node_data.get('deviceMetrics', {})
+    return {
+        'name': m.full_name,
+        'voltage': device_metrics.get('voltage', 'N/A'),
+        'batt_level': device_metrics.get('batteryLevel', 'N/A'),
+        'version': m.node.metadata.firmware_version if m.node.metadata else 'Unknown',
+        'channels': m.channels
+    }
+
+
+@app.route('/')
+def index():
+    if WEB_WORKER:
+        info = SharedStore().get('index')
+        if info is None:
+            abort(503, description='Waiting for the ingest process to publish data')
+    elif Startup().pending:
+        return render_template('connecting.html')
+    else:
+        info = build_index_info()
+    return render_template('index.html', **info)
+
+
+def build_updates(rowmax):
+    return {
+        "summary": status.get_counts(),
+        "messages": status.get_messages(rowmax),
+        "packets": status.get_packets(rowmax),
+        "nodes": NodeData().get_nodes()[:rowmax]
+    }
+
+
+@app.route('/api/updates')
+def get_updates():
+    rowmax =int(request.args.get('rowmax'))
+
+    if WEB_WORKER:
+        store = SharedStore()
+        updates = store.get('updates', {'summary': {'columns': [], 'values': []}, 'messages': [], 'packets': [], 'nodes': []})
+        for key in ['messages', 'packets', 'nodes']:
+            updates[key] = updates[key][:rowmax]
+        updates['flash'] = store.pop('flash')
+        return jsonify(updates)
+
+    updates = build_updates(rowmax)
+    updates['flash'] = pop_flash_message()
+    return jsonify(updates)
 
 @app.route('/api/traceroute')
 def do_traceroute():
@@ -95,9 +193,236 @@ def do_traceroute():
     print(f'Trace Route to {item_id} with {hopLimit} hops')
     channelIndex = 0
 
-    thread = threading.Thread(target=send_trace_route_in_thread, args=(dest, hopLimit, channelIndex))
-    thread.start()
-    return 'Trace Route sent.'
+    job, err = Traceroutes().submit(dest, hopLimit, channelIndex)
+    if job is None:
+        return jsonify({'success': False, 'error': err}), 429
+    return jsonify({'success': True, 'job_id': job['id'], 'message': 'Trace Route sent.'})
+
+
+@app.route('/api/traceroute/jobs')
+def get_traceroute_jobs():
+    rowmax = int(request.args.get('rowmax', 50))
+    return jsonify(Traceroutes().get_jobs(rowmax))
+
+
+@app.route('/api/traceroute/<job_id>')
+def get_traceroute_job(job_id):
+    job = Traceroutes().get_job(job_id)
+    if job is None:
+        abort(404, description=f"Trace route job {job_id} not found")
+    return jsonify(job)
+
+@app.route('/api/sweep', methods=['GET', 'POST'])
+def handle_sweep():
+    """Get the traceroute sweep status and results, or turn sweeping on/off and pick nodes"""
+    sweeper = Sweeper()
+    if request.method == 'POST':
+        data = request.get_json()
+        sweeper.configure(data.get('enabled'), data.get('nodes'))
+    return jsonify(sweeper.get_status())
+
+
+@app.route('/api/topology/adjacency')
+def get_topology_adjacency():
+    """Every node we've seen a link for, with its neighbours and link quality"""
+    return jsonify(Topology().get_adjacency())
+
+
+@app.route('/api/topology/path')
+def get_topology_path():
+    """Best known path between two nodes (ids without the !)"""
+    source = request.args.get('from')
+    dest = request.args.get('to')
+    if not source or not dest:
+        abort(400, description="Missing required 'from' and 'to' parameters")
+
+    path = Topology().shortest_path('!' + source, '!' + dest)
+    if path is None:
+        abort(404, description=f"No known path from {source} to {dest}")
+    return jsonify(path)
+
+
+@app.route('/api/topology/critical')
+def get_topology_critical():
+    """Relays whose loss would split the mesh into pieces"""
+    return jsonify(Topology().critical_relays())
+
+
+@app.route('/api/stats')
+def get_link_stats():
+    """Link quality for one node (?id=, without the !) or, without an id, for every node we've heard"""
+    item_id = request.args.get('id')
+    if not item_id:
+        return jsonify(LinkStats().get_all())
+
+    stats = LinkStats().get_node('!' + item_id)
+    if stats is None:
+        abort(404, description=f"No packets heard from {item_id}")
+    return jsonify(stats)
+
+
+@app.route('/api/metrics')
+def get_metrics():
+    """
+    Telemetry time series for a node (?id=, without the !).  Without ?metric= it lists the
+    node's metrics; with it, returns points between ?since= and ?until= (epoch seconds) at
+    ?resolution= raw, minute, hour or auto (the default)
+    """
+    item_id = request.args.get('id')
+    if not item_id:
+        abort(400, description="Missing required 'id' parameter")
+    metric = request.args.get('metric')
+    if not metric:
+        return jsonify(Metrics().get_metrics('!' + item_id))
+
+    try:
+        series = Metrics().query('!' + item_id, metric,
+                                 since=request.args.get('since', type=float),
+                                 until=request.args.get('until', type=float),
+                                 resolution=request.args.get('resolution', 'auto'))
+    except ValueError as e:
+        abort(400, description=str(e))
+    if series is None:
+        abort(404, description=f"No {metric} data for {item_id}")
+    return jsonify(series)
+
+
+@app.route('/api/connection', methods=['GET'])
+def get_connection():
+    """State of the connection to the radio, its recent transitions, and reconnect / uptime figures"""
+    return jsonify(Supervisor().get_state())
+
+
+@app.route('/api/connection/reconnect', methods=['POST'])
+def reconnect():
+    """Drop the connection to the radio and make a new one"""
+    if Supervisor().state != 'connected':
+        return jsonify({'success': False, 'error': f'Connection is {Supervisor().state}'})
+    Supervisor().request_reconnect()
+    return jsonify({'success': True})
+
+
+@app.route('/api/rates')
+def get_rates():
+    """Packets in the last 1m / 15m / 1h, by app type, channel and (the ?top= busiest) sending node"""
+    return jsonify(Rates().get_rates(request.args.get('top', 50, type=int)))
+
+
+@app.route('/api/airtime')
+def get_airtime():
+    """Estimated time on air in the last 1m / 15m / 1h, overall, by port and for the ?top= busiest nodes"""
+    return jsonify(Airtime().get_airtime(request.args.get('top', 20, type=int)))
+
+
+@app.route('/api/anomalies')
+def get_anomalies():
+    """Nodes sending far more than they should, and how many of their packets were kept out of the table"""
+    return jsonify(Anomalies().get_anomalies())
+
+
+@app.route('/api/archive')
+def get_archive():
+    """
+    Long-term packet counts, RSSI / SNR / hops and traffic mix from the packet archive, as a series
+    of ?bucket= second buckets over ?since= / ?until= (epoch seconds), optionally for one ?node= or ?port=.
+    Read straight from the archive files, so it works in the web worker too.
+    """
+    try:
+        return jsonify(Archive().aggregate(since=request.args.get('since', type=float),
+                                           until=request.args.get('until', type=float),
+                                           node=request.args.get('node') or None,
+                                           port=request.args.get('port') or None,
+                                           bucket=request.args.get('bucket', 86400, type=float)))
+    except ValueError as e:
+        abort(400, description=str(e))
+
+
+PACKET_FILTERS = ['node', 'type', 'channel', 'since', 'until', 'min_hops', 'max_hops', 'min_rssi', 'text']
+MESSAGE_FILTERS = ['node', 'channel', 'since', 'until', 'text']
+
+
+def query_args(names):
+    """Filters, cursor and limit from the query string"""
+    filters = {name: request.args[name] for name in names if request.args.get(name, '') != ''}
+    return filters, request.args.get('cursor', type=int), min(max(request.args.get('limit', 100, type=int), 1), 1000)
+
+
+@app.route('/api/packets')
+def get_packets():
+    """
+    Packets, newest first, filtered on any of PACKET_FILTERS.  Pass next_cursor back as ?cursor=
+    to get the next page.
+    """
+    filters, cursor, limit = query_args(PACKET_FILTERS)
+    try:
+        return jsonify(status.query_packets(filters, cursor, limit))
+    except ValueError as e:
+        abort(400, description=f"Bad filter: {e}")
+
+
+@app.route('/api/messages')
+def get_messages():
+    """Messages, newest first, filtered on any of MESSAGE_FILTERS, paginated like /api/packets"""
+    filters, cursor, limit = query_args(MESSAGE_FILTERS)
+    try:
+        return jsonify(status.query_messages(filters, cursor, limit))
+    except ValueError as e:
+        abort(400, description=f"Bad filter: {e}")
+
+
+@app.route('/api/search')
+def search_messages():
+    """Messages containing every word of ?q= (text, sender, recipient or channel), best match first"""
+    query = request.args.get('q', '')
+    if not query.strip():
+        abort(400, description="Missing required 'q' parameter")
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(request.args.get('limit', 20, type=int), 200)
+    return jsonify(status.search_messages(query, offset, limit))
+
+
+@app.route('/api/threads')
+def get_threads():
+    """Conversations (channels and DM peers) with unread counts, most recently active first"""
+    return jsonify(status.get_threads())
+
+
+@app.route('/api/threads/<path:key>', methods=['GET'])
+def get_thread(key):
+    """One conversation, newest first; pass next_cursor back as ?cursor= for older messages"""
+    page = status.get_thread(key, request.args.get('cursor', type=int),
+                             min(max(request.args.get('limit', 100, type=int), 1), 1000))
+    if page is None:
+        abort(404, description=f"No thread {key}")
+    return jsonify(page)
+
+
+@app.route('/api/threads/<path:key>/read', methods=['POST'])
+def mark_thread_read(key):
+    if not status.mark_thread_read(key):
+        abort(404, description=f"No thread {key}")
+    return jsonify({'success': True})
+
+
+@app.route('/api/export/<kind>')
+def export_history(kind):
+    """
+    Stream packets, messages, nodes or telemetry as ?format=ndjson (default) or csv, optionally
+    ?gzip=1, filtered by the same query parameters as the other APIs (see export.FILTERS)
+    """
+    fmt = request.args.get('format', 'ndjson')
+    compress = request.args.get('gzip', '0') not in ('0', 'false', '')
+    if kind not in export.KINDS or fmt not in export.FORMATS:
+        abort(400, description=f"Expected /api/export/<{'|'.join(export.KINDS)}>?format=<{'|'.join(export.FORMATS)}>")
+
+    try:
+        chunks = export.export(kind, fmt, request.args.to_dict(), compress)
+    except ValueError as e:
+        abort(400, description=f"Bad filter: {e}")
+    return Response(chunks,
+                    mimetype='application/gzip' if compress else export.FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename={export.filename(kind, fmt, compress)}'})
+
 
 @app.route('/api/details')
 def get_details():
@@ -108,10 +433,14 @@ def get_details():
 
     try:
         # Fetch the data for the given ID
-        # Replace this with your actual data fetching logic
-        item_data = NodeData().lookup_by_id('!' + item_id)
+        if WEB_WORKER:
+            item_data = SharedStore().get('node_details', {}).get('!' + item_id)
+            stats = SharedStore().get('link_stats', {}).get('!' + item_id)
+        else:
+            item_data = NodeData().lookup_by_id('!' + item_id)
+            stats = LinkStats().get_node('!' + item_id)
 
-        return render_template('details.html', data = item_data)
+        return render_template('details.html', data = item_data, stats = stats)
 
     except ValueError as e:
         abort(404, description=f"Item {item_id} not found")
@@ -162,6 +491,16 @@ def send_channel():
 @app.route('/api/localnode')
 def get_local_node_info():
     """Return detailed information about the local node"""
+    if WEB_WORKER:
+        info = SharedStore().get('localnode')
+        if info is None:
+            abort(503, description='Waiting for the ingest process to publish data')
+    else:
+        info = build_local_node_info()
+    return render_template('localnode.html', data=info)
+
+
+def build_local_node_info():
     m = Mesh()
 
     # Basic node data
@@ -230,20 +569,24 @@ def get_local_node_info():
         'channels': m.channels
     }
 
-    return render_template('localnode.html', data=info)
+    return info
 
 
 @app.route('/api/config')
 def get_config_page():
     """Return the configuration page HTML"""
-    nc = NodeConfig()
-    all_config = nc.get_all_config()
+    if WEB_WORKER:
+        all_config = SharedStore().get('config_all', {})
+    else:
+        all_config = NodeConfig().get_all_config()
     return render_template('nodeconfig.html', config=all_config)
 
 
 @app.route('/api/config/all')
 def get_all_config():
     """Return all configuration as JSON"""
+    if WEB_WORKER:
+        return jsonify(SharedStore().get('config_all', {}))
     nc = NodeConfig()
     return jsonify(nc.get_all_config())
 
@@ -516,6 +859,15 @@ def update_channel(channel_index):
     return jsonify(result)
 
 
+@app.route('/api/config/batch', methods=['POST'])
+def update_config_batch():
+    """Update several config sections and channels in a single settings transaction"""
+    nc = NodeConfig()
+    data = request.get_json()
+    result = nc.update_config_batch(data.get('sections'), data.get('channels'))
+    return jsonify(result)
+
+
 @app.route('/api/config/reboot', methods=['POST'])
 def reboot_node():
     """Reboot the Meshtastic node"""
@@ -550,7 +902,11 @@ def find_free_port():
 #    │    having to click.                                      │
 #    └──────────────────────────────────────────────────────────┘
 if __name__ == '__main__':
-    listener = Listener()
+    # In the background the page is up at once, showing progress until everything's ready
+    if Config().get('startup.background', True):
+        Startup().start(STARTUP_STEPS)
+    elif not Startup().run(STARTUP_STEPS):
+        sys.exit(1)
     port = find_free_port()
     if os.name == 'nt':
         os.system(f'explorer "http:/127.0.0.1:{port}"')
@@ -1,10 +1,18 @@
 import uuid
 from datetime import datetime
 
+from airtime import Airtime
+from anomaly import Anomalies
+from archive import Archive
 from config import Config
+from linkstats import LinkStats
 from mesh import Mesh
+from metrics import Metrics
 from nodedata import NodeData
+from rates import Rates
 from status import Status
+from topology import Topology
+from traceroute import Traceroutes
 from utilities import get_datestamp, format_seconds, calculate_distance
 
 
@@ -14,9 +22,16 @@ def short_uuid():
 
 
 class Message:
-    def __init__(self, interface, packet):
+    def __init__(self, interface, packet, replay=None):
+        """
+        :param replay: None for live packets.  For packets read back from a log (see backfill.py),
+                       {'nodes': {node id: node}, 'local': local node number or None, 'received': when
+                       the packet was logged, 'archive': whether to add it to the Archive}; nothing is
+                       logged or sent, and nothing asks the radio.
+        """
         self.interface = interface
         self.packet = packet
+        self.replay = replay
         self.status = Status()
         self.app2type = {
             'TEXT_MESSAGE_APP': 'Text',
@@ -24,13 +39,15 @@ class Message:
             'POSITION_APP': 'Position',
             'NODEINFO_APP': 'NodeInfo'
         }
-        self.formatted_date = get_datestamp()
+        self.formatted_date = replay['received'] if replay else get_datestamp()
         self.fromId = None
         self.toId = None
         self.application = None
         self.hops = -1
         self.fromName = ''
         self.decoded = {}
+        self.dedup_key = None
+        self.throttled = False
 
     def handle_message(self):
         if 'rxTime' in self.packet:
@@ -54,17 +71,47 @@ class Message:
         elif 'hopStart' in self.packet:
             self.hops = self.packet.get('hopStart')
 
-        self.log_packet_to_file()
+        if not self.replay:
+            self.log_packet_to_file()
+            Airtime().add_packet(self.packet, self.fromId, self.application)
+
+        # A rebroadcast of a packet we've already handled only updates that packet's row
+        if self.packet.get('id'):
+            self.dedup_key = (self.packet['from'], self.packet['id'])
+        if self.status.seen_packet(self.dedup_key, self.hops, self.packet.get('rxRssi', ''), self.packet.get('rxSnr', '')):
+            return
 
         # we get a lot of TELEMETRY_APP packets from ourselves that aren't transmitted, just sent back to the local computer
-        if self.packet['from'] == Mesh().node.localNode.nodeNum and self.application == 'TELEMETRY_APP':
+        if self.packet['from'] == self.local_node_num() and self.application == 'TELEMETRY_APP':
             return
 
         self.increment_count()
+        if not self.replay:
+            LinkStats().add_packet(self.fromId, self.packet.get('rxRssi'), self.packet.get('rxSnr'), self.hops)
+            self.throttled = Anomalies().check(self.fromId, self.application)
+            Archive().add_packet(self.packet, self.application, self.hops)
+        elif self.replay.get('archive'):
+            Archive().add_packet(self.packet, self.application, self.hops, self.received_time())
 
         # Process the packet
         self.handle_packet()
 
+    def lookup_node(self, node_id):
+        if self.replay:
+            return self.replay['nodes'].get(node_id)
+        return NodeData().lookup_by_id(node_id)
+
+    def local_node_num(self):
+        if self.replay:
+            return self.replay.get('local')
+        return Mesh().node.localNode.nodeNum
+
+    def received_time(self):
+        """When the packet arrived, as epoch seconds (for the row stores' retention)"""
+        if 'rxTime' in self.packet:
+            return self.packet['rxTime']
+        return datetime.strptime(self.formatted_date, "%Y-%m-%d %H:%M:%S").timestamp()
+
     def log_packet_to_file(self):
         # Write packet to packetlog.txt
         with open('packetlog.txt', 'a') as f:
@@ -74,7 +121,7 @@ class Message:
         # print(f'{self.application}: {self.fromId} → {self.toId}', flush=True)
         if self.fromId is not None:
             self.fromName = self.fromId
-            node = NodeData().lookup_by_id(self.fromId)
+            node = self.lookup_node(self.fromId)
             if node is not None:
                 self.fromName = f"{self.fromId} {node['user.longName']}"
 
@@ -96,10 +143,16 @@ class Message:
             elif self.application == 'TRACEROUTE_APP':
                 self.handle_traceroute()
 
+            elif self.application == 'NEIGHBORINFO_APP':
+                self.handle_neighborinfo()
+
             else:
                 self.handle_other()
 
     def add_node_to_ui(self, message_type, node_info_string):
+        # A node flooding the mesh doesn't get to push everyone else out of the packet table
+        if self.throttled:
+            return
         id = 'id' + short_uuid()
         name = self.fromName.split(' ')
 
@@ -110,13 +163,20 @@ class Message:
             self.packet.get('rxRssi', ''),
             message_type,
             node_info_string,
-            self.fromId
+            self.fromId,
+            self.packet.get('rxSnr', ''),
+            self.dedup_key,
+            self.application,
+            self.packet.get('channel', 0),
+            self.received_time() if self.replay else None
         )
 
     def handle_other(self):
         self.add_node_to_ui('-', self.application)
 
     def handle_traceroute(self):
+        Topology().add_traceroute(self.packet)
+
         route_to = []
         route = [int(self.packet['toId'][1:], 16)]
         if 'route' in self.packet['decoded']['traceroute']:
@@ -128,12 +188,24 @@ class Message:
         for hop in route:
             self.hops += 1
             node_id = f'!{int(hop):08x}'
-            hop_node = NodeData().lookup_by_id(node_id)
+            hop_node = self.lookup_node(node_id)
             if hop_node and hop_node.get('user.longName'):
                 node_id = hop_node.get('user.longName')
             route_to.append(node_id)
 
-        self.add_node_to_ui('TR', f'Routing: {'→'.join(route_to)}')
+        job = None
+        request_id = self.packet['decoded'].get('requestId')
+        # Only a reply to us can answer one of our traceroutes, not a traceroute the node sent itself
+        if not self.replay and request_id and self.packet.get('to') == self.local_node_num():
+            job = Traceroutes().complete(self.packet['from'], request_id, [f'!{int(hop):08x}' for hop in route],
+                                         self.packet['decoded']['traceroute'].get('snrTowards'))
+        rtt = f' ({job["rtt"]}s)' if job else ''
+
+        self.add_node_to_ui('TR', f'Routing: {'→'.join(route_to)}{rtt}')
+
+    def handle_neighborinfo(self):
+        count = Topology().add_neighborinfo(self.packet)
+        self.add_node_to_ui('NB', f'{count} neighbors')
 
     def handle_text(self):
         data = self.flatten_packet()
@@ -148,12 +220,23 @@ class Message:
             text = data['text']
         else:
             text = '*** ENCRYPTED TEXT ***'
-        self.status.add_msg(data['received'], data['fromName'], data['toName'], data['channel'], text, self.fromId)
+        # DMs are threaded by whoever is on the other end, everything else by channel
+        if self.toId != '^all':
+            if self.packet['from'] == self.local_node_num():
+                thread, title = f'dm:{self.toId}', data['toName']
+            else:
+                thread, title = f'dm:{self.fromId}', data['fromName']
+        else:
+            thread, title = f'ch:{data["channel"]}', data['channel']
+        self.status.add_msg(data['received'], data['fromName'], data['toName'], data['channel'], text, self.fromId,
+                            thread, title, self.received_time() if self.replay else None)
 
         self.add_node_to_ui('Text', text[:32])
 
     def handle_telemetry(self):
         telemetry = self.decoded.get('telemetry', {})
+        if not self.replay:
+            Metrics().add_telemetry(self.fromId, telemetry)
         metrics = telemetry.get('deviceMetrics', {})
         if metrics.get('uptimeSeconds'):
             self.add_node_to_ui('🕑', f'{format_seconds(metrics.get("uptimeSeconds", 0))} uptime')
@@ -164,10 +247,10 @@ class Message:
 
     def increment_count(self):
         # Increment the count for the app type
-        if self.application in self.app2type:
-            self.status.add_count(self.app2type[self.application])
-        else:
-            self.status.add_count('Other')
+        packet_type = self.app2type.get(self.application, 'Other')
+        self.status.add_count(packet_type)
+        if not self.replay:
+            Rates().add(packet_type, self.packet.get('channel', 0), self.fromId)
 
     def handle_nodeinfo(self):
         user = self.decoded.get('user', {})
@@ -222,19 +305,17 @@ class Message:
         data['fromName'] = self.fromId
         data['toName'] = self.toId
 
-        node = NodeData().lookup_by_id(self.fromId)
+        node = self.lookup_node(self.fromId)
         if node is not None:
             data['fromName'] = node['user.longName']
 
-        node = NodeData().lookup_by_id(self.toId)
+        node = self.lookup_node(self.toId)
         if node is not None:
             data['toName'] = node['user.longName']
 
         if 'rxTime' in self.packet:
-            dt = datetime.fromtimestamp(self.packet['rxTime'])
+            data['received'] = datetime.fromtimestamp(self.packet['rxTime']).strftime('%Y-%m-%d %H:%M:%S')
         else:
-            dt = datetime.now()
-
-        data['received'] = dt.strftime('%Y-%m-%d %H:%M:%S')
+            data['received'] = self.formatted_date
 
         return data
@@ -0,0 +1,197 @@
+"""
+Device Metrics Time Series for Meshtastic Monitor
+
+Keeps the numbers nodes report in TELEMETRY_APP packets (battery level,
+voltage, channel utilization, airUtilTx and any environment readings) as
+compact time series, one per node and metric, so they can be charted.
+
+Each series is stored at three resolutions, each kept for its own length of
+time: every raw sample, one-minute rollups and one-hour rollups.  Rollups
+(count, mean, min, max) are built as samples arrive, so a query never has to
+aggregate raw data.  Columns are arrays of doubles, not lists of dicts.
+"""
+
+import bisect
+import threading
+import time
+from array import array
+
+from config import Config
+
+# Telemetry sections we keep, and the fields we want from deviceMetrics (environment: all of them)
+DEVICE_METRICS = ('batteryLevel', 'voltage', 'channelUtilization', 'airUtilTx')
+ENVIRONMENT_SECTION = 'environmentMetrics'
+
+RESOLUTIONS = {'raw': 0, 'minute': 60, 'hour': 3600}
+
+
+class Tier:
+    """One resolution of a series: parallel columns of bucket start, count, sum, min and max"""
+
+    def __init__(self, retention):
+        self.retention = retention
+        self.start = 0      # Rows before this have expired and are waiting to be compacted away
+        self.times = array('d')
+        self.counts = array('d')
+        self.totals = array('d')
+        self.mins = array('d')
+        self.maxs = array('d')
+
+    def append(self, t, count, total, low, high):
+        self.times.append(t)
+        self.counts.append(count)
+        self.totals.append(total)
+        self.mins.append(low)
+        self.maxs.append(high)
+        self.trim(t - self.retention)
+
+    def trim(self, cutoff):
+        self.start = bisect.bisect_left(self.times, cutoff, self.start)
+        # Only move memory around once the dead rows are at least half the arrays
+        if self.start > 64 and self.start * 2 > len(self.times):
+            for column in (self.times, self.counts, self.totals, self.mins, self.maxs):
+                del column[:self.start]
+            self.start = 0
+
+    def query(self, since, until):
+        first = bisect.bisect_left(self.times, since, self.start)
+        last = bisect.bisect_right(self.times, until, first)
+        return [
+            [self.times[i], round(self.totals[i] / self.counts[i], 3), self.mins[i], self.maxs[i]]
+            for i in range(first, last)
+        ]
+
+
+class Series:
+    """Raw samples of one metric of one node, plus its minute and hour rollups"""
+
+    def __init__(self, retention):
+        self.tiers = {name: Tier(retention[name]) for name in RESOLUTIONS}
+        self.open = {'minute': None, 'hour': None}  # Rollup buckets still filling: [start, count, sum, min, max]
+        self.last = None
+
+    def add(self, t, value):
+        # Samples are timestamped as they arrive, but don't let a clock step break the ordering
+        if self.last is not None and t < self.last[0]:
+            t = self.last[0]
+        self.last = (t, value)
+        self.tiers['raw'].append(t, 1, value, value, value)
+
+        for name in ('minute', 'hour'):
+            start = t - t % RESOLUTIONS[name]
+            bucket = self.open[name]
+            if bucket is not None and bucket[0] != start:
+                self.tiers[name].append(*bucket)
+                bucket = None
+            if bucket is None:
+                self.open[name] = [start, 1, value, value, value]
+            else:
+                bucket[1] += 1
+                bucket[2] += value
+                bucket[3] = min(bucket[3], value)
+                bucket[4] = max(bucket[4], value)
+
+    def query(self, resolution, since, until):
+        points = self.tiers[resolution].query(since, until)
+        bucket = self.open.get(resolution)
+        if bucket is not None and since <= bucket[0] <= until:
+            points.append([bucket[0], round(bucket[2] / bucket[1], 3), bucket[3], bucket[4]])
+        return points
+
+
+class Metrics:
+    """Singleton holding a Series for every (node, metric) we've had telemetry for"""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(Metrics, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        config = Config()
+        self.retention = {
+            'raw': config.get('metrics.raw_retention', 24 * 3600),
+            'minute': config.get('metrics.minute_retention', 7 * 24 * 3600),
+            'hour': config.get('metrics.hour_retention', 90 * 24 * 3600)
+        }
+        self.lock = threading.Lock()
+        self.series = {}    # node id -> {metric name -> Series}
+        self._initialized = True
+
+    def add_telemetry(self, node_id, telemetry, now=None):
+        """Record every metric we keep from a TELEMETRY_APP payload"""
+        now = now or time.time()
+        values = {}
+        device = telemetry.get('deviceMetrics', {})
+        for name in DEVICE_METRICS:
+            if isinstance(device.get(name), (int, float)):
+                values[name] = device[name]
+        for name, value in telemetry.get(ENVIRONMENT_SECTION, {}).items():
+            if isinstance(value, (int, float)):
+                values[name] = value
+
+        if not values:
+            return
+        with self.lock:
+            node = self.series.setdefault(node_id, {})
+            for name, value in values.items():
+                series = node.get(name)
+                if series is None:
+                    series = node[name] = Series(self.retention)
+                series.add(now, float(value))
+
+    def get_metrics(self, node_id):
+        """The metrics we have for a node, with their latest sample"""
+        with self.lock:
+            return {name: {'time': series.last[0], 'value': series.last[1]}
+                    for name, series in self.series.get(node_id, {}).items()}
+
+    @staticmethod
+    def pick_resolution(since, until):
+        """Finest resolution that keeps a chart to a few thousand points at most"""
+        span = until - since
+        if span <= 6 * 3600:
+            return 'raw'
+        if span <= 2 * 24 * 3600:
+            return 'minute'
+        return 'hour'
+
+    def query(self, node_id, metric, since=None, until=None, resolution='auto'):
+        """
+        Points for one metric of one node between since and until (epoch seconds)
+
+        :return: {'resolution', 'points': [[time, mean, min, max], ...]}, or None if there's no such series
+        """
+        until = time.time() if until is None else until
+        since = until - 24 * 3600 if since is None else since
+        if resolution == 'auto':
+            resolution = self.pick_resolution(since, until)
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f'Unknown resolution {resolution}, expected one of auto, {", ".join(RESOLUTIONS)}')
+
+        with self.lock:
+            series = self.series.get(node_id, {}).get(metric)
+            if series is None:
+                return None
+            return {'resolution': resolution, 'points': series.query(resolution, since, until)}
+
+    def export(self, node_id=None, metric=None, since=None, until=None, resolution='raw'):
+        """
+        Every point of every matching series, one series at a time, as
+        {'node', 'metric', 'time', 'mean', 'min', 'max'}
+        """
+        with self.lock:
+            keys = [(node, name) for node, series in self.series.items() for name in series
+                    if (node_id is None or node == node_id) and (metric is None or name == metric)]
+        for node, name in keys:
+            result = self.query(node, name, 0 if since is None else since, until, resolution)
+            for t, mean, low, high in (result or {}).get('points', []):
+                yield {'node': node, 'metric': name, 'time': t, 'mean': mean, 'min': low, 'max': high}
+
+
+__all__ = ['Metrics']
@@ -5,9 +5,23 @@ This singleton service handles reading and writing Meshtastic node configuration
 through the Python API.
 """
 
+import functools
+import threading
+
 from mesh import Mesh
 
 
+def _invalidates_cache(method):
+    """Decorator for methods that change the node, so the next read rebuilds the config snapshot"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.invalidate_cache()
+    return wrapper
+
+
 class NodeConfig:
     """Singleton service for Meshtastic node configuration"""
 
@@ -143,6 +157,13 @@ class NodeConfig:
         15: 'BAUD_921600'
     }
 
+    # Config sections, by where they live on the node
+    LOCAL_SECTIONS = ('device', 'lora', 'position', 'power', 'network', 'display', 'bluetooth', 'security')
+
+    MODULE_SECTIONS = ('mqtt', 'serial', 'telemetry', 'store_forward', 'external_notification', 'range_test',
+                       'neighbor_info', 'detection_sensor', 'audio', 'remote_hardware', 'ambient_lighting',
+                       'paxcounter', 'canned_message')
+
     CHANNEL_ROLES = {
         0: 'DISABLED',
         1: 'PRIMARY',
@@ -158,10 +179,30 @@ class NodeConfig:
     def __init__(self):
         if self._initialized:
             return
+        self._node = None
+        self._config_cache = None
+        self._cache_lock = threading.Lock()
         self._initialized = True
 
+    @classmethod
+    def for_node(cls, local_node):
+        """Standalone (not the singleton) NodeConfig for some other node, used by the fleet tools"""
+        nc = super(NodeConfig, cls).__new__(cls)
+        nc._node = local_node
+        nc._config_cache = None
+        nc._cache_lock = threading.Lock()
+        nc._initialized = True
+        return nc
+
+    def invalidate_cache(self):
+        """Forget the cached config snapshot (after writes, reboots and reconnects)"""
+        with self._cache_lock:
+            self._config_cache = None
+
     def _get_local_node(self):
-        """Get the local node from the Mesh singleton"""
+        """Get the local node from the Mesh singleton (or the node we were built for)"""
+        if self._node is not None:
+            return self._node
         return Mesh().node.localNode
 
     def _get_local_config(self):
@@ -183,15 +224,23 @@ class NodeConfig:
         except Exception:
             return default
 
+    # Option lists keyed by (enum, selected value); the enums never change, so these
+    # are built once and shared by every snapshot
+    _enum_options = {}
+
     def _enum_to_options(self, enum_dict, current_value):
         """Convert enum dict to list of options with current selection marked"""
-        options = []
-        for value, name in enum_dict.items():
-            options.append({
-                'value': value,
-                'name': name,
-                'selected': value == current_value
-            })
+        key = (id(enum_dict), current_value)
+        options = self._enum_options.get(key)
+        if options is None:
+            options = []
+            for value, name in enum_dict.items():
+                options.append({
+                    'value': value,
+                    'name': name,
+                    'selected': value == current_value
+                })
+            self._enum_options[key] = options
         return options
 
     def get_device_config(self) -> dict:
@@ -665,7 +714,18 @@ class NodeConfig:
             return {'success': False, 'error': str(e)}
 
     def get_all_config(self) -> dict:
-        """Get all configuration sections"""
+        """Get all configuration sections, from the cached snapshot when we have one"""
+        with self._cache_lock:
+            if self._config_cache is not None:
+                return self._config_cache
+            config = self._read_all_config()
+            # Don't hang on to a snapshot with failed sections, try again next time
+            if all(section.get('success') for section in config.values()):
+                self._config_cache = config
+            return config
+
+    def _read_all_config(self) -> dict:
+        """Read every configuration section from the node"""
         return {
             'device': self.get_device_config(),
             'lora': self.get_lora_config(),
@@ -693,6 +753,7 @@ class NodeConfig:
 
     # Update methods
 
+    @_invalidates_cache
     def update_device_config(self, **kwargs) -> dict:
         """Update device configuration"""
         try:
@@ -709,6 +770,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_lora_config(self, **kwargs) -> dict:
         """Update LoRa configuration"""
         try:
@@ -743,6 +805,7 @@ class NodeConfig:
             traceback.print_exc()
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_position_config(self, **kwargs) -> dict:
         """Update position configuration"""
         try:
@@ -759,6 +822,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_power_config(self, **kwargs) -> dict:
         """Update power configuration"""
         try:
@@ -775,6 +839,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_network_config(self, **kwargs) -> dict:
         """Update network configuration"""
         try:
@@ -791,6 +856,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_display_config(self, **kwargs) -> dict:
         """Update display configuration"""
         try:
@@ -807,6 +873,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_bluetooth_config(self, **kwargs) -> dict:
         """Update Bluetooth configuration"""
         try:
@@ -823,6 +890,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_security_config(self, **kwargs) -> dict:
         """Update security configuration"""
         try:
@@ -841,6 +909,7 @@ class NodeConfig:
 
     # Module update methods
 
+    @_invalidates_cache
     def update_mqtt_config(self, **kwargs) -> dict:
         """Update MQTT module configuration"""
         try:
@@ -857,6 +926,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_serial_config(self, **kwargs) -> dict:
         """Update Serial module configuration"""
         try:
@@ -873,6 +943,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_telemetry_config(self, **kwargs) -> dict:
         """Update Telemetry module configuration"""
         try:
@@ -889,6 +960,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_store_forward_config(self, **kwargs) -> dict:
         """Update Store & Forward module configuration"""
         try:
@@ -905,6 +977,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_external_notification_config(self, **kwargs) -> dict:
         """Update External Notification module configuration"""
         try:
@@ -921,6 +994,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_range_test_config(self, **kwargs) -> dict:
         """Update Range Test module configuration"""
         try:
@@ -937,6 +1011,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_neighbor_info_config(self, **kwargs) -> dict:
         """Update Neighbor Info module configuration"""
         try:
@@ -953,6 +1028,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_detection_sensor_config(self, **kwargs) -> dict:
         """Update Detection Sensor module configuration"""
         try:
@@ -969,6 +1045,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_audio_config(self, **kwargs) -> dict:
         """Update Audio module configuration"""
         try:
@@ -985,6 +1062,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_remote_hardware_config(self, **kwargs) -> dict:
         """Update Remote Hardware module configuration"""
         try:
@@ -1001,6 +1079,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_ambient_lighting_config(self, **kwargs) -> dict:
         """Update Ambient Lighting module configuration"""
         try:
@@ -1017,6 +1096,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_paxcounter_config(self, **kwargs) -> dict:
         """Update Paxcounter module configuration"""
         try:
@@ -1033,6 +1113,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_canned_message_config(self, **kwargs) -> dict:
         """Update Canned Message module configuration"""
         try:
@@ -1078,6 +1159,7 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @_invalidates_cache
     def update_channel_config(self, channel_index: int, **kwargs) -> dict:
         """Update a specific channel configuration"""
         try:
@@ -1116,6 +1198,124 @@ class NodeConfig:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    def _section_config(self, node, section):
+        """Get the protobuf for a config section, local or module"""
+        if section in self.LOCAL_SECTIONS:
+            return getattr(node.localConfig, section)
+        if section in self.MODULE_SECTIONS:
+            return getattr(node.moduleConfig, section)
+        raise ValueError(f'Unknown config section: {section}')
+
+    def _channel_changes(self, channel, kwargs) -> dict:
+        """Work out which channel fields differ from what the node already has"""
+        current = {
+            'role': channel.role,
+            'name': channel.settings.name,
+            'psk': channel.settings.psk.hex() if channel.settings.psk else '',
+            'uplink_enabled': channel.settings.uplink_enabled,
+            'downlink_enabled': channel.settings.downlink_enabled,
+        }
+        changes = {}
+        for key, value in kwargs.items():
+            if key not in current or current[key] == value:
+                continue
+            # An empty PSK in a form means "leave it alone", as in update_channel_config
+            if key == 'psk' and not value:
+                continue
+            changes[key] = value
+        return changes
+
+    @_invalidates_cache
+    def update_config_batch(self, sections: dict = None, channels: dict = None) -> dict:
+        """
+        Update many config sections and channels in one settings transaction
+
+        :param sections: {section name: {field: value}}, as for the update_*_config methods
+        :param channels: {channel index: {field: value}}, as for update_channel_config
+        :return: overall success plus a result per section and per channel; sections and
+                 channels whose values already match the node are skipped, not written
+        """
+        sections = sections or {}
+        channels = channels or {}
+        results = {'sections': {}, 'channels': {}}
+
+        try:
+            node = self._get_local_node()
+
+            # Diff everything first, so we only open a transaction if there's something to write
+            section_changes = {}
+            for section, fields in sections.items():
+                try:
+                    config = self._section_config(node, section)
+                except ValueError as e:
+                    results['sections'][section] = {'success': False, 'error': str(e)}
+                    continue
+                changes = {key: value for key, value in fields.items()
+                           if hasattr(config, key) and getattr(config, key) != value}
+                if changes:
+                    section_changes[section] = changes
+                else:
+                    results['sections'][section] = {'success': True, 'skipped': True, 'changed': []}
+
+            channel_changes = {}
+            for index, fields in channels.items():
+                index = int(index)
+                if index < 0 or index >= len(node.channels):
+                    results['channels'][str(index)] = {'success': False, 'error': f'Invalid channel index: {index}'}
+                    continue
+                changes = self._channel_changes(node.channels[index], fields)
+                if changes:
+                    channel_changes[index] = changes
+                else:
+                    results['channels'][str(index)] = {'success': True, 'skipped': True, 'changed': []}
+
+            if section_changes or channel_changes:
+                node.ensureSessionKey()
+                node.beginSettingsTransaction()
+
+                for section, changes in section_changes.items():
+                    try:
+                        config = self._section_config(node, section)
+                        for key, value in changes.items():
+                            setattr(config, key, value)
+                        node.writeConfig(section)
+                        results['sections'][section] = {'success': True, 'changed': list(changes)}
+                    except Exception as e:
+                        results['sections'][section] = {'success': False, 'error': str(e)}
+
+                for index, changes in channel_changes.items():
+                    try:
+                        channel = node.channels[index]
+                        if 'role' in changes:
+                            channel.role = changes['role']
+                        for key in ('name', 'uplink_enabled', 'downlink_enabled'):
+                            if key in changes:
+                                setattr(channel.settings, key, changes[key])
+                        if 'psk' in changes:
+                            channel.settings.psk = bytes.fromhex(changes['psk'])
+                        node.writeChannel(index)
+                        results['channels'][str(index)] = {'success': True, 'changed': list(changes)}
+                    except Exception as e:
+                        results['channels'][str(index)] = {'success': False, 'error': str(e)}
+
+                node.commitSettingsTransaction()
+
+            print(f'[CONFIG] Batch update wrote {len(section_changes)} sections, {len(channel_changes)} channels', flush=True)
+            outcomes = list(results['sections'].values()) + list(results['channels'].values())
+            return {
+                'success': all(r['success'] for r in outcomes),
+                'reboot_required': any(results['sections'][section]['success'] for section in section_changes),
+                **results
+            }
+        except (ConnectionResetError, BrokenPipeError, OSError) as e:
+            # As with LoRa writes, the device may reboot itself as soon as it commits
+            print(f'[CONFIG] Connection error during batch config write (this may be normal): {e}', flush=True)
+            return {'success': True, 'reboot_required': True, 'note': 'Config sent, connection lost (device may have auto-rebooted)', **results}
+        except Exception as e:
+            print(f'[CONFIG] ERROR in batch config update: {e}', flush=True)
+            return {'success': False, 'error': str(e), **results}
+
+    @_invalidates_cache
     def reboot_node(self) -> dict:
         """Reboot the Meshtastic node"""
         try:
@@ -0,0 +1,126 @@
+"""
+Packet Rates for Meshtastic Monitor
+
+Status.counts only has lifetime totals; these are sliding-window counters
+(packets in the last minute, 15 minutes and hour) per app type, per channel
+and per sending node, so you can see how busy the mesh is right now.
+
+Each window is a ring of slots with a running total: adding a packet or
+reading a window costs the same however busy the mesh is.  Slots that have
+slid out of the window are only cleared as time moves past them.
+"""
+
+import threading
+import time
+
+# Window name -> (length in seconds, slots in the ring)
+WINDOWS = {'1m': (60, 60), '15m': (900, 60), '1h': (3600, 60)}
+
+
+class Window:
+    """Count of events in the last `span` seconds, to a resolution of span / slots"""
+
+    def __init__(self, span, slots):
+        self.width = span / slots
+        self.counts = [0] * slots
+        self.total = 0
+        self.head = None    # Absolute number of the newest slot
+
+    def _advance(self, now):
+        slot = int(now // self.width)
+        if self.head is None or slot - self.head >= len(self.counts):
+            # Nothing in the ring is recent enough to keep
+            self.counts = [0] * len(self.counts)
+            self.total = 0
+        else:
+            for old in range(self.head + 1, slot + 1):
+                index = old % len(self.counts)
+                self.total -= self.counts[index]
+                self.counts[index] = 0
+        if self.head is None or slot > self.head:
+            self.head = slot
+
+    def add(self, now, n=1):
+        self._advance(now)
+        self.counts[self.head % len(self.counts)] += n
+        self.total += n
+
+    def get(self, now):
+        self._advance(now)
+        return self.total
+
+
+class RateCounter:
+    """One Window per entry in WINDOWS (n can be any amount, e.g. seconds of airtime)"""
+
+    def __init__(self):
+        self.windows = {name: Window(*spec) for name, spec in WINDOWS.items()}
+
+    def add(self, now, n=1):
+        for window in self.windows.values():
+            window.add(now, n)
+
+    def get(self, now):
+        return {name: window.get(now) for name, window in self.windows.items()}
+
+
+class Rates:
+    """Singleton holding the counters by app type, channel and node"""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(Rates, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        self.lock = threading.Lock()
+        self.total = RateCounter()
+        self.groups = {'types': {}, 'channels': {}, 'nodes': {}}
+        self._initialized = True
+
+    def add(self, packet_type, channel, node_id, now=None):
+        now = now or time.time()
+        with self.lock:
+            self.total.add(now)
+            for group, key in (('types', packet_type), ('channels', channel), ('nodes', node_id)):
+                counter = self.groups[group].get(key)
+                if counter is None:
+                    counter = self.groups[group][key] = RateCounter()
+                counter.add(now)
+
+    def get_type_rates(self, columns):
+        """Rates for each of the summary columns ('Total' included), per window"""
+        now = time.time()
+        with self.lock:
+            rates = {name: [] for name in WINDOWS}
+            for column in columns:
+                counter = self.total if column == 'Total' else self.groups['types'].get(column)
+                values = counter.get(now) if counter else {}
+                for name in WINDOWS:
+                    rates[name].append(values.get(name, 0))
+            return rates
+
+    def get_rates(self, top=50):
+        """Everything, with nodes limited to the `top` busiest in the last minute (then 15m, 1h)"""
+        now = time.time()
+        with self.lock:
+            result = {'windows': list(WINDOWS), 'total': self.total.get(now)}
+            for group, counters in self.groups.items():
+                values = {key: counter.get(now) for key, counter in counters.items()}
+                # Forget whatever hasn't been heard from for the longest window
+                for key in [key for key, counts in values.items() if not counts['1h']]:
+                    del counters[key]
+                    del values[key]
+                result[group] = values
+
+            busiest = sorted(result['nodes'].items(), key=lambda item: tuple(item[1].values()), reverse=True)
+            result['nodes'] = dict(busiest[:top])
+            return result
+
+
+__all__ = ['Rates']
@@ -0,0 +1,88 @@
+"""
+Message Search for Meshtastic Monitor
+
+An inverted index over message text, sender, recipient and channel: every
+word points at the messages containing it (and how often), so a search only
+looks at messages that contain the words asked for, never the whole history.
+MSGs keeps it up to date as messages are added and trimmed.
+
+Results are ranked with BM25, the usual search-engine scoring: rare words
+count for more than common ones, and a word in a short message counts for
+more than the same word in a long one.  Ties go to the newest message.
+"""
+
+import heapq
+import math
+import re
+
+WORD = re.compile(r'\w+')
+
+# BM25 tuning, the usual defaults
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    return WORD.findall(text.lower())
+
+
+class SearchIndex:
+    def __init__(self):
+        self.postings = {}      # word -> {sequence number: times it appears}
+        self.lengths = {}       # sequence number -> words in the message
+        self.total_length = 0
+
+    def add(self, seq, text):
+        words = tokenize(text)
+        self.lengths[seq] = len(words)
+        self.total_length += len(words)
+        for word in words:
+            posting = self.postings.setdefault(word, {})
+            posting[seq] = posting.get(seq, 0) + 1
+
+    def remove(self, seq, text):
+        """Take a message out; text must be what it was added with"""
+        self.total_length -= self.lengths.pop(seq, 0)
+        for word in set(tokenize(text)):
+            posting = self.postings.get(word)
+            if posting is None:
+                continue
+            posting.pop(seq, None)
+            if not posting:
+                del self.postings[word]
+
+    def search(self, query, offset=0, limit=20):
+        """
+        Messages containing every word of the query, best first
+
+        :return: (how many matched, [(seq, score), ...] for the requested page)
+        """
+        words = set(tokenize(query))
+        if not words or not self.lengths:
+            return 0, []
+        postings = [self.postings.get(word) for word in words]
+        if any(posting is None for posting in postings):
+            return 0, []
+
+        # Intersect starting from the rarest word, so the candidate set starts small
+        postings.sort(key=len)
+        matches = set(postings[0])
+        for posting in postings[1:]:
+            matches.intersection_update(posting)
+            if not matches:
+                return 0, []
+
+        count = len(self.lengths)
+        average = self.total_length / count
+        idf = [math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5)) for posting in postings]
+
+        def score(seq):
+            norm = K1 * (1 - B + B * self.lengths[seq] / average)
+            return sum(weight * posting[seq] * (K1 + 1) / (posting[seq] + norm)
+                       for weight, posting in zip(idf, postings))
+
+        ranked = heapq.nlargest(offset + limit, ((score(seq), seq) for seq in matches))
+        return len(matches), [(seq, round(value, 3)) for value, seq in ranked[offset:]]
+
+
+__all__ = ['SearchIndex', 'tokenize']
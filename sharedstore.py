@@ -0,0 +1,135 @@
+"""
+Shared Store for Meshtastic Monitor
+
+When the monitor is split into one ingest process (which owns the radio) and
+any number of web worker processes, this is how they talk to each other.  It
+is a small SQLite database in WAL mode holding:
+
+  * snapshots - JSON blobs the ingest process publishes (counts, packets,
+                messages, nodes, local node info, config) for workers to serve
+  * commands  - a local queue of requests (DMs, traceroutes, config writes...)
+                the workers hand to the ingest process, along with the result
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+from config import Config
+
+
+class SharedStore:
+    """Singleton wrapper around the shared SQLite store (one connection per thread)"""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(SharedStore, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        config = Config()
+        self.path = config.get('shared.store_path', 'shared_store.db')
+        self.poll_interval = config.get('shared.poll_interval', 0.05)
+        self.command_timeout = config.get('shared.command_timeout', 30)
+        self._local = threading.local()
+        self._create_tables()
+        self._initialized = True
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _create_tables(self):
+        conn = self._connection()
+        conn.execute('CREATE TABLE IF NOT EXISTS snapshots ('
+                     'key TEXT PRIMARY KEY, value TEXT NOT NULL, updated REAL NOT NULL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS commands ('
+                     'id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL, '
+                     "status TEXT NOT NULL DEFAULT 'pending', result TEXT, created REAL NOT NULL, finished REAL)")
+        conn.execute('CREATE INDEX IF NOT EXISTS commands_status ON commands (status, id)')
+
+    # Snapshots
+
+    def put(self, key, value):
+        """Publish a JSON-serializable value under key"""
+        self._connection().execute('INSERT OR REPLACE INTO snapshots (key, value, updated) VALUES (?, ?, ?)',
+                                   (key, json.dumps(value, default=str), time.time()))
+
+    def put_many(self, items: dict):
+        """Publish several values in one transaction so readers never see a half-updated set"""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN')
+            conn.executemany('INSERT OR REPLACE INTO snapshots (key, value, updated) VALUES (?, ?, ?)',
+                             [(key, json.dumps(value, default=str), now) for key, value in items.items()])
+
+    def get(self, key, default=None):
+        row = self._connection().execute('SELECT value FROM snapshots WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def pop(self, key, default=None):
+        """Read and delete a value, so only one worker ever sees it (used for flash messages)"""
+        row = self._connection().execute('DELETE FROM snapshots WHERE key = ? RETURNING value', (key,)).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    # Command queue
+
+    def enqueue(self, kind, payload) -> int:
+        cur = self._connection().execute('INSERT INTO commands (kind, payload, created) VALUES (?, ?, ?)',
+                                         (kind, json.dumps(payload), time.time()))
+        return cur.lastrowid
+
+    def wait_result(self, command_id, timeout=None):
+        """Block until the ingest process finishes a command; returns None on timeout"""
+        deadline = time.time() + (timeout or self.command_timeout)
+        conn = self._connection()
+        while time.time() < deadline:
+            row = conn.execute("SELECT result FROM commands WHERE id = ? AND status = 'done'",
+                               (command_id,)).fetchone()
+            if row is not None:
+                return json.loads(row[0])
+            time.sleep(self.poll_interval)
+        # Nobody picked it up in time, don't let it run later by surprise
+        conn.execute("UPDATE commands SET status = 'expired' WHERE id = ? AND status = 'pending'", (command_id,))
+        return None
+
+    def claim_commands(self, limit=16) -> list:
+        """Atomically take pending commands for execution (ingest process only)"""
+        conn = self._connection()
+        claimed = []
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute("SELECT id, kind, payload FROM commands WHERE status = 'pending' ORDER BY id LIMIT ?",
+                                (limit,)).fetchall()
+            for command_id, kind, payload in rows:
+                conn.execute("UPDATE commands SET status = 'running' WHERE id = ?", (command_id,))
+                claimed.append((command_id, kind, json.loads(payload)))
+        return claimed
+
+    def complete(self, command_id, result):
+        self._connection().execute("UPDATE commands SET status = 'done', result = ?, finished = ? WHERE id = ?",
+                                   (json.dumps(result, default=str), time.time(), command_id))
+
+    def purge_commands(self, max_age=3600):
+        """Drop finished/expired commands older than max_age seconds"""
+        self._connection().execute("DELETE FROM commands WHERE status IN ('done', 'expired') AND created < ?",
+                                   (time.time() - max_age,))
+
+
+__all__ = ['SharedStore']
@@ -0,0 +1,188 @@
+"""
+Snapshot Files for Meshtastic Monitor
+
+The saved packet and message history (persisted_data.snap).  It used to be a
+pickle of the Status objects themselves, which breaks when a class is renamed or
+pydantic changes, and has to be loaded all at once.  A snapshot is instead a
+header followed by a stream of small typed records:
+
+    header:  MAGIC, format version (u16), when it was written (f64)
+    record:  kind (u8), payload length (u32), payload
+    payload: the kind's fields in SCHEMAS order, int = i64, float = f64 and str = u32 byte
+             length, followed by the UTF-8 of all its strings, in the same order
+
+and ends with an 'end' record holding the number of records before it, so a
+file cut short is noticed.  Everything is little-endian.  Records are read one
+at a time, so loading never needs more than one record in memory besides what
+it's loading into.
+
+Changing what's saved means adding a new VERSION with its SCHEMAS entry, and a
+MIGRATIONS hook that turns records of the previous version into the new one;
+older files are then upgraded record by record as they're read.
+"""
+
+import os
+import struct
+import tempfile
+import time
+
+MAGIC = b'MMSNAP'
+VERSION = 1
+
+HEADER = struct.Struct('<6sHd')
+RECORD = struct.Struct('<BI')
+CODES = {'i': 'q', 'f': 'd', 's': 'I'}
+
+MESSAGE_FIELDS = [('msg_time', 's'), ('msg_fromId', 's'), ('msg_from', 's'), ('msg_to', 's'),
+                  ('msg_channel', 's'), ('msg_text', 's')]
+
+# Format version -> record kind number -> (name, [(field, type), ...])
+SCHEMAS = {
+    1: {
+        0: ('end', [('records', 'i')]),
+        1: ('count', [('name', 's'), ('value', 'i')]),
+        2: ('store', [('name', 's'), ('next_seq', 'i')]),
+        3: ('packet', [('seq', 'i'), ('when', 'f'), ('pk_time', 's'), ('pk_from', 's'), ('pk_id', 's'),
+                       ('pk_hops', 's'), ('pk_rssi', 's'), ('pk_type', 's'), ('pk_info', 's'), ('pk_copies', 'i'),
+                       ('pk_snr', 's'), ('pk_hops_max', 's'), ('pk_app', 's'), ('pk_channel', 's')]),
+        4: ('message', [('seq', 'i'), ('when', 'f')] + MESSAGE_FIELDS),
+        5: ('thread', [('key', 's'), ('title', 's'), ('total', 'i'), ('read', 'i'), ('last_activity', 's')]),
+        # A thread's message that is also in the message store, and one that isn't any more
+        6: ('thread_ref', [('key', 's'), ('seq', 'i')]),
+        7: ('thread_message', [('key', 's'), ('seq', 'i')] + MESSAGE_FIELDS)
+    }
+}
+
+# Version -> function(kind name, {field: value}) giving the record as the next version has it:
+# (kind name, {field: value}), or None to drop it
+MIGRATIONS = {}
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class Layout:
+    """How one kind of record is packed: a fixed-size struct, then the strings"""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.names = [field for field, kind in fields]
+        self.strings = [kind == 's' for field, kind in fields]
+        self.fixed = struct.Struct('<' + ''.join(CODES[kind] for field, kind in fields))
+
+    def encode(self, values):
+        fixed = []
+        strings = []
+        for is_string, value in zip(self.strings, values):
+            if is_string:
+                data = str(value).encode('utf-8')
+                strings.append(data)
+                fixed.append(len(data))
+            else:
+                fixed.append(value)
+        return self.fixed.pack(*fixed) + b''.join(strings)
+
+    def decode(self, payload):
+        values = list(self.fixed.unpack_from(payload))
+        offset = self.fixed.size
+        for i, is_string in enumerate(self.strings):
+            if is_string:
+                end = offset + values[i]
+                values[i] = payload[offset:end].decode('utf-8')
+                offset = end
+        return dict(zip(self.names, values))
+
+
+def _layouts(version):
+    return {number: Layout(name, fields) for number, (name, fields) in SCHEMAS[version].items()}
+
+
+def write(path, records):
+    """
+    Write a snapshot; the file is only replaced once the new one is complete
+
+    :param records: iterable of (kind name, field values in SCHEMAS[VERSION] order)
+    """
+    kinds = {layout.name: (number, layout) for number, layout in _layouts(VERSION).items()}
+    # A temp file of its own, so a write that overlaps another can't mix their records
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    count = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, time.time()))
+            for name, values in records:
+                number, layout = kinds[name]
+                payload = layout.encode(values)
+                f.write(RECORD.pack(number, len(payload)))
+                f.write(payload)
+                count += 1
+            number, layout = kinds['end']
+            payload = layout.encode([count])
+            f.write(RECORD.pack(number, len(payload)))
+            f.write(payload)
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+def _migrate(version, name, record):
+    """Bring a record written by an older version up to VERSION"""
+    while version < VERSION:
+        record = MIGRATIONS[version](name, record)
+        if record is None:
+            return None
+        name, record = record
+        version += 1
+    return name, record
+
+
+def read(path, progress=None):
+    """
+    Stream the records of a snapshot, upgraded to the current VERSION
+
+    :param progress: function(bytes read, file size), called every few thousand records
+    :return: generator of (kind name, {field: value})
+    :raises SnapshotError: if it isn't a snapshot we can read, or is incomplete
+    """
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise SnapshotError(f'{path} is not a snapshot')
+        magic, version, written = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise SnapshotError(f'{path} is not a snapshot')
+        if version not in SCHEMAS:
+            raise SnapshotError(f'{path} is format version {version}, this program reads up to {VERSION}')
+        layouts = _layouts(version)
+        size = os.fstat(f.fileno()).st_size
+
+        count = 0
+        while True:
+            if progress is not None and count % 4096 == 0:
+                progress(f.tell(), size)
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                raise SnapshotError(f'{path} is incomplete ({count} records)')
+            number, length = RECORD.unpack(head)
+            payload = f.read(length)
+            if len(payload) < length or number not in layouts:
+                raise SnapshotError(f'{path} is damaged after {count} records')
+            layout = layouts[number]
+            try:
+                record = layout.decode(payload)
+            except (struct.error, UnicodeDecodeError):
+                raise SnapshotError(f'{path} is damaged after {count} records') from None
+            name = layout.name
+            if name == 'end':
+                if record['records'] != count:
+                    raise SnapshotError(f'{path} should have {record["records"]} records, found {count}')
+                return
+            count += 1
+            record = _migrate(version, name, record)
+            if record is not None:
+                yield record
+
+
+__all__ = ['read', 'write', 'SnapshotError', 'VERSION']
@@ -0,0 +1,114 @@
+"""
+Startup for Meshtastic Monitor
+
+Loading the saved history and connecting to the radio (which is retried for up
+to 20 seconds) take a while.  With startup.background on, mesher.py starts the
+web server straight away and does them on a background thread: until they're
+done the dashboard shows a "connecting" page, the APIs answer 503, and
+/api/startup says how far along each step is.
+
+Steps report progress with the 'mesher.startup.progress' pubsub message
+(step, done, total): bytes of history loaded, or attempts at the radio.
+"""
+
+import threading
+import time
+
+from pubsub import pub
+
+
+class Startup:
+    """Singleton running the startup steps and keeping track of where they're at"""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(Startup, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        self.lock = threading.Lock()
+        self.state = 'idle'     # idle (never started), starting, ready or failed
+        self.steps = {}         # name -> {'state', 'started', 'finished', 'done', 'total', 'error'}
+        self.started = None
+        self.finished = None
+        self.thread = None
+        pub.subscribe(self.on_progress, 'mesher.startup.progress')
+        self._initialized = True
+
+    @property
+    def pending(self):
+        """Started but not ready: requests that need the radio or the history have to wait"""
+        return self.state in ('starting', 'failed')
+
+    def run(self, steps):
+        """
+        Run the steps in order, stopping at the first that fails
+
+        :param steps: [(name, function)]
+        :return: True if they all succeeded
+        """
+        with self.lock:
+            self.state = 'starting'
+            self.started = time.time()
+            self.finished = None
+            self.steps = {name: {'state': 'waiting', 'started': None, 'finished': None,
+                                 'done': None, 'total': None, 'error': None} for name, function in steps}
+        for name, function in steps:
+            step = self.steps[name]
+            step['state'] = 'running'
+            step['started'] = time.time()
+            print(f'Startup: {name}', flush=True)
+            try:
+                function()
+            except Exception as e:
+                print(f'Startup: {name} failed: {e}', flush=True)
+                step['state'] = 'failed'
+                step['error'] = str(e)
+                with self.lock:
+                    self.state = 'failed'
+                    self.finished = time.time()
+                return False
+            step['state'] = 'done'
+            step['finished'] = time.time()
+        with self.lock:
+            self.state = 'ready'
+            self.finished = time.time()
+        print(f'Startup: ready in {self.finished - self.started:.1f}s', flush=True)
+        return True
+
+    def start(self, steps):
+        """Run the steps on a background thread (unless they're already running)"""
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return False
+            # Pending from now on, not just once the thread gets going
+            self.state = 'starting'
+            self.started = time.time()
+            self.finished = None
+            self.thread = threading.Thread(target=self.run, args=(steps,), daemon=True)
+            self.thread.start()
+            return True
+
+    def on_progress(self, step, done, total):
+        entry = self.steps.get(step)
+        if entry is not None:
+            entry['done'] = done
+            entry['total'] = total
+
+    def get_state(self):
+        now = time.time()
+        with self.lock:
+            steps = {name: dict(step) for name, step in self.steps.items()}
+            return {
+                'state': self.state,
+                'elapsed': round((self.finished or now) - self.started, 2) if self.started else None,
+                'steps': steps
+            }
+
+
+__all__ = ['Startup']
@@ -120,9 +120,15 @@ function updateTables() {
             data.summary.columns.forEach(column => {
                 summaryHeaders.innerHTML += `<th>${column}</th>`;
             });
-            data.summary.values.forEach(value => {
-                summaryValues.innerHTML += `<td>${value}</td>`;
+            data.summary.values.forEach((value, i) => {
+                const rates = data.summary.rates;
+                const rate = rates ? `<br><small class="text-muted" title="Last minute / 15 minutes / hour">${rates['1m'][i]} / ${rates['15m'][i]} / ${rates['1h'][i]}</small>` : '';
+                summaryValues.innerHTML += `<td>${value}${rate}</td>`;
             });
+            if (data.summary.duplicates !== undefined) {
+                summaryHeaders.innerHTML += '<th title="Rebroadcast copies folded into packets already listed">Duplicates</th>';
+                summaryValues.innerHTML += `<td>${data.summary.duplicates}</td>`;
+            }
 
             // Update messages table
             const messagesBody = document.querySelector('#messages-table tbody');
@@ -175,34 +181,45 @@ function updateTables() {
             });
             resortAfterDataRefresh()
 
-            // Update packets table
-            const packetsBody = document.querySelector('#packets-table tbody');
-            packetsBody.innerHTML = '';
-            data.packets.forEach(packet => {
-                packetsBody.innerHTML += `
-                            <tr>
-                                <td>${packet.datetime}</td>
-                                <td>
-                                    <div class="dropdown">
-                                        <a  class="dropdown-toggle text-decoration-none" href="#" role="button" data-bs-toggle="dropdown">
-                                            ${packet.id}
-                                        </a>
-                                        ${dropdown_menu}
-                                    </div>
-                                </td>
-                                <td>${packet.name}</td>
-                                <td>${packet.hops >= 0 ? packet.hops : ''}</td>
-                                <td>${packet.rssi}</td>
-                                <td>${packet.type}</td>
-                                <td>${packet.information}</td>
-                            </tr>
-                        `;
-                reFilterPackets();
-            });
+            // Update packets table.  With a filter on, ask the server, so older matching packets show up too
+            if (lastPacketFilter) {
+                fetch(`/api/packets?text=${encodeURIComponent(lastPacketFilter)}&limit=${maxRows}`)
+                    .then(response => response.json())
+                    .then(result => renderPackets(result.rows, dropdown_menu))
+                    .catch(error => console.error('Error fetching packets:', error));
+            } else {
+                renderPackets(data.packets, dropdown_menu);
+            }
         })
         .catch(error => console.error('Error fetching updates:', error));
 }
 
+function renderPackets(packets, dropdown_menu) {
+    const packetsBody = document.querySelector('#packets-table tbody');
+    packetsBody.innerHTML = '';
+    packets.forEach(packet => {
+        packetsBody.innerHTML += `
+                    <tr>
+                        <td>${packet.datetime}</td>
+                        <td>
+                            <div class="dropdown">
+                                <a  class="dropdown-toggle text-decoration-none" href="#" role="button" data-bs-toggle="dropdown">
+                                    ${packet.id}
+                                </a>
+                                ${dropdown_menu}
+                            </div>
+                        </td>
+                        <td>${packet.name}</td>
+                        <td>${packet.hops >= 0 ? packet.hops : ''}${Number(packet.hops_max) > Number(packet.hops) ? '–' + packet.hops_max : ''}</td>
+                        <td>${packet.rssi}</td>
+                        <td>${packet.type}${packet.copies > 1 ? ` <span class="badge bg-secondary" title="Heard ${packet.copies} times">×${packet.copies}</span>` : ''}</td>
+                        <td>${packet.information}</td>
+                    </tr>
+                `;
+    });
+    reFilterPackets();
+}
+
 // Initial update
 updateTables();
 
@@ -266,19 +283,41 @@ function traceRoute(rowData) {
     console.log(`Trace Route ${rowData}`);
 
     fetch(`/api/traceroute?id=${encodeURIComponent(rowData)}`)
-        .then(response => {
-            if (!response.ok) {
-                throw new Error('Network response was not ok');
+        .then(response => response.json())
+        .then(result => {
+            if (!result.success) {
+                showToast(result.error);
+                return;
             }
-            return response.text();
-        }).then(msg => {
-        showToast(msg);
-    })
+            showToast(result.message);
+            watchTraceRoute(result.job_id);
+        })
         .catch(error => {
             showToast(`Error: ${error.message}`);
         });
 }
 
+// Poll a trace route job until it's answered (or given up on)
+function watchTraceRoute(jobId) {
+    const poll = setInterval(() => {
+        fetch(`/api/traceroute/${encodeURIComponent(jobId)}`)
+            .then(response => response.json())
+            .then(job => {
+                if (job.status === 'done') {
+                    clearInterval(poll);
+                    showToast(`Trace route to ${job.dest} answered in ${job.rtt}s`);
+                } else if (job.status === 'failed' || job.status === 'timeout') {
+                    clearInterval(poll);
+                    showToast(`Trace route to ${job.dest} failed: ${job.error}`);
+                }
+            })
+            .catch(error => {
+                clearInterval(poll);
+                console.error('Error checking trace route:', error);
+            });
+    }, 3000);
+}
+
 function openMap(rowData) {
     const nodeNum = parseInt(rowData, 16)
     window.open('https://meshtastic.liamcottle.net/?node_id=' + String(nodeNum), "_blank");
@@ -320,6 +359,69 @@ function showLocalNodeInfo() {
         });
 }
 
+
+// Telemetry chart in the details pop-up: a metric picker, a time range picker and an SVG line
+function loadMetricsChart(container) {
+    const node = container.dataset.node;
+    fetch(`/api/metrics?id=${encodeURIComponent(node)}`)
+        .then(response => response.json())
+        .then(metrics => {
+            const names = Object.keys(metrics).sort();
+            if (names.length === 0) {
+                return;
+            }
+            container.innerHTML = `
+                <h5>Telemetry</h5>
+                <div class="d-flex gap-2 mb-2">
+                    <select class="form-select form-select-sm metrics-name">
+                        ${names.map(name => `<option value="${name}">${name} (now ${metrics[name].value})</option>`).join('')}
+                    </select>
+                    <select class="form-select form-select-sm metrics-range">
+                        <option value="3600">1 hour</option>
+                        <option value="86400" selected>24 hours</option>
+                        <option value="604800">7 days</option>
+                        <option value="7776000">90 days</option>
+                    </select>
+                </div>
+                <div class="metrics-plot"></div>`;
+            const draw = () => drawMetricsChart(container, node,
+                container.querySelector('.metrics-name').value,
+                Number(container.querySelector('.metrics-range').value));
+            container.querySelectorAll('select').forEach(select => select.addEventListener('change', draw));
+            draw();
+        })
+        .catch(error => console.error('Error loading metrics:', error));
+}
+
+function drawMetricsChart(container, node, metric, range) {
+    const plot = container.querySelector('.metrics-plot');
+    const since = Date.now() / 1000 - range;
+    fetch(`/api/metrics?id=${encodeURIComponent(node)}&metric=${encodeURIComponent(metric)}&since=${since}`)
+        .then(response => response.json())
+        .then(series => {
+            const points = series.points || [];
+            if (points.length === 0) {
+                plot.innerHTML = '<em>No data in this range</em>';
+                return;
+            }
+            const width = 460, height = 120, pad = 4;
+            const t0 = points[0][0], t1 = points[points.length - 1][0];
+            const lows = points.map(p => p[2]), highs = points.map(p => p[3]);
+            const vmin = Math.min(...lows), vmax = Math.max(...highs);
+            const x = t => pad + (t1 > t0 ? (t - t0) / (t1 - t0) : 0.5) * (width - 2 * pad);
+            const y = v => height - pad - (vmax > vmin ? (v - vmin) / (vmax - vmin) : 0.5) * (height - 2 * pad);
+            const line = points.map(p => `${x(p[0]).toFixed(1)},${y(p[1]).toFixed(1)}`).join(' ');
+            plot.innerHTML = `
+                <svg viewBox="0 0 ${width} ${height}" width="100%" style="border: 1px solid #dee2e6">
+                    <polyline points="${line}" fill="none" stroke="#0d6efd" stroke-width="1.5"/>
+                </svg>
+                <small class="text-muted">${vmin} – ${vmax}, ${points.length} points (${series.resolution})</small>`;
+        })
+        .catch(error => {
+            plot.innerHTML = `<div class="alert alert-danger">Error loading ${metric}: ${error.message}</div>`;
+        });
+}
+
 // Initialize the config modal
 let config_modal = null;
 
@@ -376,6 +478,10 @@ function showDetailsModal(id) {
         })
         .then(html => {
             modalBody.innerHTML = html;
+            const chart = modalBody.querySelector('.metrics-chart');
+            if (chart) {
+                loadMetricsChart(chart);
+            }
         })
         .catch(error => {
             modalBody.innerHTML = `<div class="alert alert-danger">Error loading content: ${error.message}</div>`;
@@ -481,6 +587,7 @@ function initializePacketFilter() {
         const filterText = filterInput.value.toLowerCase();
         lastPacketFilter = filterText;
         reFilterPackets();
+        updateTables();
         // document.getElementById("current-packet-filter").innerHTML = `Filtering List on "${filterText}"`;
         filterInput.placeholder = 'Filtering on "' + filterText + '"';
         filterInput.value = '';
@@ -490,6 +597,7 @@ function initializePacketFilter() {
         filterInput.value = '';
         lastPacketFilter = '';
         reFilterPackets();
+        updateTables();
         // document.getElementById("current-packet-filter").innerHTML = '';
         filterInput.placeholder = 'Enter a Filter ...';
     }
@@ -39,6 +39,19 @@ function initializeConfigForms() {
 function handleConfigSave(form) {
     const section = form.dataset.section;
     const channelIndex = form.dataset.channelIndex; // For channel forms
+    const data = collectFormData(form);
+
+    console.log('Form data prepared for save:', data);
+
+    // Show confirmation dialog
+    showConfigConfirmation(section, data, channelIndex);
+}
+
+/**
+ * Turn a config form into the object the API expects
+ */
+function collectFormData(form) {
+    const section = form.dataset.section;
     const formData = new FormData(form);
     const data = {};
 
@@ -84,10 +97,28 @@ function handleConfigSave(form) {
         }
     }
 
-    console.log('Form data prepared for save:', data);
+    return data;
+}
 
-    // Show confirmation dialog
-    showConfigConfirmation(section, data, channelIndex);
+/**
+ * Save every tab at once: the server skips anything unchanged and writes
+ * the rest in a single settings transaction (one reboot instead of many)
+ */
+function saveAllConfig() {
+    const batch = {sections: {}, channels: {}};
+
+    document.querySelectorAll('#configModal form[data-section]').forEach(form => {
+        const data = collectFormData(form);
+        if (form.dataset.section === 'channel') {
+            batch.channels[form.dataset.channelIndex] = data;
+        } else {
+            batch.sections[form.dataset.section] = data;
+        }
+    });
+
+    console.log('Batch prepared for save:', batch);
+
+    showConfigConfirmation('batch', batch);
 }
 
 /**
@@ -126,9 +157,12 @@ function showConfigConfirmation(section, data, channelIndex = null) {
         'canned_message': 'Canned Message'
     };
 
-    const sectionName = section === 'channel' && channelIndex !== null
+    let sectionName = section === 'channel' && channelIndex !== null
         ? `Channel ${channelIndex}`
         : (sectionNames[section] || section);
+    if (section === 'batch') {
+        sectionName = 'all changed';
+    }
 
     // Special warnings for certain sections
     let warningMessage = '';
@@ -200,9 +234,12 @@ function confirmConfigSave() {
     showConfigToast('Saving configuration...', 'info');
 
     // Determine the correct endpoint
-    const endpoint = section === 'channel' && channelIndex !== null
+    let endpoint = section === 'channel' && channelIndex !== null
         ? `/api/config/channel/${channelIndex}`
         : `/api/config/${section}`;
+    if (section === 'batch') {
+        endpoint = '/api/config/batch';
+    }
 
     // Send POST request to save config
     fetch(endpoint, {
@@ -218,6 +255,9 @@ function confirmConfigSave() {
     })
     .then(result => {
         console.log('Save result:', result);
+        if (section === 'batch') {
+            reportBatchResults(result);
+        }
         if (result.success) {
             showConfigToast('Configuration saved successfully', 'success');
 
@@ -238,6 +278,34 @@ function confirmConfigSave() {
     });
 }
 
+/**
+ * Show what a batch save actually did, section by section
+ */
+function reportBatchResults(result) {
+    const written = [];
+    const failed = [];
+    const outcomes = Object.entries(result.sections || {})
+        .concat(Object.entries(result.channels || {}).map(([index, r]) => [`channel ${index}`, r]));
+
+    outcomes.forEach(([name, r]) => {
+        if (!r.success) {
+            failed.push(`${name}: ${r.error}`);
+        } else if (!r.skipped) {
+            written.push(`${name} (${r.changed.join(', ')})`);
+        }
+    });
+
+    if (written.length === 0 && failed.length === 0) {
+        showConfigToast('Nothing changed, no settings written', 'info');
+    }
+    if (written.length > 0) {
+        showConfigToast(`Saved ${written.join('; ')}`, 'success');
+    }
+    if (failed.length > 0) {
+        showConfigToast(`Failed ${failed.join('; ')}`, 'danger');
+    }
+}
+
 /**
  * Reboot the device
  */
@@ -1,10 +1,242 @@
-from pydantic import BaseModel
+from dataclasses import dataclass
+from pubsub import pub
 from config import Config
+from rates import Rates
+from search import SearchIndex
+import bisect
+from datetime import datetime
 import pickle
+import snapshot
+from collections import OrderedDict, deque
 import os
+import threading
 import time
 
-class MSG(BaseModel):
+class Index:
+    """
+    Sequence numbers of rows, oldest first.  Rows removed from anywhere but the old end
+    are left in place and skipped (they're gone from the store's rows) until they reach
+    the old end or there are enough of them to be worth compacting away.
+    """
+
+    dead = 0    # Removed entries still in seqs (a class default, for indexes pickled before removal)
+
+    def __init__(self):
+        self.seqs = []
+        self.start = 0      # Entries before this have been dropped, and are waiting to be compacted away
+
+    def __len__(self):
+        return len(self.seqs) - self.start - self.dead
+
+    def append(self, seq):
+        self.seqs.append(seq)
+
+    def oldest(self, rows):
+        """Oldest sequence number still in rows, or None"""
+        while self.start < len(self.seqs) and self.seqs[self.start] not in rows:
+            self.start += 1
+            self.dead -= 1
+        if self.start > 64 and self.start * 2 > len(self.seqs):
+            del self.seqs[:self.start]
+            self.start = 0
+        return self.seqs[self.start] if self.start < len(self.seqs) else None
+
+    def discard(self, rows):
+        """One of our rows has just been removed from rows"""
+        self.dead += 1
+        self.oldest(rows)
+        if self.dead > 64 and self.dead * 2 > len(self.seqs) - self.start:
+            self.seqs = [seq for seq in self.seqs[self.start:] if seq in rows]
+            self.start = 0
+            self.dead = 0
+
+    def after(self, times, when):
+        """
+        Position of the first entry that arrived after `when`, by bisection: entries are in
+        time order, and removed ones (not in times) are skipped over
+        """
+        lo, hi = self.start, len(self.seqs)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            live = mid
+            while live < hi and self.seqs[live] not in times:
+                live += 1
+            if live == hi or times[self.seqs[live]] > when:
+                hi = mid
+            else:
+                lo = live + 1
+        return lo
+
+    def newest_first(self, rows, before=None, end=None):
+        """Sequence numbers newest first, from just before the cursor `before` or position `end`"""
+        end = len(self.seqs) if end is None else end
+        if before is not None:
+            end = bisect.bisect_left(self.seqs, before, self.start, end)
+        for i in range(end - 1, self.start - 1, -1):
+            if self.seqs[i] in rows:
+                yield self.seqs[i]
+
+
+class RowStore:
+    """
+    A bounded store of rows, each with a sequence number (newer rows, bigger numbers),
+    and an Index per field in `indexed` so queries on those fields skip everything else.
+    Sequence numbers double as pagination cursors.  Rows arrive in time order, so every
+    index is also time ordered: expiring old rows only looks at the rows that expire.
+    """
+
+    indexed = {}        # filter name -> function giving a row's value for it
+    legacy_rows = None  # attribute that held the plain list of rows (newest first) in older pickles
+
+    def __init__(self, limit):
+        self.msg_limit = limit
+        self.lock = threading.RLock()
+        self.rows = {}          # sequence number -> row
+        self.times = {}         # sequence number -> when it arrived (epoch seconds)
+        self.order = Index()
+        self.indexes = {name: {} for name in self.indexed}  # filter name -> value -> Index
+        self.next_seq = 1
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        legacy = state.pop(self.legacy_rows, None)
+        if legacy is not None:
+            self.__init__()
+            for row in reversed(legacy):
+                row = self.upgrade_row(row)
+                self.append(row, self.row_time(row))
+            return
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+        if 'times' not in state:
+            self.times = {seq: self.row_time(row) for seq, row in self.rows.items()}
+
+    @staticmethod
+    def upgrade_row(row):
+        """Fill in fields that rows pickled by older versions don't have"""
+        return row
+
+    @staticmethod
+    def row_time(row):
+        """When a row from an older pickle (which didn't keep arrival times) arrived"""
+        return time.time()
+
+    def __len__(self):
+        return len(self.order)
+
+    def append(self, row, when=None):
+        with self.lock:
+            # >= rather than == since the limit can shrink when config.toml is reloaded
+            while len(self.order) and len(self.order) >= self.msg_limit:
+                self.remove(self.order.oldest(self.rows))
+            seq = self.next_seq
+            self.next_seq += 1
+            self.rows[seq] = row
+            self.times[seq] = when or time.time()
+            self.order.append(seq)
+            for name, key in self.indexed.items():
+                self.indexes[name].setdefault(key(row), Index()).append(seq)
+            return seq
+
+    def restore(self, seq, row, when):
+        """Put back a row from a snapshot; rows must come oldest first"""
+        with self.lock:
+            self.rows[seq] = row
+            self.times[seq] = when
+            self.order.append(seq)
+            for name, key in self.indexed.items():
+                self.indexes[name].setdefault(key(row), Index()).append(seq)
+            self.next_seq = max(self.next_seq, seq + 1)
+
+    def snapshot(self):
+        """[(seq, when, row)], oldest first, for saving"""
+        with self.lock:
+            return [(seq, self.times[seq], row) for seq, row in self.rows.items()]
+
+    def remove(self, seq):
+        # Caller holds the lock
+        row = self.rows.pop(seq)
+        del self.times[seq]
+        self.order.discard(self.rows)
+        for name, key in self.indexed.items():
+            value = key(row)
+            index = self.indexes[name][value]
+            index.discard(self.rows)
+            if not index:
+                del self.indexes[name][value]
+        return seq, row
+
+    def expire(self, cutoff, name=None, value=None):
+        """
+        Remove rows that arrived before cutoff: all of them, or only those with value for
+        the indexed filter name.  Stops at the first row young enough to keep.
+
+        :return: how many rows were removed
+        """
+        with self.lock:
+            index = self.order if name is None else self.indexes[name].get(value)
+            removed = 0
+            while index:
+                seq = index.oldest(self.rows)
+                if seq is None or self.times[seq] >= cutoff:
+                    break
+                self.remove(seq)
+                removed += 1
+            return removed
+
+    def query(self, equal=None, match=None, before=None, limit=100, since=None, until=None):
+        """
+        Newest rows first
+
+        :param equal: {indexed filter name: value} every row must have
+        :param match: function(row) -> bool, for any other conditions
+        :param before: cursor; only rows older than it
+        :param since, until: only rows that arrived in [since, until] (epoch seconds).  Only the
+                             rows in that window are looked at.
+        :return: ([(seq, row), ...], cursor for the next page or None if there isn't one)
+        """
+        equal = equal or {}
+        with self.lock:
+            indexes = [self.indexes[name].get(value) for name, value in equal.items()]
+            if any(index is None for index in indexes):
+                return [], None
+            # Walk the smallest index that applies, checking the rest row by row
+            index = min(indexes, key=len) if indexes else self.order
+            end = None if until is None else index.after(self.times, until)
+            found = []
+            for seq in index.newest_first(self.rows, before, end):
+                if since is not None and self.times[seq] < since:
+                    break
+                row = self.rows[seq]
+                if any(self.indexed[name](row) != value for name, value in equal.items()):
+                    continue
+                if match is not None and not match(row):
+                    continue
+                if len(found) == limit:
+                    return found, found[-1][0]
+                found.append((seq, row))
+            return found, None
+
+
+def parse_row_time(text):
+    try:
+        return datetime.strptime(text, "%Y-%m-%d %H:%M:%S").timestamp()
+    except ValueError:
+        return time.time()
+
+
+class Row:
+    def __setstate__(self, state):
+        # Rows pickled while they were pydantic models keep their fields under '__dict__'
+        self.__dict__.update(state.get('__dict__', state))
+
+
+@dataclass(eq=False)
+class MSG(Row):
     msg_time: str
     msg_fromId: str
     msg_from: str
@@ -13,38 +245,190 @@ class MSG(BaseModel):
     msg_text: str
 
 
-class MSGs():
-    def __init__(self):
-        self.messages : list[MSG] = []
-        self.msg_limit = Config().get('data.max_messages', 1024)
+class MSGs(RowStore):
+    indexed = {'node': lambda msg: msg.msg_fromId, 'channel': lambda msg: msg.msg_channel}
+    legacy_rows = 'messages'
 
-    def add(self, dt, mf, mto, ch, mtxt, from_id):
+    def __init__(self):
+        super().__init__(Config().get('data.max_messages', 1024))
+        self.search = SearchIndex()
+
+    # The search index isn't saved, it's rebuilt from the messages on load
+    def __getstate__(self):
+        state = super().__getstate__()
+        del state['search']
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        if not hasattr(self, 'search'):
+            self.search = SearchIndex()
+            for seq, msg in self.rows.items():
+                self.search.add(seq, self.search_text(msg))
+
+    @staticmethod
+    def search_text(msg):
+        return ' '.join([msg.msg_text, msg.msg_from, msg.msg_fromId, msg.msg_to, msg.msg_channel])
+
+    def append(self, row, when=None):
+        with self.lock:
+            seq = super().append(row, when)
+            self.search.add(seq, self.search_text(row))
+            return seq
+
+    def restore(self, seq, row, when):
+        with self.lock:
+            super().restore(seq, row, when)
+            self.search.add(seq, self.search_text(row))
+
+    def remove(self, seq):
+        seq, msg = super().remove(seq)
+        self.search.remove(seq, self.search_text(msg))
+        return seq, msg
+
+    @staticmethod
+    def row_time(msg):
+        return parse_row_time(msg.msg_time)
+
+    def search_msgs(self, query, offset=0, limit=20):
+        """Ranked full-text search; see search.py"""
+        with self.lock:
+            total, ranked = self.search.search(query, offset, limit)
+            rows = [dict(self.to_dict(seq, self.rows[seq]), score=score) for seq, score in ranked]
+        return {'total': total, 'offset': offset, 'rows': rows,
+                'next_offset': offset + limit if offset + limit < total else None}
+
+    def add(self, dt, mf, mto, ch, mtxt, from_id, when=None):
         msg = MSG(msg_time = dt, msg_from = mf, msg_to = mto, msg_channel = ch, msg_text = mtxt, msg_fromId = from_id)
-
-        if len(self.messages) == self.msg_limit:
-            del self.messages[-1]
-
-        # insert msg at the front of self.messages
-        self.messages.insert(0, msg)
+        return self.append(msg, when), msg
+
+    @staticmethod
+    def to_dict(seq, msg):
+        return {
+            "seq": seq,
+            "datetime": msg.msg_time,
+            "id": msg.msg_fromId,
+            "from": msg.msg_from,
+            "to": msg.msg_to,
+            "channel": msg.msg_channel,
+            "message": msg.msg_text
+        }
 
     def get_msgs(self, rowmax):
-        msgs = []
-        for msg in self.messages:
-            msgs.append(
-                {
-                    "datetime": msg.msg_time,
-                    "id": msg.msg_fromId,
-                    "from": msg.msg_from,
-                    "to": msg.msg_to,
-                    "channel": msg.msg_channel,
-                    "message": msg.msg_text
-                }
-            )
-
-        return msgs[:rowmax]
-
-
-class PKT(BaseModel):
+        rows, cursor = self.query(limit=rowmax)
+        return [self.to_dict(seq, msg) for seq, msg in rows]
+
+
+class Thread:
+    """One conversation: a channel, or the DMs with one other node"""
+
+    def __init__(self, key, title, limit):
+        self.key = key
+        self.title = title
+        self.messages = deque(maxlen=limit)    # (seq, MSG), oldest first
+        self.total = 0          # Messages ever added, kept or not
+        self.read = 0           # ... of which had been added when the thread was last marked read
+        self.last_activity = None
+
+    def summary(self):
+        last = self.messages[-1][1] if self.messages else None
+        return {
+            'key': self.key,
+            'kind': self.key.split(':', 1)[0],
+            'title': self.title,
+            'count': len(self.messages),
+            'unread': self.total - self.read,
+            'last_activity': self.last_activity,
+            'last_message': MSGs.to_dict(self.messages[-1][0], last) if last else None
+        }
+
+
+class Threads:
+    """
+    Messages partitioned by conversation, each with its own retention, so a busy
+    channel can't push DMs out.  Thread keys are 'ch:<channel>' or 'dm:<other node id>'.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.threads = {}   # key -> Thread
+        self.apply_limits(Config())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    def apply_limits(self, config):
+        self.channel_limit = config.get('data.max_channel_messages', 1024)
+        self.dm_limit = config.get('data.max_dm_messages', 256)
+        for thread in getattr(self, 'threads', {}).values():
+            limit = self.dm_limit if thread.key.startswith('dm:') else self.channel_limit
+            if thread.messages.maxlen != limit:
+                thread.messages = deque(thread.messages, maxlen=limit)
+
+    def add(self, key, title, seq, msg):
+        with self.lock:
+            thread = self.threads.get(key)
+            if thread is None:
+                limit = self.dm_limit if key.startswith('dm:') else self.channel_limit
+                thread = self.threads[key] = Thread(key, title, limit)
+            thread.title = title
+            thread.messages.append((seq, msg))
+            thread.total += 1
+            thread.last_activity = msg.msg_time
+
+    def restore(self, key, title, total, read, last_activity):
+        """Put back a thread from a snapshot, for its messages to be added to"""
+        limit = self.dm_limit if key.startswith('dm:') else self.channel_limit
+        thread = self.threads[key] = Thread(key, title, limit)
+        thread.total = total
+        thread.read = read
+        thread.last_activity = last_activity or None
+        return thread
+
+    def snapshot(self):
+        """[(Thread, [(seq, MSG), ...])], for saving"""
+        with self.lock:
+            return [(thread, list(thread.messages)) for thread in self.threads.values()]
+
+    def get_threads(self):
+        with self.lock:
+            threads = [thread.summary() for thread in self.threads.values()]
+        return sorted(threads, key=lambda thread: thread['last_activity'] or '', reverse=True)
+
+    def get_thread(self, key, before=None, limit=100):
+        """
+        A page of one thread, newest first
+
+        :return: {'rows', 'next_cursor'}, or None if there's no such thread
+        """
+        with self.lock:
+            thread = self.threads.get(key)
+            if thread is None:
+                return None
+            messages = thread.messages
+            # (seq, msg) tuples sort by seq, so the cursor can be found by bisection
+            end = len(messages) if before is None else bisect.bisect_left(messages, (before,))
+            start = max(0, end - limit)
+            rows = [MSGs.to_dict(seq, msg) for seq, msg in reversed([messages[i] for i in range(start, end)])]
+            return {'rows': rows, 'next_cursor': rows[-1]['seq'] if start > 0 else None}
+
+    def mark_read(self, key):
+        with self.lock:
+            thread = self.threads.get(key)
+            if thread is None:
+                return False
+            thread.read = thread.total
+            return True
+
+
+@dataclass(eq=False)
+class PKT(Row):
     pk_time: str
     pk_from: str
     pk_id: str
@@ -52,37 +436,77 @@ class PKT(BaseModel):
     pk_rssi: str
     pk_type: str
     pk_info: str
+    # Rebroadcast copies of the same packet are folded into one row
+    pk_copies: int = 1
+    pk_snr: str = ''
+    pk_hops_max: str = ''
+    # What the packet was, for filtering: port name (e.g. POSITION_APP) and channel index
+    pk_app: str = ''
+    pk_channel: str = ''
+
+    def add_copy(self, hops, rssi, snr):
+        """Fold another copy of this packet in: count it, keep the best signal and the hop range"""
+        self.pk_copies += 1
+        if hops >= 0:
+            if int(self.pk_hops) < 0 or hops < int(self.pk_hops):
+                self.pk_hops = str(hops)
+            if hops > int(self.pk_hops_max or -1):
+                self.pk_hops_max = str(hops)
+        if rssi != '' and (self.pk_rssi == '' or float(rssi) > float(self.pk_rssi)):
+            self.pk_rssi = str(rssi)
+        if snr != '' and (self.pk_snr == '' or float(snr) > float(self.pk_snr)):
+            self.pk_snr = str(snr)
+
+
+class PKTs(RowStore):
+    indexed = {'node': lambda pkt: pkt.pk_id, 'type': lambda pkt: pkt.pk_app, 'channel': lambda pkt: pkt.pk_channel}
+    legacy_rows = 'packets'
 
-class PKTs():
     def __init__(self):
-        self.packets : list[PKT] = []
-        self.msg_limit = Config().get('data.max_packets', 1024)
+        super().__init__(Config().get('data.max_packets', 1024))
+
+    @staticmethod
+    def upgrade_row(pkt):
+        for field, default in [('pk_copies', 1), ('pk_snr', ''), ('pk_hops_max', pkt.pk_hops),
+                               ('pk_app', ''), ('pk_channel', '')]:
+            pkt.__dict__.setdefault(field, default)
+        return pkt
+
+    @staticmethod
+    def row_time(pkt):
+        return parse_row_time(pkt.pk_time)
+
+    def add(self, pti, pf, ph, pr, pty, pi, pid, snr='', app='', channel='', when=None):
+        pkt = PKT(pk_time = pti, pk_from=pf, pk_id=pid, pk_hops=str(ph), pk_rssi=str(pr), pk_type=pty, pk_info=pi,
+                  pk_snr=str(snr), pk_hops_max=str(ph), pk_app=app, pk_channel=str(channel))
+        self.append(pkt, when)
+        return pkt
+
+    @staticmethod
+    def to_dict(seq, pkt):
+        return {
+            "seq": seq,
+            "datetime": pkt.pk_time,
+            "id": pkt.pk_id,
+            "name": pkt.pk_from,
+            "hops": pkt.pk_hops,
+            "rssi": pkt.pk_rssi,
+            "type": pkt.pk_type,
+            "information": pkt.pk_info,
+            "copies": pkt.pk_copies,
+            "snr": pkt.pk_snr,
+            "hops_max": pkt.pk_hops_max,
+            "app": pkt.pk_app,
+            "channel": pkt.pk_channel
+        }
 
-    def add(self, pti, pf, ph, pr, pty, pi, pid):
-        pkt = PKT(pk_time = pti, pk_from=pf, pk_id=pid, pk_hops=str(ph), pk_rssi=str(pr), pk_type=pty, pk_info=pi)
-
-        if len(self.packets) == self.msg_limit:
-            del self.packets[-1]
+    def get_pkts(self, rowmax):
+        rows, cursor = self.query(limit=rowmax)
+        return [self.to_dict(seq, pkt) for seq, pkt in rows]
 
-        # insert msg at the front of self.messages
-        self.packets.insert(0, pkt)
 
-    def get_pkts(self, rowmax):
-        pkts = []
-        for pkt in self.packets:
-            pkts.append(
-                {
-                    "datetime": pkt.pk_time,
-                    "id": pkt.pk_id,
-                    "name": pkt.pk_from,
-                    "hops": pkt.pk_hops,
-                    "rssi": pkt.pk_rssi,
-                    "type": pkt.pk_type,
-                    "information": pkt.pk_info
-                }
-            )
-
-        return pkts[:rowmax]
+SNAPSHOT_FILE = 'persisted_data.snap'
+LEGACY_FILE = 'persisted_data.pkl'     # What older versions saved, a pickle of the objects
 
 
 class Status:
@@ -101,16 +525,26 @@ class Status:
             self.counts = None
             self.messages = None
             self.packets = None
+            self.threads = None
             self.last_persist_time = 0
+            self.persist_lock = threading.Lock()    # persist() is called from the receive and expiry threads
+            self.recent = OrderedDict()     # (from, packet id) -> its PKT row (or None), most recent last
+            self.duplicates = 0
             self.persist_interval = 10  # seconds between disk writes
+            self.batch_mode = False     # loading in bulk (see backfill.py): only persist when forced
             if self.config.get('data.persist_data'):
-                if os.path.exists('persisted_data.pkl'):
-                    with open('persisted_data.pkl', 'rb') as f:
+                if os.path.exists(SNAPSHOT_FILE):
+                    self.load_snapshot(SNAPSHOT_FILE)
+                elif os.path.exists(LEGACY_FILE):
+                    # Saved by an older version: import it, it's saved as a snapshot from now on
+                    print(f'Importing {LEGACY_FILE}', flush=True)
+                    with open(LEGACY_FILE, 'rb') as f:
                         data = pickle.load(f)
 
                     self.counts = data.get('counts')
                     self.messages = data.get('messages')
                     self.packets = data.get('packets')
+                    self.threads = data.get('threads')
 
             if self.counts is None:
                 self.counts = {'Total': 0, 'Text': 0, 'Telemetry': 0, 'Position': 0, 'NodeInfo': 0, 'Other': 0}
@@ -118,22 +552,143 @@ class Status:
                 self.packets = PKTs()
             if self.messages is None:
                 self.messages = MSGs()
+            if self.threads is None:
+                # Saved before there were threads: start them off with the messages we have
+                self.threads = Threads()
+                for seq, msg in reversed(self.messages.query(limit=len(self.messages))[0]):
+                    key = f'ch:{msg.msg_channel}' if msg.msg_channel != 'DM' else f'dm:{msg.msg_fromId}'
+                    self.threads.add(key, msg.msg_channel if msg.msg_channel != 'DM' else msg.msg_from, seq, msg)
+
+            self.apply_limits(self.config)
+            self.config.subscribe(self.apply_limits)
+            threading.Thread(target=self._expire_loop, daemon=True).start()
 
         self.initialized = True
 
+    def apply_limits(self, config):
+        """(Re)read the store sizes, so they can be tuned without a restart"""
+        self.messages.msg_limit = config.get('data.max_messages', 1024)
+        self.packets.msg_limit = config.get('data.max_packets', 1024)
+        self.recent_limit = config.get('data.dedup_size', 512)
+        self.threads.apply_limits(config)
+        # Seconds to keep packets, by port name, and messages; anything not listed is only limited by count
+        self.retention = config.get('retention', {})
+        self.message_retention = config.get('data.message_retention', 0)
+        self.expire_interval = config.get('data.expire_interval', 60)
+
+    def expire(self, now=None):
+        """Drop packets and messages older than their retention; only the expired rows are looked at"""
+        now = now or time.time()
+        removed = 0
+        for port, seconds in self.retention.items():
+            if seconds:
+                removed += self.packets.expire(now - seconds, 'type', port)
+        if self.message_retention:
+            removed += self.messages.expire(now - self.message_retention)
+        if removed:
+            self.persist()
+        return removed
+
+    def _expire_loop(self):
+        while True:
+            if self.expire_interval <= 0:
+                time.sleep(60)      # Off; check again in case config.toml turns it on
+                continue
+            time.sleep(self.expire_interval)
+            try:
+                self.expire()
+            except Exception as e:
+                print(f'Expiry error: {e}', flush=True)
+
+    def clear(self):
+        """Start over with empty stores"""
+        self.counts = {'Total': 0, 'Text': 0, 'Telemetry': 0, 'Position': 0, 'NodeInfo': 0, 'Other': 0}
+        self.packets = PKTs()
+        self.messages = MSGs()
+        self.threads = Threads()
+        self.recent.clear()
+        self.duplicates = 0
+        self.apply_limits(self.config)
+
+    def load_snapshot(self, path):
+        """
+        Load a snapshot (see snapshot.py) a record at a time.  A damaged file is renamed
+        out of the way, keeping whatever could be read from it.
+        """
+        started = time.time()
+        self.counts = {}
+        self.packets = PKTs()
+        self.messages = MSGs()
+        self.threads = Threads()
+        stores = {'packets': self.packets, 'messages': self.messages}
+        thread = None
+        try:
+            for kind, record in snapshot.read(path, self.report_progress):
+                if kind == 'packet':
+                    seq, when = record.pop('seq'), record.pop('when')
+                    self.packets.restore(seq, PKT(**record), when)
+                elif kind == 'message':
+                    seq, when = record.pop('seq'), record.pop('when')
+                    self.messages.restore(seq, MSG(**record), when)
+                elif kind == 'thread':
+                    thread = self.threads.restore(**record)
+                elif kind == 'thread_ref' and thread is not None and record['seq'] in self.messages.rows:
+                    thread.messages.append((record['seq'], self.messages.rows[record['seq']]))
+                elif kind == 'thread_message' and thread is not None:
+                    seq = record.pop('seq')
+                    record.pop('key')
+                    thread.messages.append((seq, MSG(**record)))
+                elif kind == 'count':
+                    self.counts[record['name']] = record['value']
+                elif kind == 'store' and record['name'] in stores:
+                    stores[record['name']].next_seq = max(stores[record['name']].next_seq, record['next_seq'])
+        except snapshot.SnapshotError as e:
+            print(f'{e}; kept what could be read, the file is now {path}.damaged', flush=True)
+            os.replace(path, path + '.damaged')
+        print(f'Loaded {len(self.packets)} packets and {len(self.messages)} messages in '
+              f'{time.time() - started:.2f}s', flush=True)
+
+    @staticmethod
+    def report_progress(done, total):
+        pub.sendMessage('mesher.startup.progress', step='history', done=done, total=total)
+
+    def snapshot_records(self):
+        """What persist() saves, as snapshot records"""
+        for name, value in self.counts.items():
+            yield 'count', (name, value)
+        for name, store in (('packets', self.packets), ('messages', self.messages)):
+            yield 'store', (name, store.next_seq)
+        for seq, when, pkt in self.packets.snapshot():
+            yield 'packet', (seq, when, pkt.pk_time, pkt.pk_from, pkt.pk_id, pkt.pk_hops, pkt.pk_rssi, pkt.pk_type,
+                             pkt.pk_info, pkt.pk_copies, pkt.pk_snr, pkt.pk_hops_max, pkt.pk_app, pkt.pk_channel)
+        for seq, when, msg in self.messages.snapshot():
+            yield 'message', (seq, when, msg.msg_time, msg.msg_fromId, msg.msg_from, msg.msg_to, msg.msg_channel,
+                              msg.msg_text)
+        rows = self.messages.rows
+        for thread, messages in self.threads.snapshot():
+            yield 'thread', (thread.key, thread.title, thread.total, thread.read, thread.last_activity or '')
+            for seq, msg in messages:
+                if rows.get(seq) is msg:
+                    yield 'thread_ref', (thread.key, seq)
+                else:
+                    yield 'thread_message', (thread.key, seq, msg.msg_time, msg.msg_fromId, msg.msg_from, msg.msg_to,
+                                             msg.msg_channel, msg.msg_text)
+
     def persist(self, force=False):
         if not self.config.get('data.persist_data'):
             return
-        now = time.time()
-        if not force and (now - self.last_persist_time) < self.persist_interval:
-            return  # Skip, too soon since last persist
-        self.last_persist_time = now
-        data = { 'counts': self.counts, 'messages': self.messages, 'packets': self.packets}
-        with open('persisted_data.pkl', 'wb') as f:
-            pickle.dump(data, f)
+        with self.persist_lock:
+            now = time.time()
+            if not force and (self.batch_mode or (now - self.last_persist_time) < self.persist_interval):
+                return  # Skip, too soon since last persist
+            self.last_persist_time = now
+            snapshot.write(SNAPSHOT_FILE, self.snapshot_records())
 
     def get_counts(self):
-        r = {'columns': [key for key in self.counts], 'values': [self.counts[key] for key in self.counts]}
+        columns = [key for key in self.counts]
+        r = {'columns': columns, 'values': [self.counts[key] for key in columns], 'rates': Rates().get_type_rates(columns),
+             # Rebroadcast copies folded into existing rows since startup (see seen_packet)
+             'duplicates': self.duplicates}
         return r
 
     def get_messages(self, rowmax):
@@ -142,14 +697,123 @@ class Status:
     def get_packets(self, rowmax):
         return self.packets.get_pkts(rowmax)
 
-    def add_msg(self, dt, mf, mto, ch, mtxt, id):
-        self.messages.add(dt, mf, mto, ch, mtxt, id)
+    @staticmethod
+    def _time_bounds(filters):
+        """since / until as epoch seconds, or None"""
+        since = filters.get('since')
+        until = filters.get('until')
+        return float(since) if since else None, float(until) if until else None
+
+    @staticmethod
+    def _node_id(node):
+        return node if node.startswith('!') else '!' + node
+
+    def query_packets(self, filters, cursor=None, limit=100):
+        """
+        Packets matching all of the filters, newest first
+
+        :param filters: any of node, type (e.g. POSITION_APP), channel, since, until (epoch seconds),
+                        min_hops, max_hops, min_rssi, text (case-insensitive, anywhere in the row)
+        :return: {'rows': [...], 'next_cursor': seq to pass as cursor for the next page, or None}
+        """
+        equal = {}
+        if filters.get('node'):
+            equal['node'] = self._node_id(filters['node'])
+        if filters.get('type'):
+            equal['type'] = filters['type']
+        if filters.get('channel') not in (None, ''):
+            equal['channel'] = str(filters['channel'])
+        since, until = self._time_bounds(filters)
+        min_hops = filters.get('min_hops')
+        max_hops = filters.get('max_hops')
+        min_rssi = filters.get('min_rssi')
+        text = (filters.get('text') or '').lower()
+
+        def match(pkt):
+            if min_hops is not None and int(pkt.pk_hops_max or pkt.pk_hops) < int(min_hops):
+                return False
+            if max_hops is not None and not 0 <= int(pkt.pk_hops) <= int(max_hops):
+                return False
+            if min_rssi is not None and (pkt.pk_rssi == '' or float(pkt.pk_rssi) < float(min_rssi)):
+                return False
+            if text and text not in ' '.join([pkt.pk_time, pkt.pk_id, pkt.pk_from, pkt.pk_hops, pkt.pk_rssi, pkt.pk_type, pkt.pk_info]).lower():
+                return False
+            return True
+
+        rows, next_cursor = self.packets.query(equal, match, cursor, limit, since, until)
+        return {'rows': [PKTs.to_dict(seq, pkt) for seq, pkt in rows], 'next_cursor': next_cursor}
+
+    def query_messages(self, filters, cursor=None, limit=100):
+        """
+        Messages matching all of the filters, newest first
+
+        :param filters: any of node (sender), channel, since, until (epoch seconds), text
+        :return: {'rows': [...], 'next_cursor': seq to pass as cursor for the next page, or None}
+        """
+        equal = {}
+        if filters.get('node'):
+            equal['node'] = self._node_id(filters['node'])
+        if filters.get('channel'):
+            equal['channel'] = filters['channel']
+        since, until = self._time_bounds(filters)
+        text = (filters.get('text') or '').lower()
+
+        def match(msg):
+            return not text or text in msg.msg_text.lower()
+
+        rows, next_cursor = self.messages.query(equal, match, cursor, limit, since, until)
+        return {'rows': [MSGs.to_dict(seq, msg) for seq, msg in rows], 'next_cursor': next_cursor}
+
+    def search_messages(self, query, offset=0, limit=20):
+        return self.messages.search_msgs(query, offset, limit)
+
+    def add_msg(self, dt, mf, mto, ch, mtxt, id, thread=None, title=None, when=None):
+        """
+        thread / title: the conversation this message belongs to (see Threads), if any
+        when: when it arrived, if not just now (epoch seconds)
+        """
+        seq, msg = self.messages.add(dt, mf, mto, ch, mtxt, id, when)
+        if thread is not None:
+            self.threads.add(thread, title or thread, seq, msg)
         self.persist()
 
-    def add_pkt(self, pti, pf, ph, pr, pty, pi, pid):
-        self.packets.add(pti, pf, ph, pr, pty, pi, pid)
+    def get_threads(self):
+        return self.threads.get_threads()
+
+    def get_thread(self, key, cursor=None, limit=100):
+        return self.threads.get_thread(key, cursor, limit)
+
+    def mark_thread_read(self, key):
+        return self.threads.mark_read(key)
+
+    def add_pkt(self, pti, pf, ph, pr, pty, pi, pid, snr='', key=None, app='', channel='', when=None):
+        pkt = self.packets.add(pti, pf, ph, pr, pty, pi, pid, snr, app, channel, when)
+        if key in self.recent:
+            self.recent[key] = pkt
         self.persist()
 
+    def seen_packet(self, key, hops, rssi, snr):
+        """
+        Check a packet against the ones we've seen recently.  A rebroadcast copy is
+        folded into the original's row and True is returned, so it isn't handled again.
+
+        :param key: (from, packet id), or None for packets that can't be told apart
+        """
+        if key is None:
+            return False
+        if key not in self.recent:
+            self.recent[key] = None
+            while len(self.recent) > self.recent_limit:
+                self.recent.popitem(last=False)
+            return False
+
+        self.recent.move_to_end(key)
+        self.duplicates += 1
+        pkt = self.recent[key]
+        if pkt is not None:
+            pkt.add_copy(hops, rssi, snr)
+        return True
+
     def add_count(self, name):
         self.counts[name] = 1 + self.counts.get(name, 0)
         self.counts['Total'] = 1 + self.counts.get('Total', 0)
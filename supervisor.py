@@ -0,0 +1,223 @@
+"""
+Connection Supervisor for Meshtastic Monitor
+
+Keeps the connection to the radio up.  When meshtastic reports the connection
+lost, or the radio stops answering, the supervisor's own thread reconnects
+(never the thread that noticed, which is often meshtastic's reader thread),
+retrying with exponential backoff and jitter until it gets through.
+
+Liveness: every connection.heartbeat_interval seconds, if we haven't heard
+anything for a while, a heartbeat goes to the radio: an admin request for its
+metadata, which it answers itself (nothing goes out over the air).  Only the
+answer counts as hearing from it, since writes to a half-open TCP link still
+succeed.  If sending fails, or there's silence for connection.silence_timeout
+seconds (no packets and no answers), the connection is treated as lost.
+
+The state (connected / lost / waiting / reconnecting), its recent transitions,
+and reconnect latency and uptime figures are at /api/connection.
+"""
+
+import random
+import threading
+import time
+from collections import deque
+
+from config import Config
+
+
+class Supervisor:
+    """Singleton watching the Mesh connection"""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(Supervisor, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()     # Set when there's something for the thread to do
+        self.thread = None
+        self.state = 'disconnected'         # disconnected, connected, lost, waiting, reconnecting
+        self.reason = None
+        self.transitions = deque(maxlen=50)
+        self.attempt = 0                    # Failed reconnects since the connection was lost
+        self.next_attempt = None
+        self.last_heard = None
+        self.last_heartbeat = None
+
+        # Metrics
+        self.created = time.time()
+        self.connected_since = None
+        self.lost_at = None
+        self.connected_seconds = 0.0        # In connections that have ended
+        self.disconnects = 0
+        self.reconnects = 0
+        self.failed_attempts = 0
+        self.latencies = deque(maxlen=100)  # Seconds from losing the connection to having it back
+
+        self.apply_config(Config())
+        Config().subscribe(self.apply_config)
+        self._initialized = True
+
+    def apply_config(self, config):
+        self.backoff_initial = config.get('connection.backoff_initial', 1)
+        self.backoff_max = config.get('connection.backoff_max', 60)
+        self.heartbeat_interval = config.get('connection.heartbeat_interval', 60)
+        self.silence_timeout = config.get('connection.silence_timeout', 900)
+
+    def _set_state(self, state, reason=None):
+        # Caller holds the lock
+        if state == self.state:
+            return
+        print(f'Connection: {self.state} → {state}' + (f' ({reason})' if reason else ''), flush=True)
+        self.state = state
+        self.reason = reason
+        self.transitions.append({'state': state, 'at': time.time(), 'reason': reason})
+
+    def start(self):
+        """We're connected (Mesh is up): watch the connection from here on"""
+        now = time.time()
+        with self.lock:
+            if self.connected_since is None:
+                self.connected_since = now
+            self.last_heard = now
+            self._set_state('connected')
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, daemon=True)
+                self.thread.start()
+
+    def heard(self, packet=None):
+        """A packet came in (or a heartbeat was answered), so the link is alive"""
+        self.last_heard = time.time()
+
+    def connection_lost(self, reason='connection lost'):
+        """Note the connection is gone; the reconnecting happens on the supervisor's thread"""
+        with self.lock:
+            # Losing the old interface while we replace it is expected
+            if self.state != 'connected':
+                return
+            now = time.time()
+            self.disconnects += 1
+            self.lost_at = now
+            if self.connected_since is not None:
+                self.connected_seconds += now - self.connected_since
+                self.connected_since = None
+            self.attempt = 0
+            self.next_attempt = now
+            self._set_state('lost', reason)
+        self.wakeup.set()
+
+    def request_reconnect(self):
+        """Drop the connection and make a new one (e.g. from the API)"""
+        self.connection_lost('reconnect requested')
+
+    def backoff(self, attempt):
+        """Seconds to wait before reconnect attempt number `attempt` (0 = the first): exponential, with jitter"""
+        if attempt == 0:
+            return 0
+        delay = min(self.backoff_max, self.backoff_initial * 2 ** (attempt - 1))
+        # "Equal jitter": at least half the delay, so many monitors don't retry in lockstep
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _loop(self):
+        while True:
+            self.wakeup.wait(timeout=min(self.heartbeat_interval, 5))
+            self.wakeup.clear()
+            try:
+                if self.state == 'connected':
+                    self._check_liveness()
+                elif self.state in ('lost', 'waiting'):
+                    self._try_reconnect()
+            except Exception as e:
+                print(f'Connection supervisor error: {e}', flush=True)
+
+    def _check_liveness(self):
+        now = time.time()
+        silent = now - (self.last_heard or now)
+        if silent > self.silence_timeout:
+            self.connection_lost(f'nothing heard for {int(silent)}s')
+            return
+        from mesh import Mesh
+        connected = getattr(Mesh().node, 'isConnected', None)
+        if connected is not None and not connected.is_set():
+            self.connection_lost('interface disconnected')
+            return
+        # Only bother the radio when it's been quiet
+        if silent < self.heartbeat_interval or now - (self.last_heartbeat or 0) < self.heartbeat_interval:
+            return
+        self.last_heartbeat = now
+        try:
+            self.send_heartbeat(Mesh().node)
+        except Exception as e:
+            self.connection_lost(f'heartbeat failed: {e}')
+
+    def send_heartbeat(self, interface):
+        """Ask our own node for its metadata; heard() is called when it answers"""
+        from meshtastic.protobuf import admin_pb2, portnums_pb2
+        request = admin_pb2.AdminMessage(get_device_metadata_request=True)
+        interface.sendData(request, destinationId=interface.localNode.nodeNum, portNum=portnums_pb2.PortNum.ADMIN_APP,
+                           wantResponse=True, onResponse=self.heard)
+
+    def _try_reconnect(self):
+        if time.time() < self.next_attempt:
+            with self.lock:
+                self._set_state('waiting', self.reason)
+            self.wakeup.wait(timeout=self.next_attempt - time.time())
+            if time.time() < self.next_attempt:
+                return      # Woken early; go round again
+        with self.lock:
+            self._set_state('reconnecting', f'attempt {self.attempt + 1}')
+
+        from mesh import Mesh
+        try:
+            Mesh().reconnect()
+        except Exception as e:
+            with self.lock:
+                self.failed_attempts += 1
+                self.attempt += 1
+                self.next_attempt = time.time() + self.backoff(self.attempt)
+                self._set_state('waiting', f'attempt {self.attempt} failed: {e}')
+            return
+
+        now = time.time()
+        with self.lock:
+            self.reconnects += 1
+            self.latencies.append(now - self.lost_at)
+            self.connected_since = now
+            self.last_heard = now
+            self.attempt = 0
+            self._set_state('connected', 'reconnected')
+
+    def get_state(self):
+        now = time.time()
+        with self.lock:
+            uptime = now - self.connected_since if self.connected_since else 0
+            total = self.connected_seconds + uptime
+            latencies = sorted(self.latencies)
+            return {
+                'state': self.state,
+                'reason': self.reason,
+                'since': self.transitions[-1]['at'] if self.transitions else None,
+                'uptime': round(uptime, 1),
+                'availability': round(total / max(now - self.created, 1e-9), 4),
+                'last_heard': self.last_heard,
+                'attempt': self.attempt,
+                'next_attempt': self.next_attempt if self.state == 'waiting' else None,
+                'disconnects': self.disconnects,
+                'reconnects': self.reconnects,
+                'failed_attempts': self.failed_attempts,
+                'reconnect_latency': {
+                    'last': round(self.latencies[-1], 2) if latencies else None,
+                    'median': round(latencies[len(latencies) // 2], 2) if latencies else None,
+                    'max': round(latencies[-1], 2) if latencies else None
+                },
+                'transitions': list(self.transitions)[::-1]
+            }
+
+
+__all__ = ['Supervisor']
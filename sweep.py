@@ -0,0 +1,178 @@
+"""
+Traceroute Sweeps for Meshtastic Monitor
+
+Periodically traceroutes every node we know about (or a chosen few) so we have
+reachability data for the whole mesh, not just the nodes someone clicked on.
+Nodes that haven't been heard from lately, or are many hops away, go first.
+
+Sweeps share the channel with everyone else, so they are paced by an airtime
+budget: a token bucket of "seconds of airtime per hour" that each traceroute
+has to pay for (out and back, one packet per hop) before it is sent.
+"""
+
+import json
+import threading
+import time
+
+# noinspection PyPackageRequirements
+from pubsub import pub
+
+from airtime import Airtime, HEADER_BYTES, DATA_OVERHEAD
+from config import Config
+from mesh import Mesh
+from nodedata import NodeData
+from traceroute import Traceroutes
+
+# A traceroute request before any hops are added to it
+TRACEROUTE_BYTES = HEADER_BYTES + DATA_OVERHEAD + 8
+
+
+class Sweeper:
+    """Singleton that schedules traceroute sweeps and keeps their results"""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(Sweeper, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        config = Config()
+        self.enabled = config.get('sweep.enabled', False)
+        self.nodes = config.get('sweep.nodes', [])                     # empty means everyone
+        self.airtime_budget = config.get('sweep.airtime_budget', 36)    # seconds of airtime per hour
+        self.packet_airtime = config.get('sweep.packet_airtime', 0)     # seconds per packet, per hop (0 = estimate)
+        self.revisit = config.get('sweep.revisit', 3600)                # don't sweep a node more often than this
+        self.results_file = config.get('sweep.results_file', 'sweep_results.jsonl')
+
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.last_refill = time.time()
+        self.last_swept = {}    # node id -> when we last sent it a sweep traceroute
+        self.jobs = {}          # job id -> node id, for sweep traceroutes still in flight
+        self.results = {}       # node id -> latest sweep result
+        self.thread = None
+
+        pub.subscribe(self.on_traceroute_finished, 'mesher.traceroute.finished')
+        self._initialized = True
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+
+    def cost(self, hop_limit):
+        """Airtime (seconds) a traceroute will use: out and back, one transmission per hop"""
+        packet_airtime = self.packet_airtime
+        if not packet_airtime:
+            # The route grows by 4 bytes (node number) and 1 byte (SNR) for each hop it takes
+            packet_airtime = Airtime().estimate(TRACEROUTE_BYTES + 5 * hop_limit)
+        return 2 * (hop_limit + 1) * packet_airtime
+
+    def _refill(self):
+        now = time.time()
+        rate = self.airtime_budget / 3600
+        # Never bank more than ten minutes' worth (or one max-hop traceroute), so a quiet
+        # spell can't turn into a burst
+        capacity = max(self.airtime_budget / 6, self.cost(7))
+        self.tokens = min(capacity, self.tokens + (now - self.last_refill) * rate)
+        self.last_refill = now
+
+    def candidates(self):
+        """Nodes due for a sweep, most deserving first"""
+        now = time.time()
+        local_id = Mesh().nodenum
+        NodeData().refresh_data()
+        scored = []
+        for node in list(NodeData().data or []):
+            node_id = node['id']
+            if node_id == local_id or (self.nodes and node_id not in self.nodes):
+                continue
+            if now - self.last_swept.get(node_id, 0) < self.revisit:
+                continue
+            hops = node.get('hopsAway') or 0
+            heard_hours = (now - (node.get('lastHeard') or 0)) / 3600
+            # Stale nodes (capped at a day, so long-dead ones don't hog the sweep) and far ones first
+            scored.append((min(heard_hours, 24) + hops, node_id, hops))
+        scored.sort(reverse=True)
+        return [(node_id, hops) for score, node_id, hops in scored]
+
+    def _loop(self):
+        while True:
+            time.sleep(5)
+            if not self.enabled:
+                continue
+            try:
+                self.sweep_next()
+            except Exception as e:
+                print(f'Sweep error: {e}', flush=True)
+
+    def sweep_next(self):
+        """Send one traceroute if the budget allows it"""
+        with self.lock:
+            self._refill()
+            candidates = self.candidates()
+            if not candidates:
+                return None
+            node_id, hops = candidates[0]
+            hop_limit = min(7, max(hops + 1, 3))
+            cost = self.cost(hop_limit)
+            if self.tokens < cost:
+                return None
+
+            def track(job):
+                # Before the job can run: one that fails at once finishes before submit returns
+                self.jobs[job['id']] = node_id
+
+            job, err = Traceroutes().submit(int(node_id[1:], 16), hop_limit, on_queued=track)
+            # Either way, don't come straight back to this node
+            self.last_swept[node_id] = time.time()
+            if job is None:
+                return None
+            self.tokens -= cost
+            return job
+
+    def on_traceroute_finished(self, job):
+        node_id = self.jobs.pop(job['id'], None)
+        if node_id is None:
+            return      # Not one of ours
+        result = {
+            'node': node_id,
+            'time': job['completed'] or time.time(),
+            'status': job['status'],
+            'rtt': job['rtt'],
+            'hop_limit': job['hop_limit'],
+            'route': job['route'],
+            'snr': job['snr']
+        }
+        self.results[node_id] = result
+        if self.results_file:
+            with open(self.results_file, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+
+    def get_status(self):
+        with self.lock:
+            self._refill()
+            return {
+                'enabled': self.enabled,
+                'nodes': self.nodes,
+                'airtime_budget': self.airtime_budget,
+                'tokens': round(self.tokens, 1),
+                'in_flight': list(self.jobs.values()),
+                'results': sorted(self.results.values(), key=lambda r: r['time'], reverse=True)
+            }
+
+    def configure(self, enabled=None, nodes=None):
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if nodes is not None:
+            self.nodes = list(nodes)
+        if self.enabled:
+            self.start()
+
+
+__all__ = ['Sweeper']
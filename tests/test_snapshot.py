@@ -0,0 +1,158 @@
+"""
+Saving and loading the history (snapshot.py, Status.load_snapshot / snapshot_records)
+
+    python -m unittest discover tests
+"""
+
+import copyreg
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import snapshot
+import status
+from config import Config
+from status import MSG, PKT, Status
+
+CONFIG = """
+[data]
+persist_data = true
+max_messages = 3
+max_packets = 100
+max_channel_messages = 100
+max_dm_messages = 100
+message_retention = 0
+expire_interval = 3600
+
+[config]
+reload_interval = 0
+"""
+
+
+class PydanticRow:
+    """Pickles like a row did while PKT / MSG were pydantic models"""
+
+    def __init__(self, row):
+        self.row = row
+
+    # pickle checks __newobj__'s class against the object's
+    @property
+    def __class__(self):
+        return type(self.row)
+
+    def __reduce__(self):
+        fields = dict(vars(self.row))
+        return copyreg.__newobj__, (type(self.row),), {'__dict__': fields, '__pydantic_extra__': None,
+                                                       '__pydantic_fields_set__': set(fields),
+                                                       '__pydantic_private__': None}
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        with open('config.toml', 'w') as f:
+            f.write(CONFIG)
+        Config._instance = None
+        Status._instance = None
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+        Status._instance = None
+        Config._instance = None
+
+    @staticmethod
+    def reload():
+        """A fresh Status, as after a restart"""
+        Status._instance = None
+        return Status()
+
+    def fill(self, s):
+        for i in range(10):
+            s.add_pkt(f'2026-10-19 12:00:{i:02}', f'Node {i}', i % 4, -80 - i, 'Position', f'info {i}',
+                      f'!{i:08x}', snr=5.5, app='POSITION_APP', channel=i % 2, when=1760000000 + i)
+            s.add_count('Position')
+        for i in range(5):
+            s.add_msg(f'2026-10-19 12:01:{i:02}', f'Node {i}', '^all', 'LongFast', f'hello {i} ✓', f'!{i:08x}',
+                      thread='ch:LongFast', title='LongFast', when=1760000100 + i)
+        s.add_msg('2026-10-19 12:02:00', 'Node 1', 'Me', 'DM', 'psst', '!00000001', thread='dm:!00000001',
+                  title='Node 1', when=1760000200)
+        s.threads.mark_read('ch:LongFast')
+        s.persist(force=True)
+
+    @staticmethod
+    def rows(store):
+        return [(seq, when, vars(row)) for seq, when, row in store.snapshot()]
+
+    @staticmethod
+    def threads(s):
+        return {thread.key: (thread.title, thread.total, thread.read, thread.last_activity,
+                             [(seq, vars(msg)) for seq, msg in messages])
+                for thread, messages in s.threads.snapshot()}
+
+    def test_round_trip(self):
+        s = Status()
+        self.fill(s)
+        # Only the newest 3 messages are still in the store; the threads have kept the rest
+        self.assertEqual(len(s.messages), 3)
+        self.assertEqual(len(s.threads.threads['ch:LongFast'].messages), 5)
+        saved = (dict(s.counts), self.rows(s.packets), self.rows(s.messages), self.threads(s),
+                 s.packets.next_seq, s.messages.next_seq)
+
+        loaded = self.reload()
+        self.assertEqual((loaded.counts, self.rows(loaded.packets), self.rows(loaded.messages), self.threads(loaded),
+                          loaded.packets.next_seq, loaded.messages.next_seq), saved)
+        # Messages in both are shared, not copies, as when they were added
+        thread = loaded.threads.threads['ch:LongFast']
+        seq, msg = thread.messages[-1]
+        self.assertIs(loaded.messages.rows[seq], msg)
+        self.assertEqual(loaded.query_packets({'node': '!00000003'})['rows'][0]['information'], 'info 3')
+        self.assertEqual(loaded.search_messages('hello')['total'], 2)
+
+    def test_truncated(self):
+        s = Status()
+        self.fill(s)
+        packets = self.rows(s.packets)
+        size = os.path.getsize(status.SNAPSHOT_FILE)
+        with open(status.SNAPSHOT_FILE, 'r+b') as f:
+            f.truncate(size - 10)
+
+        with self.assertRaises(snapshot.SnapshotError):
+            list(snapshot.read(status.SNAPSHOT_FILE))
+
+        loaded = self.reload()
+        # Packets come before messages, so they were all read
+        self.assertEqual(self.rows(loaded.packets), packets)
+        self.assertFalse(os.path.exists(status.SNAPSHOT_FILE))
+        self.assertTrue(os.path.exists(status.SNAPSHOT_FILE + '.damaged'))
+
+    def test_legacy_pickle(self):
+        s = Status()
+        self.fill(s)
+        packets = self.rows(s.packets)
+        messages = self.rows(s.messages)
+        os.remove(status.SNAPSHOT_FILE)
+
+        # What an older version saved, with the rows as pydantic models
+        for store in (s.packets, s.messages):
+            store.rows = {seq: PydanticRow(row) for seq, row in store.rows.items()}
+        with open(status.LEGACY_FILE, 'wb') as f:
+            pickle.dump({'counts': s.counts, 'messages': s.messages, 'packets': s.packets}, f)
+
+        loaded = self.reload()
+        self.assertEqual(self.rows(loaded.packets), packets)
+        self.assertEqual(self.rows(loaded.messages), messages)
+        self.assertIsInstance(next(iter(loaded.packets.rows.values())), PKT)
+        self.assertIsInstance(next(iter(loaded.messages.rows.values())), MSG)
+        # Threads didn't exist yet, so they're started from the messages
+        self.assertEqual(len(loaded.threads.threads['ch:LongFast'].messages), 2)
+        self.assertEqual(loaded.search_messages('psst')['total'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
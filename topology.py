@@ -0,0 +1,209 @@
+"""
+Mesh Topology for Meshtastic Monitor
+
+An in-memory, undirected, weighted graph of the radio links we've seen, built
+up one packet at a time from traceroute routes (both directions) and
+NEIGHBORINFO_APP reports.  Each link remembers its SNR (smoothed), when it was
+last seen and how many times it has been observed.
+
+Queries work off the graph itself, never the packet history.  Critical relays
+(nodes whose loss would split the mesh) are only recomputed when the set of
+links changes, not every time a known link is seen again.
+"""
+
+import heapq
+import threading
+import time
+
+from config import Config
+
+# Traceroute SNRs are sent as int8 quarter-dB, with this meaning "unknown"
+UNKNOWN_SNR = -128
+
+
+class Topology:
+    """Singleton graph of observed links"""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(Topology, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        self.max_age = Config().get('topology.max_age', 3 * 24 * 3600)
+        self.lock = threading.Lock()
+        self.links = {}         # (node a, node b) with a < b -> {'snr', 'last_seen', 'count'}
+        self.adjacency = {}     # node -> set of neighbouring nodes
+        self._critical = None   # cached critical relays, None when the link set has changed
+        self._initialized = True
+
+    def add_link(self, a, b, snr=None, now=None):
+        if a == b:
+            return
+        now = now or time.time()
+        key = (a, b) if a < b else (b, a)
+        with self.lock:
+            link = self.links.get(key)
+            if link is None:
+                link = {'snr': snr, 'last_seen': now, 'count': 0}
+                self.links[key] = link
+                self.adjacency.setdefault(a, set()).add(b)
+                self.adjacency.setdefault(b, set()).add(a)
+                self._critical = None
+            elif snr is not None:
+                # Smooth, SNR jumps around a lot from one packet to the next
+                link['snr'] = snr if link['snr'] is None else round(0.7 * link['snr'] + 0.3 * snr, 2)
+            link['last_seen'] = now
+            link['count'] += 1
+
+    def add_path(self, path, snrs=None):
+        """Add each hop of a path; snrs[i] (quarter dB, as traceroutes send them) is for path[i] -> path[i+1]"""
+        snrs = snrs or []
+        for i in range(len(path) - 1):
+            snr = snrs[i] if i < len(snrs) and snrs[i] != UNKNOWN_SNR else None
+            self.add_link(path[i], path[i + 1], None if snr is None else snr / 4)
+
+    def add_traceroute(self, packet):
+        """Add the links from a TRACEROUTE_APP packet (a request on its way, or a reply)"""
+        decoded = packet.get('decoded', {})
+        traceroute = decoded.get('traceroute', {})
+        node_from = f'!{packet["from"]:08x}'
+        node_to = f'!{packet["to"]:08x}'
+        # A reply comes back from the target to whoever asked
+        if decoded.get('requestId'):
+            origin, target = node_to, node_from
+        else:
+            origin, target = node_from, node_to
+
+        route = [f'!{int(hop):08x}' for hop in traceroute.get('route', [])]
+        self.add_path([origin] + route + [target], traceroute.get('snrTowards'))
+
+        if 'routeBack' in traceroute or 'snrBack' in traceroute:
+            route_back = [f'!{int(hop):08x}' for hop in traceroute.get('routeBack', [])]
+            self.add_path([target] + route_back + [origin], traceroute.get('snrBack'))
+
+    def add_neighborinfo(self, packet):
+        """Add the links a node reports in a NEIGHBORINFO_APP packet"""
+        info = packet.get('decoded', {}).get('neighborinfo', {})
+        node = info.get('nodeId', packet['from'])
+        neighbors = info.get('neighbors', [])
+        for neighbor in neighbors:
+            self.add_link(f'!{node:08x}', f'!{neighbor["nodeId"]:08x}', neighbor.get('snr'))
+        return len(neighbors)
+
+    def _prune(self):
+        # Caller holds the lock
+        cutoff = time.time() - self.max_age
+        for key in [key for key, link in self.links.items() if link['last_seen'] < cutoff]:
+            del self.links[key]
+            a, b = key
+            self.adjacency[a].discard(b)
+            self.adjacency[b].discard(a)
+            for node in key:
+                if not self.adjacency[node]:
+                    del self.adjacency[node]
+            self._critical = None
+
+    def _link(self, a, b):
+        return self.links[(a, b) if a < b else (b, a)]
+
+    @staticmethod
+    def cost(link):
+        """Hop cost for path finding: every hop costs 1, weak links cost up to 1 more"""
+        if link['snr'] is None:
+            return 1.5
+        return 1 + min(1.0, max(0.0, (10 - link['snr']) / 30))
+
+    def get_adjacency(self):
+        with self.lock:
+            self._prune()
+            return {
+                node: [{'node': neighbor, **self._link(node, neighbor)} for neighbor in sorted(neighbors)]
+                for node, neighbors in self.adjacency.items()
+            }
+
+    def shortest_path(self, source, dest):
+        """Dijkstra over link costs; returns {'path', 'cost', 'hops'} or None"""
+        with self.lock:
+            self._prune()
+            if source not in self.adjacency or dest not in self.adjacency:
+                return None
+            best = {source: 0.0}
+            previous = {}
+            queue = [(0.0, source)]
+            while queue:
+                dist, node = heapq.heappop(queue)
+                if node == dest:
+                    break
+                if dist > best[node]:
+                    continue
+                for neighbor in self.adjacency[node]:
+                    candidate = dist + self.cost(self._link(node, neighbor))
+                    if candidate < best.get(neighbor, float('inf')):
+                        best[neighbor] = candidate
+                        previous[neighbor] = node
+                        heapq.heappush(queue, (candidate, neighbor))
+
+            if dest not in best:
+                return None
+            path = [dest]
+            while path[-1] != source:
+                path.append(previous[path[-1]])
+            path.reverse()
+            return {'path': path, 'cost': round(best[dest], 2), 'hops': len(path) - 1}
+
+    def critical_relays(self):
+        """Nodes whose loss would split the mesh (articulation points), busiest first"""
+        with self.lock:
+            self._prune()
+            if self._critical is None:
+                self._critical = self._articulation_points()
+            return [{'node': node, 'links': len(self.adjacency[node])} for node in self._critical]
+
+    def _articulation_points(self):
+        # Caller holds the lock.  Iterative Tarjan, so a long chain can't blow the stack.
+        index = {}
+        low = {}
+        points = set()
+        counter = 0
+        for root in self.adjacency:
+            if root in index:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            root_children = 0
+            stack = [(root, None, iter(self.adjacency[root]))]
+            while stack:
+                node, parent, neighbors = stack[-1]
+                advanced = False
+                for neighbor in neighbors:
+                    if neighbor == parent:
+                        continue
+                    if neighbor in index:
+                        low[node] = min(low[node], index[neighbor])
+                        continue
+                    index[neighbor] = low[neighbor] = counter
+                    counter += 1
+                    if node == root:
+                        root_children += 1
+                    stack.append((neighbor, node, iter(self.adjacency[neighbor])))
+                    advanced = True
+                    break
+                if advanced:
+                    continue
+                stack.pop()
+                if parent is not None:
+                    low[parent] = min(low[parent], low[node])
+                    if parent != root and low[node] >= index[parent]:
+                        points.add(parent)
+            if root_children > 1:
+                points.add(root)
+        return sorted(points, key=lambda node: len(self.adjacency[node]), reverse=True)
+
+
+__all__ = ['Topology']
@@ -0,0 +1,164 @@
+"""
+Traceroute Job Manager for Meshtastic Monitor
+
+Sending can block on the radio, so each request runs on a small, bounded pool
+of workers instead of a thread per click.  Every request becomes a job with an
+id the browser can poll.  The request is sent with sendData, rather than
+sendTraceRoute (which waits for the answer itself), so we know its packet id:
+when the TRACEROUTE_APP reply to it shows up in Message.handle_traceroute it is
+matched back to the job by that id, and the round trip time is recorded.  A job
+times out traceroute.timeout seconds after it was sent, not after it was queued.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# noinspection PyPackageRequirements
+from pubsub import pub
+
+from config import Config
+from mesh import Mesh
+
+
+class Traceroutes:
+    """Singleton that queues traceroutes and tracks them until they're answered"""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(Traceroutes, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        config = Config()
+        self.min_interval = config.get('traceroute.min_interval', 30)
+        self.timeout = config.get('traceroute.timeout', 120)
+        self.history = config.get('traceroute.history', 200)
+        self.executor = ThreadPoolExecutor(max_workers=config.get('traceroute.workers', 2))
+        self.lock = threading.RLock()  # re-entrant: 'finished' subscribers may look jobs up
+        self.jobs = OrderedDict()       # job id -> job, oldest first
+        self.waiting = {}               # destination node number -> id of the job waiting on it
+        self.last_sent = {}             # destination node number -> when we last asked
+        self._initialized = True
+
+    def submit(self, dest: int, hop_limit: int, channel_index: int = 0, on_queued=None):
+        """
+        Queue a traceroute
+
+        :param on_queued: function(job), called before the job can run (and so finish), for
+                          anyone who wants to recognise it in 'mesher.traceroute.finished'
+        :return: (job, None) or (None, reason it was refused)
+        """
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            if dest in self.waiting:
+                return None, 'A trace route to that node is already in progress'
+            since = now - self.last_sent.get(dest, 0)
+            if since < self.min_interval:
+                return None, f'Trace route to that node was sent {int(since)}s ago, try again in {int(self.min_interval - since)}s'
+
+            job = {
+                'id': str(uuid.uuid4())[:8],
+                'dest': f'!{dest:08x}',
+                'hop_limit': hop_limit,
+                'channel': channel_index,
+                'status': 'queued',
+                'created': now,
+                'sent': None,
+                'request_id': None,     # Packet id of the request, which the reply gives as its requestId
+                'completed': None,
+                'rtt': None,
+                'route': None,
+                'snr': None,
+                'error': None
+            }
+            self.jobs[job['id']] = job
+            self.waiting[dest] = job['id']
+            self.last_sent[dest] = now
+            while len(self.jobs) > self.history:
+                self.jobs.popitem(last=False)
+            if on_queued is not None:
+                on_queued(job)
+
+        self.executor.submit(self._run, job, dest)
+        return job, None
+
+    def _run(self, job, dest):
+        from meshtastic.protobuf import mesh_pb2, portnums_pb2
+
+        with self.lock:
+            if job['status'] != 'queued':
+                return      # Finished while it waited for a worker
+            job['status'] = 'sent'
+            job['sent'] = time.time()
+        try:
+            print(f'Sending traceroute ({job["dest"]} {job["hop_limit"]} {job["channel"]})', flush=True)
+            packet = Mesh().node.sendData(mesh_pb2.RouteDiscovery(), destinationId=dest,
+                                          portNum=portnums_pb2.PortNum.TRACEROUTE_APP, wantResponse=True,
+                                          channelIndex=job['channel'], hopLimit=job['hop_limit'])
+            with self.lock:
+                job['request_id'] = getattr(packet, 'id', None) or None
+        except Exception as e:
+            with self.lock:
+                if job['status'] == 'sent':
+                    self._finish(job, dest, 'failed', error=str(e))
+
+    def complete(self, from_num: int, request_id: int, route: list, snr: list = None):
+        """
+        Match a traceroute reply (sent to us, answering request_id) to the job waiting for it
+
+        :return: the finished job, or None if nobody was waiting for this reply
+        """
+        now = time.time()
+        with self.lock:
+            job_id = self.waiting.get(from_num)
+            job = self.jobs.get(job_id)
+            if job is None or job['status'] != 'sent':
+                return None
+            if job['request_id'] is not None and job['request_id'] != request_id:
+                return None     # An answer to some other request
+            job['completed'] = now
+            job['rtt'] = round(now - (job['sent'] or job['created']), 2)
+            job['route'] = route
+            job['snr'] = snr
+            self._finish(job, from_num, 'done')
+            return job
+
+    def _finish(self, job, dest, status, error=None):
+        # Caller holds the lock
+        job['status'] = status
+        job['error'] = error
+        if self.waiting.get(dest) == job['id']:
+            del self.waiting[dest]
+        pub.sendMessage('mesher.traceroute.finished', job=job)
+
+    def _expire(self, now):
+        # Caller holds the lock
+        for dest, job_id in list(self.waiting.items()):
+            job = self.jobs.get(job_id)
+            if job is None:
+                del self.waiting[dest]
+            elif job['sent'] is not None and now - job['sent'] > self.timeout:
+                self._finish(job, dest, 'timeout', error=f'No reply after {self.timeout}s')
+
+    def get_job(self, job_id):
+        with self.lock:
+            self._expire(time.time())
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def get_jobs(self, rowmax=50):
+        with self.lock:
+            self._expire(time.time())
+            return [dict(job) for job in reversed(self.jobs.values())][:rowmax]
+
+
+__all__ = ['Traceroutes']
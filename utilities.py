@@ -1,6 +1,5 @@
 from datetime import datetime
 import time
-from geopy.distance import geodesic
 from config import Config
 
 def calculate_distance(coord1, coord2=None):
@@ -13,6 +12,8 @@ def calculate_distance(coord1, coord2=None):
     if not any([coord1[0], coord1[1], coord2[0], coord2[1]]):
         return -1
 
+    # geopy is slow to import and only needed once there are positions to compare
+    from geopy.distance import geodesic
     return geodesic(coord1, coord2).km
 
 def get_datestamp():